@@ -1,7 +1,8 @@
 # bot.py - полный исправленный код
 import os
 import logging
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, time, timezone
+from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -9,14 +10,45 @@ from telegram.ext import (
     CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters
 )
 import threading
 import time as time_module
 
 # Импортируем наши модули
-from database import db
-from notifications import send_reminder_notifications
+from database import db, async_db, AUDIENCE_SEGMENTS
+from notifications import (
+    send_reminder_notifications,
+    catch_up_notifications_job,
+    build_send_plan_job,
+    deliver_outbox_job,
+    refresh_notification_slots_job,
+    expire_premium_job,
+    advance_recurring_job,
+    reconcile_statistics_job,
+    load_exact_alerts_job,
+    exact_alerts_job,
+    track_exact_alert,
+    untrack_exact_alert
+)
+from broadcast import (
+    start_broadcast,
+    pause_broadcast,
+    resume_broadcast,
+    cancel_broadcast,
+    is_broadcast_running,
+    resume_broadcasts_job,
+    broadcast_keyboard,
+    format_broadcast_report,
+    format_audience,
+    with_broadcast_header,
+    create_broadcast,
+    TextPayload,
+    PhotoPayload,
+    DocumentPayload,
+    MediaGroupPayload
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,6 +56,8 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# Тик точных напоминаний выполняется каждую секунду - не пишем каждый запуск задачи в лог
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
 
 # Получаем токен
 TOKEN = os.getenv('TELEGRAM_TOKEN')
@@ -43,6 +77,17 @@ except Exception as e:
 
 # Константы
 FREE_LIMIT = 5
+
+# Сегменты аудитории в меню рассылки: (сегмент, дни)
+BROADCAST_SEGMENTS = [
+    ('all', None),
+    ('premium', None),
+    ('premium_expiring', 7),
+    ('free_at_limit', None),
+    ('due_this_week', None),
+    ('inactive', 30),
+]
+ADMIN_USERS_PAGE_SIZE = 15
 PREMIUM_PRICES = {
     '1': {'amount': 299, 'days': 30, 'text': '1 месяц'},
     '3': {'amount': 799, 'days': 90, 'text': '3 месяца'},
@@ -97,26 +142,49 @@ def start_keep_alive():
             pass
         time_module.sleep(300)
 
-# ========== ГЛАВНОЕ МЕНЮ ==========
+# ========== ПРОФИЛЬ ПОЛЬЗОВАТЕЛЯ ==========
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда /start - главное меню"""
+async def load_user_profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пре-обработчик (группа -1): снимок профиля пользователя в context.profile.
+
+    Один запрос к БД на обновление - регистрация, премиум и счетчики напоминаний.
+    """
     user = update.effective_user
-    
-    try:
-        # Регистрируем пользователя
-        user_id = db.get_or_create_user(
+    context.profile = None
+    if user:
+        context.profile = await async_db.get_user_profile(
             telegram_id=user.id,
             username=user.username,
             first_name=user.first_name,
             last_name=user.last_name
         )
-        
-        # Получаем данные пользователя
-        premium_status = db.get_user_premium_status(user_id) if user_id else {'has_active_premium': False}
-        reminders_count = db.get_user_reminders_count(user_id) if user_id else 0
-        
-        has_premium = premium_status.get('has_active_premium', False)
+
+async def user_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Снимок профиля текущего обновления (если пре-обработчик не отработал - запрос к БД)"""
+    profile = getattr(context, 'profile', None)
+    if profile is None:
+        user = update.effective_user
+        profile = await async_db.get_user_profile(
+            telegram_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        context.profile = profile
+    return profile
+
+# ========== ГЛАВНОЕ МЕНЮ ==========
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /start - главное меню"""
+    user = update.effective_user
+    
+    try:
+        # Пользователь уже зарегистрирован пре-обработчиком - берем снимок профиля
+        profile = await user_profile(update, context) or {}
+        reminders_count = profile.get('reminders_count', 0)
+        reminders_total = profile.get('reminders_total', 0)
+        has_premium = profile.get('has_premium', False)
         
         # Создаем клавиатуру
         keyboard = [
@@ -144,6 +212,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Привет, {user.first_name}! Как твои дела?🙂\n\n"
             f"<b>Ваша статистика:</b>\n"
             f"📊 Напоминаний: {reminders_count}/{limit_text}\n"
+            f"💰 На сумму: {reminders_total:.2f}₽\n"
             f"💎 Статус: {premium_text}\n\n"
             f"<b>Ваши возможности:</b>\n"
             f"• {'♾️ Неограниченные' if has_premium else f'До {FREE_LIMIT}'} напоминаний\n"
@@ -172,7 +241,7 @@ async def list_command_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     
     try:
-        user_id = db.get_or_create_user(
+        user_id = await async_db.get_or_create_user(
             telegram_id=user.id,
             username=user.username,
             first_name=user.first_name,
@@ -184,7 +253,7 @@ async def list_command_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             return
         
         # Получаем напоминания
-        reminders = db.get_user_reminders(user_id)
+        reminders = await async_db.get_user_reminders(user_id)
         
         if not reminders:
             keyboard = [
@@ -225,7 +294,12 @@ async def list_command_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             
             message += f"{i}. <b>{rem.get('title', 'Без названия')}</b>\n"
             message += f"   💰 {amount}₽\n"
-            message += f"   📅 {formatted_date}\n\n"
+            if rem.get('remind_time'):
+                formatted_date += f" ⏰ {rem['remind_time']}"
+            message += f"   📅 {formatted_date}\n"
+            if rem.get('recurrence'):
+                message += f"   🔄 {format_recurrence(rem['recurrence'], rem.get('recurrence_interval'))}\n"
+            message += "\n"
         
         message += f"<b>📊 Итого:</b> {len(reminders)} напоминаний на сумму {total_amount:.2f}₽\n"
         
@@ -262,23 +336,17 @@ async def premium_command_handler(update: Update, context: ContextTypes.DEFAULT_
     user = update.effective_user
     
     try:
-        user_id = db.get_or_create_user(
-            telegram_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        profile = await user_profile(update, context)
         
-        if not user_id:
+        if not profile:
             await update.message.reply_text("❌ Ошибка базы данных.")
             return
         
         # Получаем статус
-        premium_status = db.get_user_premium_status(user_id)
-        has_premium = premium_status.get('has_active_premium', False) if premium_status else False
+        has_premium = profile['has_premium']
         
         if has_premium:
-            until_date = premium_status.get('premium_until')
+            until_date = profile['premium_until']
             if until_date:
                 until_str = until_date.strftime('%d.%m.%Y') if hasattr(until_date, 'strftime') else str(until_date)
                 message = f"💎 <b>У ВАС АКТИВНА ПРЕМИУМ ПОДПИСКА!</b>\n\nДействует до: <b>{until_str}</b>"
@@ -329,32 +397,12 @@ async def buy_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def status_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /status"""
     try:
-        # Получаем статистику напрямую из базы
-        conn = db.get_connection()
-        if not conn:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        
-        # Количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        
-        # Количество премиум пользователей
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-        premium_users = cursor.fetchone()[0] or 0
-        
-        # Общее количество напоминаний
-        cursor.execute("SELECT COUNT(*) FROM reminders")
-        total_reminders = cursor.fetchone()[0] or 0
-        
-        # Активные напоминания (с датой в будущем или сегодня)
-        today = datetime.now().date().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) FROM reminders WHERE payment_date >= ?", (today,))
-        active_reminders = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        # Получаем статистику в отдельном потоке, не блокируя остальных пользователей
+        stats = await async_db.get_statistics()
+        total_users = stats['total_users']
+        premium_users = stats['premium_users']
+        total_reminders = stats['total_reminders']
+        active_reminders = stats['active_reminders']
         
         message = (
             f"📊 <b>СТАТУС БОТА</b>\n\n"
@@ -373,6 +421,68 @@ async def status_command_handler(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Ошибка в команде /status: {e}")
         await update.message.reply_text(f"❌ Ошибка получения статистики: {str(e)[:100]}")
 
+async def notify_time_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /notify_time - время ежедневных уведомлений"""
+    user = update.effective_user
+    
+    try:
+        user_id = await async_db.get_or_create_user(
+            telegram_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        
+        if not user_id:
+            await update.message.reply_text("❌ Ошибка базы данных.")
+            return
+        
+        if not context.args:
+            current = await async_db.get_notification_time(user_id)
+            await update.message.reply_text(
+                f"⏰ <b>ВРЕМЯ УВЕДОМЛЕНИЙ</b>\n\n"
+                f"Сейчас: каждый день в {current['notify_hour']:02d}:00 ({current['timezone']})\n\n"
+                f"<b>Изменить:</b> <code>/notify_time &lt;час&gt; [часовой пояс]</code>\n\n"
+                f"<b>Примеры:</b>\n"
+                f"<code>/notify_time 9</code>\n"
+                f"<code>/notify_time 20 Asia/Yekaterinburg</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        try:
+            notify_hour = int(context.args[0])
+            if not 0 <= notify_hour <= 23:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("❌ Час должен быть числом от 0 до 23.")
+            return
+        
+        user_timezone = context.args[1] if len(context.args) > 1 else None
+        if user_timezone:
+            try:
+                ZoneInfo(user_timezone)
+            except Exception:
+                await update.message.reply_text(
+                    "❌ Неизвестный часовой пояс.\n"
+                    "Пример: <code>Europe/Moscow</code>, <code>Asia/Novosibirsk</code>",
+                    parse_mode='HTML'
+                )
+                return
+        
+        if await async_db.set_notification_time(user_id, notify_hour, user_timezone):
+            current = await async_db.get_notification_time(user_id)
+            await update.message.reply_text(
+                f"✅ Уведомления будут приходить каждый день в "
+                f"{current['notify_hour']:02d}:00 ({current['timezone']})"
+            )
+        else:
+            await update.message.reply_text("❌ Не удалось изменить время уведомлений.")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /notify_time: {e}")
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
 async def help_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /help"""
     keyboard = [[InlineKeyboardButton("🔙 В меню", callback_data="start_menu")]]
@@ -387,9 +497,10 @@ async def help_command_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         "• /premium — премиум подписка\n"
         "• /buy — купить премиум\n"
         "• /status — статус бота\n"
+        "• /notify_time — время уведомлений\n"
         "• /help — эта справка\n\n"
         f"<b>Бесплатный лимит:</b> {FREE_LIMIT} напоминаний\n"
-        "<b>Уведомления:</b> каждый день в 10:00 по Москве\n\n"
+        "<b>Уведомления:</b> каждый день в 10:00 по Москве (можно изменить: /notify_time)\n\n"
         "<i>По вопросам обращайтесь к администратору</i>\n"
         "Почта администратора для связи: planexgame@gmail.com",
         reply_markup=reply_markup,
@@ -401,23 +512,18 @@ async def new_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     
     try:
-        user_id = db.get_or_create_user(
-            telegram_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        profile = await user_profile(update, context)
         
-        if not user_id:
+        if not profile:
             await update.message.reply_text("❌ Ошибка базы данных.")
             return
         
         # Проверяем лимиты
-        premium_status = db.get_user_premium_status(user_id)
-        has_premium = premium_status.get('has_active_premium', False) if premium_status else False
+        user_id = profile['id']
+        has_premium = profile['has_premium']
         
         if not has_premium:
-            reminders_count = db.get_user_reminders_count(user_id)
+            reminders_count = profile['reminders_count']
             if reminders_count >= FREE_LIMIT:
                 keyboard = [
                     [InlineKeyboardButton("💎 Купить премиум", callback_data="buy_premium")],
@@ -438,6 +544,7 @@ async def new_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data['creating_reminder'] = True
         context.user_data['step'] = 'title'
         context.user_data['user_id'] = user_id
+        context.user_data['has_premium'] = has_premium
         
         keyboard = [[InlineKeyboardButton("❌ Отменить", callback_data="start_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -466,27 +573,11 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     try:
-        # Получаем статистику напрямую
-        conn = db.get_connection()
-        if not conn:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        
-        # Количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        
-        # Количество премиум пользователей
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-        premium_users = cursor.fetchone()[0] or 0
-        
-        # Общее количество напоминаний
-        cursor.execute("SELECT COUNT(*) FROM reminders")
-        total_reminders = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        # Получаем статистику в отдельном потоке, не блокируя остальных пользователей
+        stats = await async_db.get_statistics()
+        total_users = stats['total_users']
+        premium_users = stats['premium_users']
+        total_reminders = stats['total_reminders']
     
         keyboard = [
             [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
@@ -536,39 +627,32 @@ async def admin_activate_command_handler(update: Update, context: ContextTypes.D
         days = int(context.args[1])
         
         # Получаем пользователя по telegram_id
-        conn = db.get_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, username FROM users WHERE telegram_id = ?", (user_id_to_activate,))
-            result = cursor.fetchone()
-            
-            if result:
-                internal_user_id = result[0]
-                username = result[1]
-                if db.activate_premium(internal_user_id, days):
-                    # Уведомляем пользователя
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id_to_activate,
-                            text=f"🎉 <b>ВАШ ПРЕМИУМ АКТИВИРОВАН!</b>\n\n"
-                                 f"Администратор активировал вам премиум подписку на {days} дней.\n"
-                                 f"Теперь у вас есть неограниченные напоминания и расширенные уведомления! 💎",
-                            parse_mode='HTML'
-                        )
-                    except:
-                        pass
-                    
-                    username_display = f"@{username}" if username else f"ID:{user_id_to_activate}"
-                    await update.message.reply_text(
-                        f"✅ Премиум активирован для {username_display} на {days} дней."
+        user_row = await async_db.get_user_by_telegram_id(user_id_to_activate)
+        
+        if user_row:
+            internal_user_id = user_row['id']
+            username = user_row['username']
+            if await async_db.activate_premium(internal_user_id, days):
+                # Уведомляем пользователя
+                try:
+                    await context.bot.send_message(
+                        chat_id=user_id_to_activate,
+                        text=f"🎉 <b>ВАШ ПРЕМИУМ АКТИВИРОВАН!</b>\n\n"
+                             f"Администратор активировал вам премиум подписку на {days} дней.\n"
+                             f"Теперь у вас есть неограниченные напоминания и расширенные уведомления! 💎",
+                        parse_mode='HTML'
                     )
-                else:
-                    await update.message.reply_text("❌ Ошибка активации премиума.")
+                except:
+                    pass
+                
+                username_display = f"@{username}" if username else f"ID:{user_id_to_activate}"
+                await update.message.reply_text(
+                    f"✅ Премиум активирован для {username_display} на {days} дней."
+                )
             else:
-                await update.message.reply_text("❌ Пользователь не найден.")
-            conn.close()
+                await update.message.reply_text("❌ Ошибка активации премиума.")
         else:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
+            await update.message.reply_text("❌ Пользователь не найден.")
     except Exception as e:
         logger.error(f"Ошибка в admin_activate: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
@@ -594,39 +678,32 @@ async def admin_activate_username_command_handler(update: Update, context: Conte
         days = int(context.args[1])
         
         # Получаем пользователя по username
-        conn = db.get_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, telegram_id FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
+        user_row = await async_db.get_user_by_username(username)
+        
+        if user_row:
+            internal_user_id = user_row['id']
+            telegram_id = user_row['telegram_id']
             
-            if result:
-                internal_user_id = result[0]
-                telegram_id = result[1]
-                
-                if db.activate_premium(internal_user_id, days):
-                    # Уведомляем пользователя
-                    try:
-                        await context.bot.send_message(
-                            chat_id=telegram_id,
-                            text=f"🎉 <b>ВАШ ПРЕМИУМ АКТИВИРОВАН!</b>\n\n"
-                                 f"Администратор активировал вам премиум подписку на {days} дней.\n"
-                                 f"Теперь у вас есть неограниченные напоминания и расширенные уведомления! 💎",
-                            parse_mode='HTML'
-                        )
-                    except:
-                        pass
-                    
-                    await update.message.reply_text(
-                        f"✅ Премиум активирован для @{username} на {days} дней."
+            if await async_db.activate_premium(internal_user_id, days):
+                # Уведомляем пользователя
+                try:
+                    await context.bot.send_message(
+                        chat_id=telegram_id,
+                        text=f"🎉 <b>ВАШ ПРЕМИУМ АКТИВИРОВАН!</b>\n\n"
+                             f"Администратор активировал вам премиум подписку на {days} дней.\n"
+                             f"Теперь у вас есть неограниченные напоминания и расширенные уведомления! 💎",
+                        parse_mode='HTML'
                     )
-                else:
-                    await update.message.reply_text("❌ Ошибка активации премиума.")
+                except:
+                    pass
+                
+                await update.message.reply_text(
+                    f"✅ Премиум активирован для @{username} на {days} дней."
+                )
             else:
-                await update.message.reply_text(f"❌ Пользователь с username @{username} не найден.")
-            conn.close()
+                await update.message.reply_text("❌ Ошибка активации премиума.")
         else:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
+            await update.message.reply_text(f"❌ Пользователь с username @{username} не найден.")
     except Exception as e:
         logger.error(f"Ошибка в admin_activate_username: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
@@ -650,27 +727,20 @@ async def admin_deactivate_command_handler(update: Update, context: ContextTypes
         user_id_to_deactivate = int(context.args[0])
         
         # Получаем пользователя по telegram_id
-        conn = db.get_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, username FROM users WHERE telegram_id = ?", (user_id_to_deactivate,))
-            result = cursor.fetchone()
-            
-            if result:
-                internal_user_id = result[0]
-                username = result[1]
-                if db.deactivate_premium(internal_user_id):
-                    username_display = f"@{username}" if username else f"ID:{user_id_to_deactivate}"
-                    await update.message.reply_text(
-                        f"✅ Премиум деактивирован для {username_display}."
-                    )
-                else:
-                    await update.message.reply_text("❌ Ошибка деактивации премиума.")
+        user_row = await async_db.get_user_by_telegram_id(user_id_to_deactivate)
+        
+        if user_row:
+            internal_user_id = user_row['id']
+            username = user_row['username']
+            if await async_db.deactivate_premium(internal_user_id):
+                username_display = f"@{username}" if username else f"ID:{user_id_to_deactivate}"
+                await update.message.reply_text(
+                    f"✅ Премиум деактивирован для {username_display}."
+                )
             else:
-                await update.message.reply_text("❌ Пользователь не найден.")
-            conn.close()
+                await update.message.reply_text("❌ Ошибка деактивации премиума.")
         else:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
+            await update.message.reply_text("❌ Пользователь не найден.")
     except Exception as e:
         logger.error(f"Ошибка в admin_deactivate: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
@@ -695,31 +765,56 @@ async def admin_deactivate_username_command_handler(update: Update, context: Con
         username = context.args[0].lstrip('@')  # Убираем @ если есть
         
         # Получаем пользователя по username
-        conn = db.get_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, telegram_id FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
+        user_row = await async_db.get_user_by_username(username)
+        
+        if user_row:
+            internal_user_id = user_row['id']
+            telegram_id = user_row['telegram_id']
             
-            if result:
-                internal_user_id = result[0]
-                telegram_id = result[1]
-                
-                if db.deactivate_premium(internal_user_id):
-                    await update.message.reply_text(
-                        f"✅ Премиум деактивирован для @{username}."
-                    )
-                else:
-                    await update.message.reply_text("❌ Ошибка деактивации премиума.")
+            if await async_db.deactivate_premium(internal_user_id):
+                await update.message.reply_text(
+                    f"✅ Премиум деактивирован для @{username}."
+                )
             else:
-                await update.message.reply_text(f"❌ Пользователь с username @{username} не найден.")
-            conn.close()
+                await update.message.reply_text("❌ Ошибка деактивации премиума.")
         else:
-            await update.message.reply_text("❌ Ошибка подключения к базе данных.")
+            await update.message.reply_text(f"❌ Пользователь с username @{username} не найден.")
     except Exception as e:
         logger.error(f"Ошибка в admin_deactivate_username: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
 
+async def admin_find_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /admin_find - поиск пользователей по началу username"""
+    user = update.effective_user
+    
+    if user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Команда только для администратора.")
+        return
+    
+    if not context.args:
+        await update.message.reply_text(
+            "Использование: /admin_find <начало username>\n\n"
+            "Пример: /admin_find ivan"
+        )
+        return
+    
+    try:
+        prefix = context.args[0].lstrip('@')  # Убираем @ если есть
+        users = await async_db.search_users_by_username(prefix, limit=ADMIN_USERS_PAGE_SIZE)
+        
+        if not users:
+            await update.message.reply_text(f"❌ Пользователи с username на @{prefix} не найдены.")
+            return
+        
+        message = f"🔍 <b>ПОИСК: @{prefix}…</b>\n\n"
+        for u in users:
+            message += format_admin_user_line(u)
+        
+        await update.message.reply_text(message, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Ошибка в admin_find: {e}")
+        await update.message.reply_text(f"❌ Ошибка: {e}")
+
 async def broadcast_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /broadcast"""
     user = update.effective_user
@@ -748,13 +843,16 @@ async def broadcast_command_handler(update: Update, context: ContextTypes.DEFAUL
             InlineKeyboardButton("📢 Всем пользователям", callback_data="broadcast_all"),
             InlineKeyboardButton("💎 Только премиум", callback_data="broadcast_premium_only")
         ],
+        [
+            InlineKeyboardButton("🎯 Выбрать сегмент", callback_data="broadcast_segments")
+        ],
         [
             InlineKeyboardButton("❌ Отмена", callback_data="admin_panel")
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    context.user_data['broadcast_message'] = message_text
+    context.user_data['broadcast_payload'] = TextPayload(with_broadcast_header(message_text))
     
     await update.message.reply_text(
         f"📢 <b>ПОДТВЕРЖДЕНИЕ РАССЫЛКИ</b>\n\n"
@@ -794,7 +892,7 @@ async def broadcast_premium_command_handler(update: Update, context: ContextType
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    context.user_data['broadcast_message'] = message_text
+    context.user_data['broadcast_payload'] = TextPayload(with_broadcast_header(message_text))
     
     await update.message.reply_text(
         f"📢 <b>РАССЫЛКА ПРЕМИУМ ПОЛЬЗОВАТЕЛЯМ</b>\n\n"
@@ -890,39 +988,96 @@ async def broadcast_test_full_command_handler(update: Update, context: ContextTy
         logger.error(f"Ошибка тестовой рассылки: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
 
-async def broadcast_photo_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда /broadcast_photo - рассылка фото"""
+# Сколько последних альбомов администратора помнить для /broadcast_media
+MEDIA_GROUPS_LIMIT = 20
+
+def message_media(message):
+    """(тип, file_id) вложения сообщения: фото, видео или документ; иначе None"""
+    if message.photo:
+        return 'photo', message.photo[-1].file_id
+    if message.video:
+        return 'video', message.video.file_id
+    if message.document:
+        return 'document', message.document.file_id
+    return None
+
+async def remember_admin_media_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запомнить элементы альбомов администратора.
+
+    Telegram присылает альбом отдельными сообщениями, а ответить командой
+    можно только на одно из них - остальные берутся отсюда.
+    """
+    message = update.message
+    if not message or not message.media_group_id:
+        return
+    media = message_media(message)
+    if not media:
+        return
+    
+    groups = context.bot_data.setdefault('media_groups', {})
+    groups.setdefault(message.media_group_id, {})[message.message_id] = media
+    while len(groups) > MEDIA_GROUPS_LIMIT:
+        groups.pop(next(iter(groups)))
+
+async def broadcast_media_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команды /broadcast_media и /broadcast_photo - рассылка фото, документа или альбома"""
     user = update.effective_user
     
     if user.id != ADMIN_ID:
         await update.message.reply_text("❌ Команда только для администратора.")
         return
     
-    if not update.message.reply_to_message or not update.message.reply_to_message.photo:
+    source = update.message.reply_to_message
+    media = message_media(source) if source else None
+    if not media or (media[0] == 'video' and not source.media_group_id):
         await update.message.reply_text(
-            "Для рассылки фото:\n"
-            "1. Отправьте фото в чат\n"
-            "2. Ответьте на фото командой /broadcast_photo\n"
+            "Для рассылки фото, документа или альбома:\n"
+            "1. Отправьте фото, файл или альбом в чат\n"
+            "2. Ответьте на него (на любой элемент альбома) командой /broadcast_media\n"
             "3. Добавьте подпись к команде если нужно\n\n"
-            "Пример: /broadcast_photo Новое обновление!"
+            "Пример: /broadcast_media Новое обновление!"
         )
         return
     
-    # Сохраняем оригинальный текст с переносами строк
-    if update.message.text:
-        # Убираем команду из текста
-        command_text = update.message.text
-        if command_text.startswith('/broadcast_photo '):
-            caption = command_text[len('/broadcast_photo '):]
-        else:
-            caption = ""
+    # Подпись - текст после команды, с сохранением переносов строк
+    parts = update.message.text.split(None, 1) if update.message.text else []
+    caption = parts[1] if len(parts) > 1 else ""
+    full_caption = with_broadcast_header(caption)
+    
+    if source.media_group_id:
+        items = context.bot_data.get('media_groups', {}).get(source.media_group_id)
+        if not items:
+            await update.message.reply_text(
+                "❌ Альбом не найден (возможно, бот перезапускался).\n"
+                "Отправьте альбом заново и ответьте на любой его элемент."
+            )
+            return
+        try:
+            payload = MediaGroupPayload(
+                [{'type': kind, 'media': file_id} for _, (kind, file_id) in sorted(items.items())],
+                caption=full_caption
+            )
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Telegram не отправляет документы в одном альбоме с фото и видео.\n"
+                "Разделите их на отдельные альбомы."
+            )
+            return
+        description = f"альбом, {len(items)} {plural(len(items), 'файл', 'файла', 'файлов')}"
+    elif media[0] == 'document':
+        payload = DocumentPayload(media[1], caption=full_caption)
+        description = "документ"
     else:
-        caption = ""
+        payload = PhotoPayload(media[1], caption=full_caption)
+        description = "фото"
     
     keyboard = [
         [
-            InlineKeyboardButton("📢 Всем с фото", callback_data="broadcast_all_photo"),
-            InlineKeyboardButton("💎 Премиум с фото", callback_data="broadcast_premium_photo")
+            InlineKeyboardButton("📢 Всем", callback_data="broadcast_all_photo"),
+            InlineKeyboardButton("💎 Только премиум", callback_data="broadcast_premium_photo")
+        ],
+        [
+            InlineKeyboardButton("🎯 Выбрать сегмент", callback_data="broadcast_segments")
         ],
         [
             InlineKeyboardButton("❌ Отмена", callback_data="admin_panel")
@@ -930,12 +1085,11 @@ async def broadcast_photo_command_handler(update: Update, context: ContextTypes.
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # Сохраняем информацию о фото
-    context.user_data['broadcast_photo'] = update.message.reply_to_message.photo[-1].file_id
-    context.user_data['broadcast_caption'] = caption
+    context.user_data['broadcast_payload'] = payload
     
     await update.message.reply_text(
-        f"🖼️ <b>РАССЫЛКА ФОТО</b>\n\n"
+        f"🖼️ <b>{payload.title}</b>\n\n"
+        f"<b>Содержимое:</b> {description}\n"
         f"<b>Подпись:</b>\n{caption if caption else 'Без подписи'}\n\n"
         f"<b>Выберите аудиторию:</b>",
         reply_markup=reply_markup,
@@ -1002,23 +1156,18 @@ async def start_new_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = query.from_user
     
     try:
-        user_id = db.get_or_create_user(
-            telegram_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        profile = await user_profile(update, context)
         
-        if not user_id:
+        if not profile:
             await query.edit_message_text("❌ Ошибка базы данных.")
             return
         
         # Проверяем лимиты
-        premium_status = db.get_user_premium_status(user_id)
-        has_premium = premium_status.get('has_active_premium', False) if premium_status else False
+        user_id = profile['id']
+        has_premium = profile['has_premium']
         
         if not has_premium:
-            reminders_count = db.get_user_reminders_count(user_id)
+            reminders_count = profile['reminders_count']
             if reminders_count >= FREE_LIMIT:
                 keyboard = [
                     [InlineKeyboardButton("💎 Купить премиум", callback_data="buy_premium")],
@@ -1039,6 +1188,7 @@ async def start_new_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data['creating_reminder'] = True
         context.user_data['step'] = 'title'
         context.user_data['user_id'] = user_id
+        context.user_data['has_premium'] = has_premium
         
         keyboard = [[InlineKeyboardButton("❌ Отменить", callback_data="start_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1056,6 +1206,108 @@ async def start_new_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.error(f"Ошибка в start_new_reminder: {e}")
         await query.edit_message_text("❌ Ошибка при создании напоминания.")
 
+def plural(n, one, few, many):
+    """Форма слова для числа: 1 день, 2 дня, 5 дней"""
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if n % 10 in (2, 3, 4) and n % 100 not in (12, 13, 14):
+        return few
+    return many
+
+def format_recurrence(recurrence, interval=1):
+    """Правило повтора для пользователя: «каждый месяц», «каждые 10 дней»"""
+    interval = interval or 1
+    units = {
+        'days': ('день', 'дня', 'дней', 'каждый'),
+        'weekly': ('неделю', 'недели', 'недель', 'каждую'),
+        'monthly': ('месяц', 'месяца', 'месяцев', 'каждый'),
+        'yearly': ('год', 'года', 'лет', 'каждый'),
+    }
+    if recurrence not in units:
+        return ""
+    one, few, many, every = units[recurrence]
+    if interval == 1:
+        return f"{every} {one}"
+    return f"{plural(interval, 'каждый', 'каждые', 'каждые')} {interval} {plural(interval, one, few, many)}"
+
+def recurrence_keyboard():
+    """Выбор повтора при создании напоминания (премиум)"""
+    keyboard = [
+        [InlineKeyboardButton("Разовый платеж", callback_data="recur_none")],
+        [
+            InlineKeyboardButton("Каждую неделю", callback_data="recur_weekly"),
+            InlineKeyboardButton("Каждый месяц", callback_data="recur_monthly")
+        ],
+        [
+            InlineKeyboardButton("Каждый год", callback_data="recur_yearly"),
+            InlineKeyboardButton("Каждые N дней", callback_data="recur_days")
+        ],
+        [InlineKeyboardButton("❌ Отменить", callback_data="start_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def save_new_reminder(reply, context):
+    """Сохранить напоминание из context.user_data и ответить пользователю.
+
+    reply - reply_text сообщения или edit_message_text кнопки.
+    """
+    user_id = context.user_data.get('user_id')
+    title = context.user_data.get('title')
+    amount = context.user_data.get('amount')
+    date_str = context.user_data.get('payment_date')
+    recurrence = context.user_data.get('recurrence')
+    interval = context.user_data.get('recurrence_interval', 1)
+    remind_time = context.user_data.get('remind_time')
+    
+    if not all([user_id, title, amount, date_str]):
+        await reply("❌ Ошибка данных. Начните заново.")
+        context.user_data.clear()
+        return
+    
+    # Сохраняем в БД
+    reminder_id = await async_db.add_reminder(
+        user_id=user_id,
+        title=title,
+        amount=amount,
+        payment_date=date_str,
+        recurrence=recurrence,
+        recurrence_interval=interval,
+        remind_time=remind_time
+    )
+    
+    # Очищаем состояние
+    context.user_data.clear()
+    
+    if not reminder_id:
+        await reply("❌ Ошибка сохранения.")
+        return
+    
+    if remind_time:
+        await track_exact_alert(reminder_id)
+    
+    keyboard = [
+        [InlineKeyboardButton("📋 Мои напоминания", callback_data="list")],
+        [InlineKeyboardButton("➕ Еще напоминание", callback_data="new_reminder")],
+        [InlineKeyboardButton("🔙 В меню", callback_data="start_menu")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    date_text = datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+    if remind_time:
+        date_text += f" {remind_time}"
+    message = (
+        f"✅ <b>Напоминание создано!</b>\n\n"
+        f"<b>Название:</b> {title}\n"
+        f"<b>Сумма:</b> {amount}₽\n"
+        f"<b>Дата:</b> {date_text}\n"
+    )
+    if recurrence:
+        message += f"<b>Повтор:</b> {format_recurrence(recurrence, interval)}\n"
+    message += "\nВы получите уведомление за день до платежа"
+    message += f" и в {remind_time} в день платежа." if remind_time else "."
+    
+    await reply(message, reply_markup=reply_markup, parse_mode='HTML')
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений для создания напоминания"""
     if not context.user_data.get('creating_reminder'):
@@ -1102,7 +1354,8 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 await update.message.reply_text(
                     "Шаг 3 из 3\n"
                     "Введите <b>дату платежа</b> (ДД.ММ.ГГГГ):\n\n"
-                    "Например: <i>25.01.2024</i>",
+                    "Например: <i>25.01.2024</i>\n\n"
+                    "Можно добавить время, чтобы получить напоминание в день платежа: <i>25.01.2024 18:30</i>",
                     reply_markup=reply_markup,
                     parse_mode='HTML'
                 )
@@ -1111,62 +1364,52 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 await update.message.reply_text("❌ Неверный формат суммы. Введите число:")
                 
         elif step == 'date':
-            # Сохраняем напоминание
             try:
-                day, month, year = map(int, text.split('.'))
+                date_part, _, time_part = text.partition(' ')
+                day, month, year = map(int, date_part.split('.'))
                 payment_date = datetime(year, month, day).date()
-                
-                # Проверяем что дата в будущем
-                if payment_date < datetime.now().date():
-                    await update.message.reply_text("❌ Дата должна быть в будущем. Введите снова:")
-                    return
-                
-                # Получаем данные
-                user_id = context.user_data.get('user_id')
-                title = context.user_data.get('title')
-                amount = context.user_data.get('amount')
-                
-                if not all([user_id, title, amount]):
-                    await update.message.reply_text("❌ Ошибка данных. Начните заново.")
-                    return
-                
-                date_str = payment_date.strftime('%Y-%m-%d')
-                
-                # Сохраняем в БД
-                reminder_id = db.add_reminder(
-                    user_id=user_id,
-                    title=title,
-                    amount=amount,
-                    payment_date=date_str
-                )
-                
-                if reminder_id:
-                    # Очищаем состояние
-                    context.user_data.clear()
-                    
-                    keyboard = [
-                        [InlineKeyboardButton("📋 Мои напоминания", callback_data="list")],
-                        [InlineKeyboardButton("➕ Еще напоминание", callback_data="new_reminder")],
-                        [InlineKeyboardButton("🔙 В меню", callback_data="start_menu")]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    await update.message.reply_text(
-                        f"✅ <b>Напоминание создано!</b>\n\n"
-                        f"<b>Название:</b> {title}\n"
-                        f"<b>Сумма:</b> {amount}₽\n"
-                        f"<b>Дата:</b> {text}\n\n"
-                        f"Вы получите уведомление за день до платежа.",
-                        reply_markup=reply_markup,
-                        parse_mode='HTML'
-                    )
-                else:
-                    await update.message.reply_text("❌ Ошибка сохранения.")
-                    context.user_data.clear()
-                
+                # Необязательное время точного напоминания (ЧЧ:ММ)
+                remind_time = None
+                if time_part.strip():
+                    remind_time = datetime.strptime(time_part.strip(), '%H:%M').strftime('%H:%M')
             except Exception as e:
-                logger.error(f"Ошибка при сохранении напоминания: {e}")
-                await update.message.reply_text("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+                logger.error(f"Ошибка при разборе даты: {e}")
+                await update.message.reply_text("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ или ДД.ММ.ГГГГ ЧЧ:ММ")
+                return
+            
+            # Проверяем что дата в будущем
+            if payment_date < datetime.now().date():
+                await update.message.reply_text("❌ Дата должна быть в будущем. Введите снова:")
+                return
+            
+            context.user_data['payment_date'] = payment_date.strftime('%Y-%m-%d')
+            context.user_data['remind_time'] = remind_time
+            
+            if context.user_data.get('has_premium'):
+                # Премиум: платеж можно сделать повторяющимся
+                context.user_data['step'] = 'recurrence'
+                await update.message.reply_text(
+                    "🔄 <b>Повторять платеж?</b>\n\n"
+                    "Повторяющееся напоминание после даты платежа само переносится на следующую.",
+                    reply_markup=recurrence_keyboard(),
+                    parse_mode='HTML'
+                )
+                return
+            
+            await save_new_reminder(update.message.reply_text, context)
+            
+        elif step == 'recurrence_days':
+            try:
+                interval = int(text)
+                if not 1 <= interval <= 365:
+                    raise ValueError
+            except ValueError:
+                await update.message.reply_text("❌ Введите число дней от 1 до 365:")
+                return
+            
+            context.user_data['recurrence'] = 'days'
+            context.user_data['recurrence_interval'] = interval
+            await save_new_reminder(update.message.reply_text, context)
                 
     except Exception as e:
         logger.error(f"Ошибка в handle_text_message: {e}")
@@ -1213,9 +1456,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "• /premium — премиум подписка\n"
                 "• /buy — купить премиум\n"
                 "• /status — статус бота\n"
+                "• /notify_time — время уведомлений\n"
                 "• /help — эта справка\n\n"
                 f"<b>Бесплатный лимит:</b> {FREE_LIMIT} напоминаний\n"
-                "<b>Уведомления:</b> каждый день в 10:00 по Москве\n\n"
+                "<b>Уведомления:</b> каждый день в 10:00 по Москве (можно изменить: /notify_time)\n\n"
                 "<i>По вопросам обращайтесь к администратору</i>\n"
                 "Почта администратора для связи: planexgame@gmail.com",
                 reply_markup=reply_markup,
@@ -1226,18 +1470,40 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Перенаправляем на информацию о премиуме
             await show_premium_info_button(update, context)
             
+        elif query.data.startswith("recur_"):
+            # Выбор повтора при создании напоминания
+            if context.user_data.get('step') != 'recurrence':
+                await query.edit_message_text("❌ Ошибка данных. Начните заново.")
+                return
+            
+            recurrence = query.data[len("recur_"):]
+            if recurrence == 'days':
+                context.user_data['step'] = 'recurrence_days'
+                keyboard = [[InlineKeyboardButton("❌ Отменить", callback_data="start_menu")]]
+                await query.edit_message_text(
+                    "Введите интервал <b>в днях</b> (например, <i>14</i>):",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode='HTML'
+                )
+                return
+            
+            context.user_data['recurrence'] = recurrence if recurrence != 'none' else None
+            context.user_data['recurrence_interval'] = 1
+            await save_new_reminder(query.edit_message_text, context)
+            
         elif query.data.startswith("delete_"):
             # Удаление напоминания
             try:
                 reminder_id = int(query.data.split("_")[1])
-                user_id = db.get_or_create_user(
+                user_id = await async_db.get_or_create_user(
                     telegram_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
                     last_name=user.last_name
                 )
                 
-                if db.delete_reminder(user_id, reminder_id):
+                if await async_db.delete_reminder(user_id, reminder_id):
+                    untrack_exact_alert(reminder_id)
                     await query.edit_message_text("✅ Напоминание удалено!")
                     # Показываем обновленный список
                     await show_reminders_button(update, context)
@@ -1274,9 +1540,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
         elif query.data == "trial":
             # Тестовый период
-            user_id = db.get_or_create_user(user.id, user.username, user.first_name, user.last_name)
+            user_id = await async_db.get_or_create_user(user.id, user.username, user.first_name, user.last_name)
             
-            if db.activate_premium(user_id, 7):
+            if await async_db.activate_premium(user_id, 7):
                 keyboard = [
                     [InlineKeyboardButton("📋 Мои напоминания", callback_data="list")],
                     [InlineKeyboardButton("🔙 Назад", callback_data="premium_info")]
@@ -1365,6 +1631,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             await show_admin_users_button(update, context)
             
+        elif query.data.startswith("admin_users_"):
+            if user.id != ADMIN_ID:
+                await query.edit_message_text("❌ Доступ запрещен.")
+                return
+            # admin_users_<older|newer>:<created_at>|<id>
+            direction, _, cursor_text = query.data[len("admin_users_"):].partition(":")
+            created_at, _, last_id = cursor_text.rpartition("|")
+            await show_admin_users_button(update, context, cursor=(created_at, int(last_id)), direction=direction)
+            
         elif query.data == "admin_activate_user":
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
@@ -1399,32 +1674,50 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
                 return
-            await execute_broadcast(update, context, premium_only=False)
+            await execute_broadcast(update, context, segment='all')
             
         elif query.data == "broadcast_premium_only":
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
                 return
-            await execute_broadcast(update, context, premium_only=True)
+            await execute_broadcast(update, context, segment='premium')
             
         elif query.data == "broadcast_photo":
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
                 return
             # Перенаправляем на ту же функцию, что и для команды
-            await broadcast_photo_command_handler(update, context)
+            await broadcast_media_command_handler(update, context)
             
         elif query.data == "broadcast_all_photo":
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
                 return
-            await execute_broadcast_photo(update, context, premium_only=False)
+            await execute_broadcast(update, context, segment='all')
             
         elif query.data == "broadcast_premium_photo":
             if user.id != ADMIN_ID:
                 await query.edit_message_text("❌ Доступ запрещен.")
                 return
-            await execute_broadcast_photo(update, context, premium_only=True)
+            await execute_broadcast(update, context, segment='premium')
+            
+        elif query.data == "broadcast_segments":
+            if user.id != ADMIN_ID:
+                await query.edit_message_text("❌ Доступ запрещен.")
+                return
+            await show_broadcast_segments_button(update, context)
+            
+        elif query.data.startswith(("broadcast_seg_", "broadcast_go_")):
+            if user.id != ADMIN_ID:
+                await query.edit_message_text("❌ Доступ запрещен.")
+                return
+            await broadcast_segment_button(update, context)
+            
+        elif query.data.startswith(("broadcast_pause_", "broadcast_resume_", "broadcast_cancel_")):
+            if user.id != ADMIN_ID:
+                await query.edit_message_text("❌ Доступ запрещен.")
+                return
+            await control_broadcast_button(update, context)
             
     except Exception as e:
         logger.error(f"Ошибка в button_handler: {e}")
@@ -1441,7 +1734,7 @@ async def show_reminders_button(update: Update, context: ContextTypes.DEFAULT_TY
     user = query.from_user
     
     try:
-        user_id = db.get_or_create_user(
+        user_id = await async_db.get_or_create_user(
             telegram_id=user.id,
             username=user.username,
             first_name=user.first_name,
@@ -1453,7 +1746,7 @@ async def show_reminders_button(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # Получаем напоминания
-        reminders = db.get_user_reminders(user_id)
+        reminders = await async_db.get_user_reminders(user_id)
         
         if not reminders:
             keyboard = [
@@ -1494,7 +1787,12 @@ async def show_reminders_button(update: Update, context: ContextTypes.DEFAULT_TY
             
             message += f"{i}. <b>{rem.get('title', 'Без названия')}</b>\n"
             message += f"   💰 {amount}₽\n"
-            message += f"   📅 {formatted_date}\n\n"
+            if rem.get('remind_time'):
+                formatted_date += f" ⏰ {rem['remind_time']}"
+            message += f"   📅 {formatted_date}\n"
+            if rem.get('recurrence'):
+                message += f"   🔄 {format_recurrence(rem['recurrence'], rem.get('recurrence_interval'))}\n"
+            message += "\n"
         
         message += f"<b>📊 Итого:</b> {len(reminders)} напоминаний на сумму {total_amount:.2f}₽\n"
         
@@ -1532,23 +1830,17 @@ async def show_premium_info_button(update: Update, context: ContextTypes.DEFAULT
     user = query.from_user
     
     try:
-        user_id = db.get_or_create_user(
-            telegram_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        profile = await user_profile(update, context)
         
-        if not user_id:
+        if not profile:
             await query.edit_message_text("❌ Ошибка базы данных.")
             return
         
         # Получаем статус
-        premium_status = db.get_user_premium_status(user_id)
-        has_premium = premium_status.get('has_active_premium', False) if premium_status else False
+        has_premium = profile['has_premium']
         
         if has_premium:
-            until_date = premium_status.get('premium_until')
+            until_date = profile['premium_until']
             if until_date:
                 until_str = until_date.strftime('%d.%m.%Y') if hasattr(until_date, 'strftime') else str(until_date)
                 message = f"💎 <b>У ВАС АКТИВНА ПРЕМИУМ ПОДПИСКА!</b>\n\nДействует до: <b>{until_str}</b>"
@@ -1596,27 +1888,11 @@ async def show_admin_panel_button(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     
     try:
-        # Получаем статистику напрямую
-        conn = db.get_connection()
-        if not conn:
-            await query.edit_message_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        
-        # Количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        
-        # Количество премиум пользователей
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-        premium_users = cursor.fetchone()[0] or 0
-        
-        # Общее количество напоминаний
-        cursor.execute("SELECT COUNT(*) FROM reminders")
-        total_reminders = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        # Получаем статистику в отдельном потоке, не блокируя остальных пользователей
+        stats = await async_db.get_statistics()
+        total_users = stats['total_users']
+        premium_users = stats['premium_users']
+        total_reminders = stats['total_reminders']
     
         keyboard = [
             [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
@@ -1651,41 +1927,17 @@ async def show_admin_stats_button(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     
     try:
-        conn = db.get_connection()
-        if not conn:
-            await query.edit_message_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        
-        # Количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        
-        # Количество премиум пользователей
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-        premium_users = cursor.fetchone()[0] or 0
-        
-        # Общее количество напоминаний
-        cursor.execute("SELECT COUNT(*) FROM reminders")
-        total_reminders = cursor.fetchone()[0] or 0
-        
-        # Активные напоминания (с датой в будущем или сегодня)
-        today = datetime.now().date().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) FROM reminders WHERE payment_date >= ?", (today,))
-        active_reminders = cursor.fetchone()[0] or 0
+        # Получаем статистику в отдельном потоке, не блокируя остальных пользователей
+        stats = await async_db.get_statistics()
+        total_users = stats['total_users']
+        premium_users = stats['premium_users']
+        total_reminders = stats['total_reminders']
+        active_reminders = stats['active_reminders']
         
         # Дополнительная статистика
-        tomorrow = (datetime.now() + timedelta(days=1)).date().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) FROM reminders WHERE payment_date = ?", (tomorrow,))
-        tomorrow_reminders = cursor.fetchone()[0] or 0
-        
-        # Активные пользователи (за последние 7 дней)
-        week_ago = (datetime.now() - timedelta(days=7)).date().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM reminders WHERE created_at >= ?", (week_ago,))
-        active_users = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        activity = await async_db.get_activity_statistics()
+        tomorrow_reminders = activity['tomorrow_reminders']
+        active_users = activity['active_users']
     
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1709,57 +1961,63 @@ async def show_admin_stats_button(update: Update, context: ContextTypes.DEFAULT_
         logger.error(f"Ошибка в show_admin_stats_button: {e}")
         await query.edit_message_text("❌ Ошибка загрузки статистики.")
 
-async def show_admin_users_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать список пользователей при нажатии кнопки"""
+def format_admin_user_line(u):
+    """Строка с пользователем для админских списков"""
+    username_display = f"@{u['username']}" if u['username'] else f"ID:{u['telegram_id']}"
+    premium = "💎" if u['is_premium'] else "🆓"
+    
+    # Форматируем дату премиума
+    premium_info = ""
+    if u['is_premium'] and u['premium_until']:
+        try:
+            until_date = datetime.strptime(u['premium_until'], '%Y-%m-%d').date()
+            days_left = (until_date - datetime.now().date()).days
+            premium_info = f" ({days_left}д)"
+        except:
+            premium_info = ""
+    
+    # Форматируем дату регистрации
+    created_at = u['created_at']
+    date_str = created_at.strftime('%d.%m') if hasattr(created_at, 'strftime') else str(created_at)[:10]
+    
+    return f"• {premium}{premium_info} {u['first_name'] or 'Без имени'} ({username_display}) - {date_str}\n"
+
+async def show_admin_users_button(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, direction='older'):
+    """Показать страницу пользователей при нажатии кнопки"""
     query = update.callback_query
     
     try:
-        conn = db.get_connection()
-        if not conn:
-            await query.edit_message_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT telegram_id, username, first_name, is_premium, premium_until, created_at 
-            FROM users 
-            ORDER BY created_at DESC 
-            LIMIT 15
-        """)
-        users = cursor.fetchall()
-        
-        # Общее количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        page = await async_db.get_users_page(cursor=cursor, direction=direction, limit=ADMIN_USERS_PAGE_SIZE)
+        users = page['users']
+        stats = await async_db.get_statistics()
+        total_users = stats['total_users']
         
         if not users:
             await query.edit_message_text("📭 Пользователей пока нет.")
             return
         
-        message = f"👥 <b>ПОСЛЕДНИЕ ПОЛЬЗОВАТЕЛИ (всего: {total_users}):</b>\n\n"
+        message = f"👥 <b>ПОЛЬЗОВАТЕЛИ (всего: {total_users}):</b>\n\n"
         
-        for i, (telegram_id, username, first_name, is_premium, premium_until, created_at) in enumerate(users, 1):
-            username_display = f"@{username}" if username else f"ID:{telegram_id}"
-            premium = "💎" if is_premium else "🆓"
-            
-            # Форматируем дату премиума
-            premium_info = ""
-            if is_premium and premium_until:
-                try:
-                    until_date = datetime.strptime(premium_until, '%Y-%m-%d').date()
-                    days_left = (until_date - datetime.now().date()).days
-                    premium_info = f" ({days_left}д)"
-                except:
-                    premium_info = ""
-            
-            # Форматируем дату регистрации
-            date_str = created_at.strftime('%d.%m') if hasattr(created_at, 'strftime') else str(created_at)[:10]
-            
-            message += f"{i}. {premium}{premium_info} {first_name or 'Без имени'} ({username_display}) - {date_str}\n"
+        for u in users:
+            message += format_admin_user_line(u)
         
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
+        message += "\n🔍 Поиск: <code>/admin_find &lt;начало username&gt;</code>"
+        
+        # Кнопки листания: курсор - (created_at, id) крайнего пользователя на странице
+        navigation = []
+        if page['has_newer']:
+            first = users[0]
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Новее", callback_data=f"admin_users_newer:{first['created_at']}|{first['id']}"
+            ))
+        if page['has_older']:
+            last = users[-1]
+            navigation.append(InlineKeyboardButton(
+                "Старше ➡️", callback_data=f"admin_users_older:{last['created_at']}|{last['id']}"
+            ))
+        
+        keyboard = [navigation] if navigation else []
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
@@ -1854,149 +2112,170 @@ async def show_admin_broadcast_form_button(update: Update, context: ContextTypes
         "   - Отправить только премиум пользователям\n\n"
         "• <code>/broadcast_test</code>\n"
         "   - Тестовая рассылка (только админу)\n\n"
-        "• <code>/broadcast_photo</code>\n"
-        "   - Рассылка с фото (ответьте на фото командой)"
+        "• <code>/broadcast_media</code>\n"
+        "   - Рассылка фото, документа или альбома (ответьте на него командой)"
     )
     
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
+    keyboard = []
+    
+    # Незавершенные рассылки с кнопками управления
+    jobs = await async_db.get_unfinished_broadcast_jobs()
+    if jobs:
+        message += "\n\n<b>Незавершенные рассылки:</b>\n"
+        for job in jobs:
+            state = "🔄 идет" if job['status'] == 'running' else "⏸ на паузе"
+            message += f"• #{job['id']} {job['title']} — {state}, отправлено {job['sent']} из {job['total']}\n"
+            if job['status'] == 'running':
+                toggle = InlineKeyboardButton(f"⏸ #{job['id']}", callback_data=f"broadcast_pause_{job['id']}")
+            else:
+                toggle = InlineKeyboardButton(f"▶️ #{job['id']}", callback_data=f"broadcast_resume_{job['id']}")
+            keyboard.append([
+                toggle,
+                InlineKeyboardButton(f"⏹ #{job['id']}", callback_data=f"broadcast_cancel_{job['id']}")
+            ])
+    
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
 
-# ========== ФУНКЦИИ РАССЫЛКИ ==========
+async def show_broadcast_segments_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор сегмента аудитории с оценкой числа получателей"""
+    query = update.callback_query
+    
+    if not context.user_data.get('broadcast_payload'):
+        await query.edit_message_text("❌ Сообщение для рассылки не найдено.")
+        return
+    
+    # Оценки считаются по индексам сегментов - без просмотра всей таблицы
+    keyboard = []
+    for segment, days in BROADCAST_SEGMENTS:
+        count = await async_db.count_segment(segment, days=days, free_limit=FREE_LIMIT)
+        keyboard.append([InlineKeyboardButton(
+            f"{format_audience(segment, {'days': days})} — {count}",
+            callback_data=f"broadcast_seg_{segment}_{days or 0}"
+        )])
+    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="admin_panel")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        "🎯 <b>АУДИТОРИЯ РАССЫЛКИ</b>\n\n"
+        "Недоступные чаты (бот заблокирован) не учитываются.\n"
+        "Рядом с сегментом - примерное число получателей.",
+        reply_markup=reply_markup,
+        parse_mode='HTML'
+    )
 
-async def execute_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, premium_only: bool = False):
-    """Выполнить рассылку"""
+async def broadcast_segment_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение (broadcast_seg_) и запуск (broadcast_go_) рассылки по сегменту"""
     query = update.callback_query
+    action, _, rest = query.data[len("broadcast_"):].partition("_")
+    segment, _, days = rest.rpartition("_")
+    if segment not in AUDIENCE_SEGMENTS or not days.isdigit():
+        await query.edit_message_text("❌ Неизвестный сегмент.")
+        return
+    days = int(days) or None
     
-    message_text = context.user_data.get('broadcast_message', '')
-    if not message_text:
+    if action == "go":
+        await execute_broadcast(update, context, segment=segment, days=days)
+        return
+    
+    if not context.user_data.get('broadcast_payload'):
         await query.edit_message_text("❌ Сообщение для рассылки не найдено.")
         return
     
-    try:
-        await query.edit_message_text("🔄 Начинаю рассылку...")
-        
-        conn = db.get_connection()
-        if not conn:
-            await query.edit_message_text("❌ Ошибка подключения к базе данных.")
-            return
-        
-        cursor = conn.cursor()
-        if premium_only:
-            cursor.execute("SELECT telegram_id FROM users WHERE is_premium = TRUE")
-        else:
-            cursor.execute("SELECT telegram_id FROM users")
-        
-        users = cursor.fetchall()
-        conn.close()
-        
-        success = 0
-        failed = 0
-        
-        for (telegram_id,) in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=f"📢 <b>РАССЫЛКА ОТ АДМИНИСТРАТОРА</b>\n\n{message_text}",
-                    parse_mode='HTML'
-                )
-                success += 1
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                import time
-                time.sleep(0.1)
-            except Exception as e:
-                logger.error(f"Ошибка отправки пользователю {telegram_id}: {e}")
-                failed += 1
-        
-        result_message = (
-            f"✅ <b>РАССЫЛКА ЗАВЕРШЕНА</b>\n\n"
-            f"<b>Аудитория:</b> {'💎 Только премиум' if premium_only else '👥 Все пользователи'}\n"
-            f"<b>Отправлено успешно:</b> {success}\n"
-            f"<b>Не удалось отправить:</b> {failed}\n"
-            f"<b>Всего пользователей:</b> {len(users)}"
-        )
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(result_message, reply_markup=reply_markup, parse_mode='HTML')
-        
-    except Exception as e:
-        logger.error(f"Ошибка рассылки: {e}")
-        await query.edit_message_text(f"❌ Ошибка при рассылке: {e}")
+    count = await async_db.count_segment(segment, days=days, free_limit=FREE_LIMIT)
+    keyboard = [
+        [InlineKeyboardButton("✅ Отправить", callback_data=f"broadcast_go_{segment}_{days or 0}")],
+        [InlineKeyboardButton("🔙 К сегментам", callback_data="broadcast_segments")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"📢 <b>ПОДТВЕРЖДЕНИЕ РАССЫЛКИ</b>\n\n"
+        f"<b>Аудитория:</b> {format_audience(segment, {'days': days})}\n"
+        f"<b>Получателей:</b> ≈{count}\n\n"
+        f"Точный список получателей фиксируется при запуске.",
+        reply_markup=reply_markup,
+        parse_mode='HTML'
+    )
 
-async def execute_broadcast_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, premium_only: bool = False):
-    """Выполнить рассылку фото"""
+async def control_broadcast_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пауза, продолжение и отмена рассылки"""
     query = update.callback_query
+    _, action, job_id = query.data.split("_")
+    job_id = int(job_id)
     
-    photo_file_id = context.user_data.get('broadcast_photo', '')
-    caption = context.user_data.get('broadcast_caption', '')
+    if action == "pause":
+        if pause_broadcast(job_id):
+            await query.edit_message_text("⏸ Рассылка останавливается...\nИтоги появятся в этом сообщении.")
+        else:
+            await query.edit_message_text("❌ Рассылка не идет.", reply_markup=broadcast_keyboard(job_id, 'done'))
     
-    if not photo_file_id:
-        await query.edit_message_text("❌ Фото для рассылки не найдено.")
+    elif action == "resume":
+        if await resume_broadcast(context.application, job_id):
+            job = await async_db.get_broadcast_job(job_id)
+            # Итоги запишутся в исходное сообщение-отчет
+            await query.edit_message_text(
+                f"🔄 Рассылка #{job_id} продолжается с места остановки "
+                f"(уже отправлено {job['sent']} из {job['total']}).",
+                reply_markup=broadcast_keyboard(job_id, 'running')
+            )
+        else:
+            await query.edit_message_text("❌ Рассылку нельзя продолжить.", reply_markup=broadcast_keyboard(job_id, 'done'))
+    
+    else:
+        running = is_broadcast_running(job_id)
+        if not await cancel_broadcast(job_id):
+            await query.edit_message_text("❌ Рассылка уже завершена.", reply_markup=broadcast_keyboard(job_id, 'done'))
+        elif running:
+            await query.edit_message_text("⏹ Рассылка останавливается...\nИтоги появятся в этом сообщении.")
+        else:
+            job = await async_db.get_broadcast_job(job_id)
+            await query.edit_message_text(
+                format_broadcast_report(job, 'cancelled'),
+                reply_markup=broadcast_keyboard(job_id, 'cancelled'),
+                parse_mode='HTML'
+            )
+
+# ========== ФУНКЦИИ РАССЫЛКИ ==========
+
+async def execute_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, segment: str = 'all',
+                            days: int = None):
+    """Выполнить подготовленную рассылку (текст, фото, документ или альбом)
+    по сегменту аудитории - в фоне, с учетом лимитов Telegram"""
+    query = update.callback_query
+    
+    payload = context.user_data.get('broadcast_payload')
+    if not payload:
+        await query.edit_message_text("❌ Сообщение для рассылки не найдено.")
         return
     
     try:
-        await query.edit_message_text("🔄 Начинаю рассылку фото...")
-        
-        conn = db.get_connection()
-        if not conn:
-            await query.edit_message_text("❌ Ошибка подключения к базе данных.")
+        # Задание рассылки: прогресс сохраняется в БД, итоги - в это сообщение
+        job_id, recipients_count = await create_broadcast(
+            payload,
+            segment,
+            {'days': days, 'free_limit': FREE_LIMIT},
+            report_chat_id=query.message.chat_id,
+            report_message_id=query.message.message_id
+        )
+        if not job_id:
+            await query.edit_message_text("❌ Не удалось создать рассылку.")
             return
+        context.user_data.pop('broadcast_payload', None)
         
-        cursor = conn.cursor()
-        if premium_only:
-            cursor.execute("SELECT telegram_id FROM users WHERE is_premium = TRUE")
-        else:
-            cursor.execute("SELECT telegram_id FROM users")
-        
-        users = cursor.fetchall()
-        conn.close()
-        
-        success = 0
-        failed = 0
-        
-        for (telegram_id,) in users:
-            try:
-                if caption:
-                    await context.bot.send_photo(
-                        chat_id=telegram_id,
-                        photo=photo_file_id,
-                        caption=f"📢 <b>РАССЫЛКА ОТ АДМИНИСТРАТОРА</b>\n\n{caption}",
-                        parse_mode='HTML'
-                    )
-                else:
-                    await context.bot.send_photo(
-                        chat_id=telegram_id,
-                        photo=photo_file_id,
-                        caption="📢 <b>РАССЫЛКА ОТ АДМИНИСТРАТОРА</b>",
-                        parse_mode='HTML'
-                    )
-                success += 1
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                import time
-                time.sleep(0.1)
-            except Exception as e:
-                logger.error(f"Ошибка отправки фото пользователю {telegram_id}: {e}")
-                failed += 1
-        
-        result_message = (
-            f"✅ <b>РАССЫЛКА ФОТО ЗАВЕРШЕНА</b>\n\n"
-            f"<b>Аудитория:</b> {'💎 Только премиум' if premium_only else '👥 Все пользователи'}\n"
-            f"<b>Отправлено успешно:</b> {success}\n"
-            f"<b>Не удалось отправить:</b> {failed}\n"
-            f"<b>Всего пользователей:</b> {len(users)}"
+        await query.edit_message_text(
+            f"🔄 Рассылка #{job_id} запущена в фоне для {recipients_count} пользователей.\n"
+            f"Итоги появятся в этом сообщении.",
+            reply_markup=broadcast_keyboard(job_id, 'running')
         )
         
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(result_message, reply_markup=reply_markup, parse_mode='HTML')
+        start_broadcast(context.application, job_id)
         
     except Exception as e:
-        logger.error(f"Ошибка рассылки фото: {e}")
-        await query.edit_message_text(f"❌ Ошибка при рассылке фото: {e}")
+        logger.error(f"Ошибка рассылки: {e}")
+        await query.edit_message_text(f"❌ Ошибка при рассылке: {e}")
 
 # ========== ЗАПУСК БОТА ==========
 
@@ -2014,40 +2293,21 @@ def main():
         if db.init_db():
             print("✅ База данных: подключена")
             
-            # ПРЯМАЯ ПРОВЕРКА СТАТИСТИКИ
-            conn = db.get_connection()
-            if conn:
-                cursor = conn.cursor()
-                
-                # Проверяем количество пользователей
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0] or 0
-                print(f"👥 Всего пользователей: {total_users}")
-                
-                # Проверяем премиум пользователей
-                cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-                premium_users = cursor.fetchone()[0] or 0
-                print(f"💎 Премиум пользователей: {premium_users}")
-                
-                # Проверяем общее количество напоминаний
-                cursor.execute("SELECT COUNT(*) FROM reminders")
-                total_reminders = cursor.fetchone()[0] or 0
-                print(f"📝 Всего напоминаний: {total_reminders}")
-                
-                # Проверяем активные напоминания (с датой в будущем или сегодня)
-                today = datetime.now().date().strftime('%Y-%m-%d')
-                cursor.execute("SELECT COUNT(*) FROM reminders WHERE payment_date >= ?", (today,))
-                active_reminders = cursor.fetchone()[0] or 0
-                print(f"🔔 Активных напоминаний: {active_reminders}")
-                
-                conn.close()
-                
-                # Выводим статистику напрямую
-                print("\n📊 ПРЯМАЯ ПРОВЕРКА СТАТИСТИКИ:")
-                print(f"• 👥 Всего пользователей: {total_users}")
-                print(f"• 💎 Премиум пользователей: {premium_users}")
-                print(f"• 📝 Всего напоминаний: {total_reminders}")
-                print(f"• 🔔 Активных напоминаний: {active_reminders}")
+            # Проверяем, что ежедневные запросы идут по индексам
+            plan_problems = db.check_query_plans()
+            if plan_problems:
+                for problem in plan_problems:
+                    print(f"⚠️ План запроса деградировал: {problem}")
+            else:
+                print("✅ Планы запросов: используют индексы")
+            
+            # Статистика из счетчиков (без полного просмотра таблиц)
+            stats = db.get_statistics()
+            print("\n📊 СТАТИСТИКА:")
+            print(f"• 👥 Всего пользователей: {stats['total_users']}")
+            print(f"• 💎 Премиум пользователей: {stats['premium_users']}")
+            print(f"• 📝 Всего напоминаний: {stats['total_reminders']}")
+            print(f"• 🔔 Активных напоминаний: {stats['active_reminders']}")
         else:
             print("⚠️ База данных: проблемы с подключением")
     except Exception as e:
@@ -2065,36 +2325,108 @@ def main():
     app.add_handler(CommandHandler("premium", premium_command_handler))
     app.add_handler(CommandHandler("buy", buy_command_handler))
     app.add_handler(CommandHandler("status", status_command_handler))
+    app.add_handler(CommandHandler("notify_time", notify_time_command_handler))
     app.add_handler(CommandHandler("new", new_command_handler))
     app.add_handler(CommandHandler("admin", admin_command_handler))
     app.add_handler(CommandHandler("admin_activate", admin_activate_command_handler))
     app.add_handler(CommandHandler("admin_activate_username", admin_activate_username_command_handler))
     app.add_handler(CommandHandler("admin_deactivate", admin_deactivate_command_handler))
     app.add_handler(CommandHandler("admin_deactivate_username", admin_deactivate_username_command_handler))
+    app.add_handler(CommandHandler("admin_find", admin_find_command_handler))
     app.add_handler(CommandHandler("broadcast", broadcast_command_handler))
     app.add_handler(CommandHandler("broadcast_premium", broadcast_premium_command_handler))
     app.add_handler(CommandHandler("broadcast_test", broadcast_test_command_handler))
     app.add_handler(CommandHandler("broadcast_test_full", broadcast_test_full_command_handler))
-    app.add_handler(CommandHandler("broadcast_photo", broadcast_photo_command_handler))
+    app.add_handler(CommandHandler(["broadcast_media", "broadcast_photo"], broadcast_media_command_handler))
     app.add_handler(CommandHandler("test", test_command_handler))
     app.add_handler(CommandHandler("test_notify", test_notify_command_handler))
     app.add_handler(CommandHandler("test_admin", test_admin_command_handler))
     app.add_handler(CommandHandler("test_payment", test_payment_command_handler))
     
+    # Снимок профиля пользователя до основных обработчиков
+    app.add_handler(TypeHandler(Update, load_user_profile_handler), group=-1)
+    
     # Обработчик кнопок
     app.add_handler(CallbackQueryHandler(button_handler))
     
+    # Альбомы администратора - для рассылки через /broadcast_media
+    app.add_handler(MessageHandler(
+        filters.User(user_id=ADMIN_ID) & (filters.PHOTO | filters.VIDEO | filters.Document.ALL),
+        remember_admin_media_handler
+    ))
+    
     # Обработчик текстовых сообщений для создания напоминаний
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     
     # Настраиваем планировщик уведомлений
     job_queue = app.job_queue
     if job_queue:
-        job_queue.run_daily(
+        # Уведомления по часовым слотам: в начале каждого часа (UTC) - пользователи,
+        # у которых на этот час приходится выбранное время уведомлений
+        next_hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        job_queue.run_repeating(
             send_reminder_notifications,
-            time=time(hour=7, minute=0),
+            interval=3600,
+            first=next_hour,
+            name="notification_slots"
+        )
+        
+        # Слоты, пропущенные пока бот не работал (перезапуск, деплой)
+        job_queue.run_once(catch_up_notifications_job, when=15, name="notification_catch_up")
+        
+        # План отправки на сутки вперед: строится ночью (вне часа пик) и при запуске
+        job_queue.run_once(build_send_plan_job, when=25, name="send_plan_startup")
+        job_queue.run_daily(
+            build_send_plan_job,
+            time=time(hour=1, minute=30),
+            days=(0, 1, 2, 3, 4, 5, 6),
+            name="send_plan"
+        )
+        
+        # Точные напоминания: загрузка ближайших часов в колесо таймеров и тик раз в секунду
+        job_queue.run_repeating(load_exact_alerts_job, interval=3600, first=2, name="exact_alerts_load")
+        job_queue.run_repeating(exact_alerts_job, interval=1, first=3, name="exact_alerts_tick")
+        
+        # Рассылки, прерванные перезапуском, продолжаются с контрольной точки
+        job_queue.run_once(resume_broadcasts_job, when=30, name="broadcast_resume")
+        
+        # Пересчет слотов после перехода на летнее/зимнее время
+        job_queue.run_once(refresh_notification_slots_job, when=5, name="notification_slots_refresh_startup")
+        job_queue.run_daily(
+            refresh_notification_slots_job,
+            time=time(hour=0, minute=15),
+            days=(0, 1, 2, 3, 4, 5, 6),
+            name="notification_slots_refresh"
+        )
+        
+        # Очередь уведомлений: повторы после ошибок и продолжение после перезапуска
+        job_queue.run_repeating(deliver_outbox_job, interval=300, first=20, name="notification_outbox")
+        
+        # Перенос наступивших повторяющихся платежей: при запуске и каждую ночь
+        job_queue.run_once(advance_recurring_job, when=3, name="recurring_advance_startup")
+        job_queue.run_daily(
+            advance_recurring_job,
+            time=time(hour=0, minute=1),
+            days=(0, 1, 2, 3, 4, 5, 6),
+            name="recurring_advance"
+        )
+        
+        # Снятие истекших подписок: сразу после запуска и каждую ночь
+        job_queue.run_once(expire_premium_job, when=10, data={'notify': True}, name="premium_expiry_startup")
+        job_queue.run_daily(
+            expire_premium_job,
+            time=time(hour=0, minute=5),
+            days=(0, 1, 2, 3, 4, 5, 6),
+            data={'notify': True},
+            name="premium_expiry"
+        )
+        
+        # Сверка счетчиков статистики: раз в сутки, после ночных переносов и снятия подписок
+        job_queue.run_daily(
+            reconcile_statistics_job,
+            time=time(hour=3, minute=0),
             days=(0, 1, 2, 3, 4, 5, 6),
-            name="daily_reminders"
+            name="statistics_reconcile"
         )
         print("📅 Планировщик уведомлений настроен")
     
@@ -0,0 +1,429 @@
+# broadcast.py - фоновые рассылки администратора
+import json
+import logging
+from collections import deque
+
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument
+)
+
+from database import async_db
+from delivery import fan_out, chat_state_for_error, DeliveryStats, ThrottledProgress, format_duration
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_HEADER = "📢 <b>РАССЫЛКА ОТ АДМИНИСТРАТОРА</b>"
+
+# Сколько недоступных чатов накапливать перед записью в БД
+UNDELIVERABLE_FLUSH_SIZE = 100
+
+# Как часто (в обработанных получателях) сохранять контрольную точку рассылки
+CHECKPOINT_EVERY = 50
+
+# Рассылки, идущие в этом процессе: id -> требуемое состояние ('running', 'paused', 'cancelled')
+_running = {}
+
+# Подписи сегментов аудитории (database.AUDIENCE_SEGMENTS)
+SEGMENT_TITLES = {
+    'all': '👥 Все пользователи',
+    'premium': '💎 Только премиум',
+    'premium_expiring': '⏳ Премиум истекает за {days} дн.',
+    'free_at_limit': '🛑 Бесплатные на лимите',
+    'due_this_week': '📅 Платежи на этой неделе',
+    'inactive': '💤 Неактивные {days}+ дн.',
+}
+
+def format_audience(segment, params=None):
+    """Подпись аудитории рассылки по сегменту и его параметрам"""
+    params = params or {}
+    title = SEGMENT_TITLES.get(segment, segment).format(days=params.get('days'))
+    if not params.get('exclude_blocked', True):
+        title += ' (включая недоступные чаты)'
+    return title
+
+def job_audience(job):
+    """Подпись аудитории задания рассылки"""
+    return format_audience(job['segment'], json.loads(job['segment_params']))
+
+def with_broadcast_header(text):
+    """Текст рассылки с заголовком администратора"""
+    return f"{BROADCAST_HEADER}\n\n{text}" if text else BROADCAST_HEADER
+
+# ========== СОДЕРЖИМОЕ РАССЫЛКИ ==========
+
+class BroadcastPayload:
+    """Содержимое рассылки одного типа.
+
+    Подкласс знает, как отправить содержимое одному получателю и как сохранить
+    его в задании рассылки (to_dict/from_dict). Цикл рассылки, учет и
+    контрольные точки общие для всех типов - см. _run_broadcast.
+    """
+    kind = None
+    title = "РАССЫЛКА"
+
+    def to_dict(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    async def send(self, bot, chat_id):
+        raise NotImplementedError
+
+class TextPayload(BroadcastPayload):
+    """Текстовое сообщение"""
+    kind = 'text'
+    title = "РАССЫЛКА"
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_dict(self):
+        return {'text': self.text}
+
+    async def send(self, bot, chat_id):
+        return await bot.send_message(chat_id=chat_id, text=self.text, parse_mode='HTML')
+
+class PhotoPayload(BroadcastPayload):
+    """Фото с подписью, photo - file_id"""
+    kind = 'photo'
+    title = "РАССЫЛКА ФОТО"
+
+    def __init__(self, photo, caption=None):
+        self.photo = photo
+        self.caption = caption
+
+    def to_dict(self):
+        return {'photo': self.photo, 'caption': self.caption}
+
+    async def send(self, bot, chat_id):
+        return await bot.send_photo(
+            chat_id=chat_id,
+            photo=self.photo,
+            caption=self.caption,
+            parse_mode='HTML'
+        )
+
+class DocumentPayload(BroadcastPayload):
+    """Документ (файл) с подписью, document - file_id"""
+    kind = 'document'
+    title = "РАССЫЛКА ДОКУМЕНТА"
+
+    def __init__(self, document, caption=None):
+        self.document = document
+        self.caption = caption
+
+    def to_dict(self):
+        return {'document': self.document, 'caption': self.caption}
+
+    async def send(self, bot, chat_id):
+        return await bot.send_document(
+            chat_id=chat_id,
+            document=self.document,
+            caption=self.caption,
+            parse_mode='HTML'
+        )
+
+class MediaGroupPayload(BroadcastPayload):
+    """Альбом: до 10 фото и видео или до 10 документов, подпись - у первого элемента.
+
+    items - список {'type': 'photo' | 'video' | 'document', 'media': file_id}.
+    Telegram не принимает альбомы, где документы смешаны с фото или видео, -
+    такой список отклоняется с ValueError.
+    """
+    kind = 'media_group'
+    title = "РАССЫЛКА АЛЬБОМА"
+
+    MEDIA_TYPES = {
+        'photo': InputMediaPhoto,
+        'video': InputMediaVideo,
+        'document': InputMediaDocument,
+    }
+
+    def __init__(self, items, caption=None):
+        items = [dict(item) for item in items]
+        documents = sum(item['type'] == 'document' for item in items)
+        if 0 < documents < len(items):
+            raise ValueError("Документы нельзя отправить в одном альбоме с фото и видео")
+        self.items = items
+        self.caption = caption
+
+    def to_dict(self):
+        return {'items': self.items, 'caption': self.caption}
+
+    async def send(self, bot, chat_id):
+        media = [
+            self.MEDIA_TYPES[item['type']](
+                media=item['media'],
+                caption=self.caption if index == 0 else None,
+                parse_mode='HTML'
+            )
+            for index, item in enumerate(self.items)
+        ]
+        return await bot.send_media_group(chat_id=chat_id, media=media)
+
+# Типы содержимого по kind, сохраненному в задании рассылки
+PAYLOAD_TYPES = {cls.kind: cls for cls in (TextPayload, PhotoPayload, DocumentPayload, MediaGroupPayload)}
+
+def payload_from_job(job):
+    """Содержимое задания рассылки"""
+    return PAYLOAD_TYPES[job['payload_kind']].from_dict(json.loads(job['payload']))
+
+def dump_payload(payload):
+    """JSON содержимого для задания рассылки"""
+    return json.dumps(payload.to_dict(), ensure_ascii=False)
+
+async def create_broadcast(payload, segment='all', segment_params=None, report_chat_id=None, report_message_id=None):
+    """Создать задание рассылки содержимого payload по сегменту аудитории.
+
+    Возвращает (id задания или None, число получателей). Запуск - start_broadcast.
+    """
+    job_id = await async_db.create_broadcast_job(
+        payload.title,
+        payload.kind,
+        dump_payload(payload),
+        segment=segment,
+        segment_params=segment_params,
+        report_chat_id=report_chat_id,
+        report_message_id=report_message_id
+    )
+    if not job_id:
+        return None, 0
+    job = await async_db.get_broadcast_job(job_id)
+    return job_id, job['total']
+
+# ========== ВЫПОЛНЕНИЕ ==========
+
+def broadcast_keyboard(job_id, status):
+    """Кнопки управления рассылкой в сообщении-отчете"""
+    if status == 'running':
+        keyboard = [[
+            InlineKeyboardButton("⏸ Пауза", callback_data=f"broadcast_pause_{job_id}"),
+            InlineKeyboardButton("⏹ Отменить", callback_data=f"broadcast_cancel_{job_id}")
+        ]]
+    elif status == 'paused':
+        keyboard = [[
+            InlineKeyboardButton("▶️ Продолжить", callback_data=f"broadcast_resume_{job_id}"),
+            InlineKeyboardButton("⏹ Отменить", callback_data=f"broadcast_cancel_{job_id}")
+        ]]
+    else:
+        keyboard = []
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")])
+    return InlineKeyboardMarkup(keyboard)
+
+def start_broadcast(application, job_id):
+    """Запустить (или продолжить с контрольной точки) рассылку фоновой задачей.
+
+    Содержимое и получатели берутся из задания broadcast_jobs. Обработчик
+    сразу возвращает управление, а итоги записываются в сообщение-отчет.
+    """
+    if job_id in _running:
+        return None
+    _running[job_id] = 'running'
+    return application.create_task(_run_broadcast(application.bot, job_id))
+
+def pause_broadcast(job_id):
+    """Приостановить идущую рассылку: она остановится после текущих отправок
+    и сохранит контрольную точку. Возвращает True, если пауза принята."""
+    if _running.get(job_id) == 'running':
+        _running[job_id] = 'paused'
+        return True
+    return False
+
+def is_broadcast_running(job_id):
+    """Рассылка идет в этом процессе"""
+    return job_id in _running
+
+async def resume_broadcast(application, job_id):
+    """Продолжить приостановленную рассылку с контрольной точки"""
+    if job_id in _running:
+        return False
+    if not await async_db.set_broadcast_status(job_id, 'running', from_statuses=('paused',)):
+        return False
+    start_broadcast(application, job_id)
+    return True
+
+async def cancel_broadcast(job_id):
+    """Отменить рассылку: идущая остановится после текущих отправок,
+    приостановленная отменяется сразу. Возвращает True, если отмена принята."""
+    if job_id in _running:
+        _running[job_id] = 'cancelled'
+        return True
+    return await async_db.set_broadcast_status(job_id, 'cancelled', from_statuses=('paused',))
+
+async def resume_broadcasts_job(context):
+    """Продолжить рассылки, прерванные перезапуском бота (запускается при старте)"""
+    try:
+        for job in await async_db.get_unfinished_broadcast_jobs(statuses=('running',)):
+            logger.info(f"Продолжаем рассылку #{job['id']} с пользователя id > {job['cursor_user_id']}")
+            start_broadcast(context.application, job['id'])
+    except Exception as e:
+        logger.error(f"Ошибка продолжения рассылок: {e}")
+
+def format_broadcast_report(job, status, duration=None, error=None):
+    """Текст отчета о рассылке для администратора"""
+    counters = (
+        f"<b>Аудитория:</b> {job_audience(job)}\n"
+        f"<b>Отправлено успешно:</b> {job['sent']}\n"
+        f"<b>Не удалось отправить:</b> {job['failed']}\n"
+        f"<b>Из них недоступные чаты:</b> {job['blocked']}\n"
+    )
+    if status == 'done':
+        message = (
+            f"✅ <b>{job['title']} ЗАВЕРШЕНА</b>\n\n"
+            f"{counters}"
+            f"<b>Всего пользователей:</b> {job['sent'] + job['failed']}\n"
+        )
+        if duration is not None:
+            message += f"<b>Время:</b> {duration:.1f} сек."
+        return message
+    if status == 'paused':
+        message = f"⏸ <b>{job['title']} ПРИОСТАНОВЛЕНА</b>\n\n{counters}"
+        if error:
+            message += f"\n❌ Ошибка: {error}\n"
+        return message + "\nМожно продолжить с места остановки."
+    return f"⏹ <b>{job['title']} ОТМЕНЕНА</b>\n\n{counters}"
+
+def format_broadcast_progress(job, base, stats):
+    """Живой прогресс рассылки: base - счетчики до этого запуска, stats - текущего"""
+    sent = base['sent'] + stats.sent
+    failed = base['failed'] + stats.failed
+    remaining = max(job['total'] - base['sent'] - base['failed'], 0)
+    return (
+        f"🔄 <b>{job['title']} #{job['id']} ИДЕТ</b>\n\n"
+        f"<b>Отправлено:</b> {sent} из {job['total']}\n"
+        f"<b>Не удалось отправить:</b> {failed} (недоступные чаты: {base['blocked'] + stats.blocked})\n"
+        f"<b>Скорость:</b> {stats.throughput:.1f} сообщ./сек.\n"
+        f"<b>Осталось:</b> {format_duration(stats.eta(remaining))}"
+    )
+
+async def _run_broadcast(bot, job_id):
+    """Тело фоновой рассылки.
+
+    Получатели читаются порциями по id начиная с контрольной точки. Контрольная
+    точка - id, до которого включительно все получатели уже обработаны (отправки
+    идут параллельно и завершаются не по порядку). После сбоя процесса рассылка
+    продолжается с нее, поэтому повторно могут получить сообщение только
+    последние несколько получателей.
+    """
+    job = None
+    status = 'paused'
+    error_text = None
+    stats = DeliveryStats()
+    progress = {'cursor': 0, 'sent': 0, 'failed': 0, 'blocked': 0}
+    reporter = None
+
+    try:
+        job = await async_db.get_broadcast_job(job_id)
+        if not job:
+            logger.error(f"Рассылка #{job_id} не найдена")
+            return
+
+        progress = {'cursor': job['cursor_user_id'], 'sent': job['sent'],
+                    'failed': job['failed'], 'blocked': job['blocked']}
+        base = dict(progress)
+        payload = payload_from_job(job)
+        recipients = async_db.stream('iter_broadcast_recipients', job_id, after_id=job['cursor_user_id'])
+        undeliverable = {}
+        in_flight = deque()  # id получателей в порядке выдачи
+        finished = set()
+
+        async def publish_progress():
+            # После паузы или отмены сообщение уже сообщает об остановке
+            if _running.get(job_id) == 'running' and job['report_chat_id']:
+                await bot.edit_message_text(
+                    chat_id=job['report_chat_id'],
+                    message_id=job['report_message_id'],
+                    text=format_broadcast_progress(job, base, stats),
+                    reply_markup=broadcast_keyboard(job_id, 'running'),
+                    parse_mode='HTML'
+                )
+
+        # Правки сообщения-отчета сливаются: не чаще нескольких в минуту
+        reporter = ThrottledProgress(publish_progress)
+
+        async def feed():
+            try:
+                async for user in recipients:
+                    # Пауза или отмена: новых получателей не берем
+                    if _running.get(job_id) != 'running':
+                        return
+                    in_flight.append(user['id'])
+                    yield user
+            finally:
+                await recipients.aclose()
+
+        async def checkpoint(status=None, last_error=None):
+            progress.update(sent=base['sent'] + stats.sent,
+                            failed=base['failed'] + stats.failed,
+                            blocked=base['blocked'] + stats.blocked)
+            await async_db.save_broadcast_progress(
+                job_id, progress['cursor'], progress['sent'], progress['failed'], progress['blocked'],
+                status=status, last_error=last_error
+            )
+
+        async def on_result(user, error):
+            chat_state = chat_state_for_error(error) if error else None
+            if chat_state:
+                undeliverable[user['telegram_id']] = chat_state
+                if len(undeliverable) >= UNDELIVERABLE_FLUSH_SIZE:
+                    batch = dict(undeliverable)
+                    undeliverable.clear()
+                    await async_db.mark_chats_undeliverable(batch)
+
+            # Сдвигаем контрольную точку на непрерывно обработанный префикс
+            finished.add(user['id'])
+            while in_flight and in_flight[0] in finished:
+                progress['cursor'] = in_flight.popleft()
+                finished.discard(progress['cursor'])
+            if stats.total % CHECKPOINT_EVERY == 0:
+                await checkpoint()
+            reporter.update()
+
+        await fan_out(
+            feed(),
+            lambda user: payload.send(bot, user['telegram_id']),
+            chat_id_of=lambda user: user['telegram_id'],
+            on_result=on_result,
+            stats=stats
+        )
+        await async_db.mark_chats_undeliverable(undeliverable)
+
+        requested = _running.get(job_id, 'running')
+        status = 'done' if requested == 'running' else requested
+        await checkpoint(status=status)
+        logger.info(f"{job['title']} #{job_id}: {status}, {stats.summary()}")
+    except Exception as e:
+        logger.error(f"Ошибка рассылки #{job_id}: {e}")
+        # Сбой (в том числе чтения получателей) - рассылка не завершена: ставим
+        # на паузу с контрольной точкой, снимок получателей сохраняется
+        status = 'paused'
+        error_text = str(e)[:500]
+        if job:
+            progress.update(sent=job['sent'] + stats.sent,
+                            failed=job['failed'] + stats.failed,
+                            blocked=job['blocked'] + stats.blocked)
+        await async_db.save_broadcast_progress(
+            job_id, progress['cursor'], progress['sent'], progress['failed'], progress['blocked'],
+            status=status, last_error=error_text
+        )
+    finally:
+        if reporter:
+            await reporter.close()
+        _running.pop(job_id, None)
+
+    job = await async_db.get_broadcast_job(job_id)
+    if not job or not job['report_chat_id']:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job['report_chat_id'],
+            message_id=job['report_message_id'],
+            text=format_broadcast_report(job, status, stats.duration, error_text),
+            reply_markup=broadcast_keyboard(job_id, status),
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logger.error(f"Не удалось показать итоги рассылки: {e}")
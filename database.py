@@ -1,435 +1,2147 @@
 # database.py - исправленная версия
 import sqlite3
+import calendar
 import os
-from datetime import datetime, timedelta
+import queue
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta, time as dt_time
+from zoneinfo import ZoneInfo
+
+# За сколько дней до платежа приходят уведомления. За 1 день - всем,
+# остальные сроки - только пользователям с действующим премиумом
+NOTIFICATION_OFFSETS = (1, 3, 7)
+FREE_NOTIFICATION_OFFSET = 1
+
+# Время уведомлений по умолчанию: 10:00 по Москве
+DEFAULT_TIMEZONE = 'Europe/Moscow'
+DEFAULT_NOTIFY_HOUR = 10
+
+# Уведомления одного часового слота (UTC). Выборка идет от активных пользователей
+# слота (idx_users_notify_slot_active) к их напоминаниям (idx_reminders_user_due), поэтому
+# каждый слот читает только своих пользователей. :today - дата в поясе пользователей
+SLOT_NOTIFICATIONS_SQL = '''
+    SELECT r.id, r.user_id, r.title, r.amount, r.payment_date,
+           u.telegram_id, u.username, u.first_name,
+           (u.is_premium AND (u.premium_until IS NULL OR u.premium_until >= :today)) AS is_premium,
+           CAST(julianday(r.payment_date) - julianday(:today) AS INTEGER) AS days_before
+    FROM users u
+    JOIN reminders r ON r.user_id = u.id
+    WHERE u.notify_utc_hour = :slot_hour
+    AND u.timezone = :timezone
+    AND u.delivery_state = 'active'
+    AND r.payment_date IN (:date_1, :date_3, :date_7)
+    AND r.is_paid = FALSE
+    AND (r.payment_date = :date_free
+         OR (u.is_premium AND (u.premium_until IS NULL OR u.premium_until >= :today)))
+'''
+
+# Догоняющая выборка после простоя: все неоплаченные напоминания активных
+# пользователей в диапазоне дат, порциями по idx_reminders_due: каждая порция
+# начинается поиском по индексу сразу после ключа (payment_date, user_id, id)
+# предыдущей. Какие из них были пропущены, решается по слотам пользователя
+# в Database.enqueue_missed_notifications
+MISSED_NOTIFICATIONS_SQL = '''
+    SELECT r.id, r.user_id, r.title, r.amount, r.payment_date,
+           u.telegram_id, u.timezone, u.notify_utc_hour,
+           (u.is_premium AND (u.premium_until IS NULL OR u.premium_until >= :today)) AS is_premium
+    FROM reminders r
+    JOIN users u ON r.user_id = u.id
+    WHERE (r.payment_date, r.user_id, r.id) > (:after_date, :after_user_id, :after_id)
+    AND r.payment_date <= :date_last
+    AND r.is_paid = FALSE
+    AND u.delivery_state = 'active'
+    ORDER BY r.payment_date, r.user_id, r.id
+    LIMIT :limit
+'''
+
+# Сегменты аудитории рассылок: условия выборки id пользователей. Каждое
+# условие ищется по индексу: idx_users_premium_active, idx_users_free_active,
+# idx_users_last_seen_active (частичные - только доступные чаты) и
+# idx_reminders_due для платежей недели. Параметры - Database._segment_params
+AUDIENCE_SEGMENTS = {
+    'all': (),
+    # Действующий премиум (флаг мог еще не сняться фоновой проверкой)
+    'premium': ('is_premium = TRUE', '(premium_until IS NULL OR premium_until >= :today)'),
+    # Премиум, который закончится в ближайшие :days дней
+    'premium_expiring': ('is_premium = TRUE', 'premium_until BETWEEN :today AND :until'),
+    # Бесплатные пользователи, исчерпавшие лимит напоминаний
+    'free_at_limit': ('is_premium = FALSE', 'reminders_count >= :free_limit'),
+    # Есть неоплаченный платеж в ближайшие 7 дней
+    'due_this_week': ('id IN (SELECT user_id FROM reminders '
+                      'WHERE payment_date BETWEEN :today AND :week_end AND is_paid = FALSE)',),
+    # Не писали боту :days дней и больше
+    'inactive': ('last_seen_at < :seen_before',),
+}
+
+# Снимок профиля пользователя (Database.get_user_profile): премиум считается
+# действующим на :today, сумма - CAST, чтобы целые суммы не приходили как int
+USER_PROFILE_COLUMNS = '''
+    id,
+    (is_premium AND (premium_until IS NULL OR premium_until >= :today)) AS has_premium,
+    premium_until,
+    reminders_count,
+    CAST(reminders_total AS REAL) AS reminders_total
+'''
+
+# Правила повторения платежей: в reminders хранится только ближайшая дата
+# (payment_date), после наступления она сдвигается на следующую
+RECURRENCE_RULES = ('days', 'weekly', 'monthly', 'yearly')
+
+def add_months(value, months, anchor_day):
+    """Сдвинуть дату на months месяцев, день - anchor_day (или последний день короткого месяца)"""
+    month_index = value.year * 12 + value.month - 1 + months
+    year, month = divmod(month_index, 12)
+    day = min(anchor_day, calendar.monthrange(year, month + 1)[1])
+    return date(year, month + 1, day)
+
+def next_payment_date(payment_date, recurrence, interval, anchor_day, today):
+    """Ближайшая дата серии не раньше today.
+
+    Считается сразу, без перебора всех пропущенных повторов: для
+    дней и недель - делением, для месяцев и лет - по числу месяцев.
+    anchor_day - исходный день месяца (31-е в феврале становится 28/29-м,
+    а в марте снова 31-м).
+    """
+    if payment_date >= today or recurrence not in RECURRENCE_RULES:
+        return payment_date
+    interval = max(1, interval or 1)
+
+    if recurrence in ('days', 'weekly'):
+        step = interval * (7 if recurrence == 'weekly' else 1)
+        periods = -(-(today - payment_date).days // step)
+        return payment_date + timedelta(days=periods * step)
+
+    step = interval * (12 if recurrence == 'yearly' else 1)
+    anchor_day = anchor_day or payment_date.day
+    months = (today.year - payment_date.year) * 12 + today.month - payment_date.month
+    periods = max(1, -(-months // step))
+    candidate = add_months(payment_date, periods * step, anchor_day)
+    while candidate < today:
+        periods += 1
+        candidate = add_months(payment_date, periods * step, anchor_day)
+    return candidate
+
+# Точные напоминания, срок которых наступает до :until (прошедшие тоже - бот мог
+# не работать). Идут по частичному индексу idx_reminders_remind_at
+EXACT_ALERTS_SQL = '''
+    SELECT r.id, r.title, r.amount, r.payment_date, r.remind_at, r.remind_time, u.telegram_id
+    FROM reminders r
+    JOIN users u ON r.user_id = u.id
+    WHERE r.remind_at IS NOT NULL AND r.remind_at <= :until
+    AND u.delivery_state = 'active'
+    ORDER BY r.remind_at
+'''
+
+def remind_at_for(timezone, payment_date, remind_time):
+    """Момент точного напоминания: remind_time («ЧЧ:ММ») местного дня payment_date - во времени сервера"""
+    hour, minute = map(int, remind_time.split(':'))
+    local_remind = datetime.combine(payment_date, dt_time(hour=hour, minute=minute), tzinfo=ZoneInfo(timezone))
+    return local_remind.astimezone().replace(tzinfo=None)
+
+def local_day_end(zone, local_date):
+    """Конец местного дня local_date в поясе zone - во времени сервера (без tzinfo)"""
+    day_end = datetime.combine(local_date + timedelta(days=1), dt_time.min, tzinfo=zone)
+    return day_end.astimezone().replace(tzinfo=None)
+
+def notify_utc_hour(timezone, notify_hour):
+    """Час UTC, на который приходится notify_hour по местному времени.
+
+    Смещение берется на сегодня, поэтому после перехода на летнее время
+    значения нужно пересчитать (Database.refresh_notification_slots).
+    Для поясов с получасовым смещением это начало часа UTC, в котором
+    наступает notify_hour.
+    """
+    zone = ZoneInfo(timezone)
+    local_notify = datetime.combine(datetime.now(zone).date(), dt_time(hour=notify_hour), tzinfo=zone)
+    return local_notify.astimezone(ZoneInfo('UTC')).hour
+
+# Размер порции потокового чтения (iter_*)
+STREAM_CHUNK_SIZE = 1000
+
+# Очередь уведомлений: число попыток и задержка перед повтором (удваивается)
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
 
 class Database:
-    def __init__(self, db_path='reminders.db'):
+    def __init__(self, db_path='reminders.db', pool_size=5, busy_timeout=5000, user_cache_size=10000,
+                 profile_cache_ttl=300):
         self.db_path = db_path
+        self.pool_size = pool_size          # Максимум одновременно открытых подключений
+        self.busy_timeout = busy_timeout    # Сколько ждать блокировку БД (мс)
+
+        # LRU-кэш: telegram_id -> (id, username, first_name, last_name, день последнего обращения)
+        self.user_cache_size = user_cache_size
+        self._user_cache = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+
+        # Кэш снимков профиля (get_user_profile): user_id -> (снимок, until_date, expires_at).
+        # Сбрасывается при изменении премиума и напоминаний пользователя
+        self.profile_cache_ttl = profile_cache_ttl
+        self._profile_cache = OrderedDict()
+        self._profile_cache_lock = threading.Lock()
+
+        # Пул переиспользуемых подключений
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pool_lock = threading.Lock()
+        self._created_connections = 0
+
+        # Создаем папку для базы данных один раз, а не на каждый запрос
+        os.makedirs(os.path.dirname(self.db_path) if os.path.dirname(self.db_path) else '.', exist_ok=True)
+
         self.init_db()  # Инициализируем БД при создании
-        
-    def get_connection(self):
-        """Создает подключение к базе данных"""
-        try:
-            # Создаем папку для базы данных если её нет
-            os.makedirs(os.path.dirname(self.db_path) if os.path.dirname(self.db_path) else '.', exist_ok=True)
-            
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            return conn
-        except Exception as e:
-            print(f"❌ Ошибка подключения к БД: {e}")
-            return None
-    
+
+    # ========== ПУЛ ПОДКЛЮЧЕНИЙ ==========
+
+    def _create_connection(self):
+        """Создает новое подключение к базе данных"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+
+        # WAL позволяет читать параллельно с записью
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        return conn
+
+    def _acquire(self):
+        """Взять подключение из пула (или создать, если лимит не достигнут)"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._pool_lock:
+            if self._created_connections < self.pool_size:
+                self._created_connections += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._create_connection()
+            except Exception:
+                with self._pool_lock:
+                    self._created_connections -= 1
+                raise
+
+        # Все подключения заняты - ждем освобождения
+        return self._pool.get(timeout=self.busy_timeout / 1000)
+
+    def _release(self, conn):
+        """Вернуть подключение в пул"""
+        try:
+            # Незакоммиченные изменения не должны попасть к следующему пользователю
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put_nowait(conn)
+        except Exception:
+            # Подключение сломано или пул переполнен - закрываем его
+            with self._pool_lock:
+                self._created_connections -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self):
+        """Взять подключение из пула на время блока with"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Закрыть все подключения пула"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            with self._pool_lock:
+                self._created_connections -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    # ========== СХЕМА ==========
+
     def init_db(self):
         """Инициализация базы данных"""
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return False
-                
-            cursor = conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_premium BOOLEAN DEFAULT FALSE,
-                    premium_until DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица напоминаний
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    payment_date DATE NOT NULL,
-                    is_paid BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            # Индексы для оптимизации
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON reminders(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_payment_date ON reminders(payment_date)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_telegram_id ON users(telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_premium_until ON users(premium_until)')
-            
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+
+                # Таблица пользователей
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        telegram_id INTEGER UNIQUE NOT NULL,
+                        username TEXT,
+                        first_name TEXT,
+                        last_name TEXT,
+                        is_premium BOOLEAN DEFAULT FALSE,
+                        premium_until DATE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                # Таблица напоминаний
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS reminders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        title TEXT NOT NULL,
+                        amount REAL NOT NULL,
+                        payment_date DATE NOT NULL,
+                        is_paid BOOLEAN DEFAULT FALSE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                    )
+                ''')
+
+                # Индексы для оптимизации
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON reminders(user_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_payment_date ON reminders(payment_date)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_telegram_id ON users(telegram_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_premium_until ON users(premium_until)')
+
+                # Частичный покрывающий индекс для ежедневной рассылки: только неоплаченные,
+                # упорядочены по (дата, пользователь). is_paid включен в индекс, иначе SQLite
+                # ходит в таблицу за значением из WHERE
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_reminders_due
+                    ON reminders(payment_date, user_id, id, title, amount, is_paid)
+                    WHERE is_paid = FALSE
+                ''')
+
+                # Админ-просмотр пользователей: постраничный курсор и поиск по username
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE)')
+
+                # Для статистики активности (новые напоминания за неделю)
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_created_at ON reminders(created_at, user_id)')
+
+                # Время уведомлений пользователя: часовой пояс, час по местному времени
+                # и соответствующий час UTC, по которому выбирается слот рассылки
+                self._add_column(cursor, 'users', 'timezone', f"TEXT NOT NULL DEFAULT '{DEFAULT_TIMEZONE}'")
+                self._add_column(cursor, 'users', 'notify_hour', f"INTEGER NOT NULL DEFAULT {DEFAULT_NOTIFY_HOUR}")
+                self._add_column(cursor, 'users', 'notify_utc_hour',
+                                 f"INTEGER NOT NULL DEFAULT {notify_utc_hour(DEFAULT_TIMEZONE, DEFAULT_NOTIFY_HOUR)}")
+
+                # Доступность чата: active, blocked (бот заблокирован) или deactivated
+                # (аккаунт удален / чат не найден). Рассылки и уведомления идут только
+                # активным - частичные индексы ниже содержат только их
+                self._add_column(cursor, 'users', 'delivery_state', "TEXT NOT NULL DEFAULT 'active'")
+                self._add_column(cursor, 'users', 'delivery_state_at', 'TIMESTAMP')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_active ON users(id) WHERE delivery_state = 'active'")
+
+                # Счетчики напоминаний пользователя (поддерживаются триггерами): число
+                # и сумма неоплаченных - для профиля и сегментов рассылок. И день
+                # последнего обращения к боту
+                if self._add_column(cursor, 'users', 'reminders_count', 'INTEGER NOT NULL DEFAULT 0'):
+                    cursor.execute('''
+                        UPDATE users
+                        SET reminders_count = (SELECT COUNT(*) FROM reminders WHERE reminders.user_id = users.id)
+                    ''')
+                if self._add_column(cursor, 'users', 'reminders_total', 'REAL NOT NULL DEFAULT 0'):
+                    cursor.execute('''
+                        UPDATE users
+                        SET reminders_total = (SELECT COALESCE(SUM(CASE WHEN is_paid THEN 0 ELSE amount END), 0)
+                                               FROM reminders WHERE reminders.user_id = users.id)
+                    ''')
+                if self._add_column(cursor, 'users', 'last_seen_at', 'DATE'):
+                    cursor.execute('UPDATE users SET last_seen_at = date(created_at)')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_premium_active
+                    ON users(premium_until)
+                    WHERE delivery_state = 'active' AND is_premium = TRUE
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_free_active
+                    ON users(reminders_count)
+                    WHERE delivery_state = 'active' AND is_premium = FALSE
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_last_seen_active
+                    ON users(last_seen_at)
+                    WHERE delivery_state = 'active'
+                ''')
+
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_notify_slot_active
+                    ON users(notify_utc_hour, timezone)
+                    WHERE delivery_state = 'active'
+                ''')
+
+                # Повторяющиеся платежи: правило, интервал и исходный день месяца.
+                # payment_date - ближайший повтор, поэтому выборки уведомлений не меняются
+                self._add_column(cursor, 'reminders', 'recurrence', 'TEXT')
+                self._add_column(cursor, 'reminders', 'recurrence_interval', 'INTEGER NOT NULL DEFAULT 1')
+                self._add_column(cursor, 'reminders', 'anchor_day', 'INTEGER')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_reminders_recurring
+                    ON reminders(payment_date)
+                    WHERE recurrence IS NOT NULL
+                ''')
+
+                # Точное напоминание: время в поясе пользователя и ближайший момент
+                # срабатывания во времени сервера (после отправки remind_at очищается)
+                self._add_column(cursor, 'reminders', 'remind_time', 'TEXT')
+                self._add_column(cursor, 'reminders', 'remind_at', 'TIMESTAMP')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_reminders_remind_at
+                    ON reminders(remind_at)
+                    WHERE remind_at IS NOT NULL
+                ''')
+
+                # Неоплаченные напоминания пользователя по дате - для выборки по слотам
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_reminders_user_due
+                    ON reminders(user_id, payment_date)
+                    WHERE is_paid = FALSE
+                ''')
+
+                # Очередь уведомлений: одна строка на (напоминание, срок, день запуска
+                # в поясе пользователя). Хранит снимок текста уведомления и состояние
+                # доставки, чтобы прерванный запуск продолжился без повторов.
+                # После expires_at (конец местного дня) уведомление уже неактуально.
+                # message и priority заполняет план отправки (готовое сообщение чата
+                # и очередность чата в слоте)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS notification_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        reminder_id INTEGER NOT NULL,
+                        offset_days INTEGER NOT NULL,
+                        run_date DATE NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        title TEXT NOT NULL,
+                        amount REAL NOT NULL,
+                        payment_date DATE NOT NULL,
+                        is_premium BOOLEAN DEFAULT FALSE,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at TIMESTAMP NOT NULL,
+                        claimed_at TIMESTAMP,
+                        expires_at TIMESTAMP,
+                        last_error TEXT,
+                        priority INTEGER NOT NULL DEFAULT 0,
+                        message TEXT,
+                        UNIQUE (reminder_id, offset_days, run_date)
+                    )
+                ''')
+
+                # Готовые к отправке строки по чатам: очередь забирается целыми чатами
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_outbox_pending
+                    ON notification_outbox(chat_id, next_attempt_at)
+                    WHERE status = 'pending'
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_outbox_sending
+                    ON notification_outbox(claimed_at)
+                    WHERE status = 'sending'
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_run_date ON notification_outbox(run_date)')
+
+                # Рассылки администратора: содержимое (тип text, photo, document,
+                # media_group и его JSON), сегмент аудитории (AUDIENCE_SEGMENTS) с
+                # параметрами в JSON, состояние и контрольная точка (id последнего
+                # обработанного пользователя) для продолжения после паузы или перезапуска бота
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        title TEXT NOT NULL,
+                        payload_kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        segment TEXT NOT NULL,
+                        segment_params TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'running',
+                        cursor_user_id INTEGER NOT NULL DEFAULT 0,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        sent INTEGER NOT NULL DEFAULT 0,
+                        failed INTEGER NOT NULL DEFAULT 0,
+                        blocked INTEGER NOT NULL DEFAULT 0,
+                        report_chat_id INTEGER,
+                        report_message_id INTEGER,
+                        last_error TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        finished_at TIMESTAMP
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)')
+
+                # Получатели рассылки: снимок сегмента на момент создания. Рассылка
+                # идет по ключу (job_id, user_id), как и продолжение с контрольной точки
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                        job_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        PRIMARY KEY (job_id, user_id)
+                    ) WITHOUT ROWID
+                ''')
+
+                # Состояние планировщиков: последний обработанный слот (водяной знак)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS scheduler_state (
+                        name TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                conn.commit()
+
+                self._init_statistics(conn)
             return True
-            
+
         except Exception as e:
             print(f"❌ Ошибка инициализации БД: {e}")
             return False
-    
+
+    def _add_column(self, cursor, table, column, definition):
+        """Добавить колонку в существующую таблицу, если ее еще нет. Возвращает True, если добавлена"""
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column in columns:
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+
+    def _init_statistics(self, conn):
+        """Таблицы счетчиков статистики и триггеры, которые их обновляют.
+
+        stats хранит готовые значения (пользователи, премиум, напоминания),
+        reminder_date_counts - количество напоминаний на каждую дату, чтобы
+        "активные" (дата >= сегодня) считались без просмотра всей таблицы.
+        """
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_date_counts (
+                payment_date DATE PRIMARY KEY,
+                cnt INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # Пользователи
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users
+            BEGIN
+                UPDATE stats SET value = value + 1 WHERE name = 'total_users';
+                UPDATE stats SET value = value + 1 WHERE name = 'premium_users' AND NEW.is_premium;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users
+            BEGIN
+                UPDATE stats SET value = value - 1 WHERE name = 'total_users';
+                UPDATE stats SET value = value - 1 WHERE name = 'premium_users' AND OLD.is_premium;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_users_premium AFTER UPDATE OF is_premium ON users
+            WHEN COALESCE(OLD.is_premium, FALSE) != COALESCE(NEW.is_premium, FALSE)
+            BEGIN
+                UPDATE stats SET value = value + (CASE WHEN NEW.is_premium THEN 1 ELSE -1 END)
+                WHERE name = 'premium_users';
+            END
+        ''')
+
+        # Напоминания
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_reminders_insert AFTER INSERT ON reminders
+            BEGIN
+                UPDATE stats SET value = value + 1 WHERE name = 'total_reminders';
+                INSERT INTO reminder_date_counts (payment_date, cnt) VALUES (NEW.payment_date, 1)
+                ON CONFLICT(payment_date) DO UPDATE SET cnt = cnt + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_reminders_delete AFTER DELETE ON reminders
+            BEGIN
+                UPDATE stats SET value = value - 1 WHERE name = 'total_reminders';
+                UPDATE reminder_date_counts SET cnt = cnt - 1 WHERE payment_date = OLD.payment_date;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_reminders_date AFTER UPDATE OF payment_date ON reminders
+            WHEN OLD.payment_date IS NOT NEW.payment_date
+            BEGIN
+                UPDATE reminder_date_counts SET cnt = cnt - 1 WHERE payment_date = OLD.payment_date;
+                INSERT INTO reminder_date_counts (payment_date, cnt) VALUES (NEW.payment_date, 1)
+                ON CONFLICT(payment_date) DO UPDATE SET cnt = cnt + 1;
+            END
+        ''')
+
+        # Счетчики пользователя: users.reminders_count и users.reminders_total
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_counters_insert AFTER INSERT ON reminders
+            BEGIN
+                UPDATE users
+                SET reminders_count = reminders_count + 1,
+                    reminders_total = reminders_total + (CASE WHEN NEW.is_paid THEN 0 ELSE NEW.amount END)
+                WHERE id = NEW.user_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_counters_delete AFTER DELETE ON reminders
+            BEGIN
+                UPDATE users
+                SET reminders_count = reminders_count - 1,
+                    reminders_total = reminders_total - (CASE WHEN OLD.is_paid THEN 0 ELSE OLD.amount END)
+                WHERE id = OLD.user_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_counters_update AFTER UPDATE OF amount, is_paid ON reminders
+            WHEN OLD.amount IS NOT NEW.amount OR OLD.is_paid IS NOT NEW.is_paid
+            BEGIN
+                UPDATE users
+                SET reminders_total = reminders_total
+                                      - (CASE WHEN OLD.is_paid THEN 0 ELSE OLD.amount END)
+                                      + (CASE WHEN NEW.is_paid THEN 0 ELSE NEW.amount END)
+                WHERE id = NEW.user_id;
+            END
+        ''')
+
+        # Первый запуск: заполняем счетчики по существующим данным
+        cursor.execute("SELECT COUNT(*) FROM stats")
+        if cursor.fetchone()[0] == 0:
+            self._recount_statistics(cursor)
+
+        conn.commit()
+
+    def _recount_statistics(self, cursor):
+        """Пересчитать счетчики полным проходом по таблицам"""
+        cursor.execute('''
+            INSERT OR REPLACE INTO stats (name, value)
+            SELECT 'total_users', COUNT(*) FROM users
+            UNION ALL SELECT 'premium_users', COUNT(*) FROM users WHERE is_premium = TRUE
+            UNION ALL SELECT 'total_reminders', COUNT(*) FROM reminders
+        ''')
+        cursor.execute("DELETE FROM reminder_date_counts")
+        cursor.execute('''
+            INSERT INTO reminder_date_counts (payment_date, cnt)
+            SELECT payment_date, COUNT(*) FROM reminders GROUP BY payment_date
+        ''')
+        cursor.execute('''
+            UPDATE users
+            SET reminders_count = (SELECT COUNT(*) FROM reminders WHERE reminders.user_id = users.id),
+                reminders_total = (SELECT COALESCE(SUM(CASE WHEN is_paid THEN 0 ELSE amount END), 0)
+                                   FROM reminders WHERE reminders.user_id = users.id)
+        ''')
+
+    def reconcile_statistics(self):
+        """Сверить счетчики статистики с таблицами (полный пересчет, раз в сутки)"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                self._recount_statistics(cursor)
+
+                # Статистика читает только даты от сегодня: прошедшие и пустые не нужны
+                cursor.execute(
+                    "DELETE FROM reminder_date_counts WHERE cnt <= 0 OR payment_date < ?",
+                    (date.today().strftime('%Y-%m-%d'),)
+                )
+                conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"❌ Ошибка пересчета статистики: {e}")
+            return False
+
+    def _hot_queries(self):
+        """Запросы, которые обязаны работать по индексу: (название, SQL, параметры)"""
+        return [
+            ('enqueue_missed_notifications', MISSED_NOTIFICATIONS_SQL,
+             {'today': '2000-01-01', 'after_date': '2000-01-01', 'after_user_id': 0, 'after_id': 0,
+              'date_last': '2000-01-08', 'limit': STREAM_CHUNK_SIZE}),
+            ('enqueue_slot_notifications', SLOT_NOTIFICATIONS_SQL,
+             dict(self._due_notification_params(datetime(2000, 1, 1).date()), slot_hour=7, timezone=DEFAULT_TIMEZONE)),
+            ('get_exact_alerts', EXACT_ALERTS_SQL, {'until': '2000-01-01 00:00:00'}),
+            ('get_user_by_username',
+             'SELECT id FROM users WHERE username = ? COLLATE NOCASE', ('username',)),
+        ] + [
+            # Сегменты рассылок, кроме "все" (он читает частичный индекс активных целиком)
+            (f'segment {segment}', self._segment_query(segment), self._segment_params(7, 5, date(2000, 1, 1)))
+            for segment in AUDIENCE_SEGMENTS if segment != 'all'
+        ]
+
+    def check_query_plans(self):
+        """Проверить планы горячих запросов через EXPLAIN QUERY PLAN.
+
+        Возвращает список проблем: полный просмотр таблицы (SCAN) или
+        сортировка во временном B-дереве. Пустой список - все в порядке.
+        """
+        problems = []
+        try:
+            # Отдельное подключение: кэш подготовленных запросов у подключений
+            # пула может вернуть план, построенный до изменения схемы
+            conn = self._create_connection()
+            try:
+                for name, sql, params in self._hot_queries():
+                    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+                        detail = row[3]
+                        if detail.startswith('SCAN') or 'TEMP B-TREE' in detail:
+                            problems.append(f"{name}: {detail}")
+            finally:
+                conn.close()
+        except Exception as e:
+            problems.append(f"Ошибка проверки планов запросов: {e}")
+        return problems
+
+    # ========== ПОЛЬЗОВАТЕЛИ ==========
+
     def get_or_create_user(self, telegram_id, username=None, first_name=None, last_name=None):
         """Получить или создать пользователя"""
+        # День обращения - часть профиля: last_seen_at пишется не чаще раза в день
+        profile = (username, first_name, last_name, date.today().isoformat())
+
+        # Повторные обращения не ходят в БД, пока профиль не изменился
+        with self._user_cache_lock:
+            cached = self._user_cache.get(telegram_id)
+            if cached is not None:
+                self._user_cache.move_to_end(telegram_id)
+                if cached[1:] == profile:
+                    return cached[0]
+
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return None
-                
-            cursor = conn.cursor()
-            
-            # Пытаемся найти пользователя
-            cursor.execute(
-                'SELECT id FROM users WHERE telegram_id = ?',
-                (telegram_id,)
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                user_id = result[0]
-            else:
-                # Создаем нового пользователя
+            with self.connection() as conn:
+                cursor = conn.cursor()
+
+                # Один запрос: создаем пользователя или обновляем изменившийся профиль.
+                # Пользователь написал боту - значит, чат снова доступен
                 cursor.execute('''
-                    INSERT INTO users (telegram_id, username, first_name, last_name)
-                    VALUES (?, ?, ?, ?)
-                ''', (telegram_id, username, first_name, last_name))
+                    INSERT INTO users (telegram_id, username, first_name, last_name, last_seen_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(telegram_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        last_seen_at = excluded.last_seen_at,
+                        delivery_state = 'active',
+                        delivery_state_at = CASE WHEN users.delivery_state != 'active'
+                                                 THEN datetime('now', 'localtime')
+                                                 ELSE users.delivery_state_at END
+                    WHERE users.username IS NOT excluded.username
+                       OR users.first_name IS NOT excluded.first_name
+                       OR users.last_name IS NOT excluded.last_name
+                       OR users.last_seen_at IS NOT excluded.last_seen_at
+                       OR users.delivery_state != 'active'
+                    RETURNING id
+                ''', (telegram_id,) + profile)
+                result = cursor.fetchone()
+
+                if result is None:
+                    # Профиль не изменился - UPDATE пропущен, берем id отдельно
+                    cursor.execute(
+                        'SELECT id FROM users WHERE telegram_id = ?',
+                        (telegram_id,)
+                    )
+                    result = cursor.fetchone()
+
                 conn.commit()
-                user_id = cursor.lastrowid
-            
-            conn.close()
+                user_id = result[0]
+
+            self._remember_user(telegram_id, user_id, profile)
             return user_id
-                
+
         except Exception as e:
             print(f"❌ Ошибка создания пользователя: {e}")
             return None
-    
-    def get_user_premium_status(self, user_id):
-        """Получить статус премиума пользователя"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return {'has_active_premium': False}
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT is_premium, premium_until 
-                FROM users 
-                WHERE id = ?
-            ''', (user_id,))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                is_premium = bool(result[0])
-                premium_until = result[1]
-                
-                # Проверяем, не истек ли премиум
-                if is_premium and premium_until:
-                    try:
-                        until_date = datetime.strptime(premium_until, '%Y-%m-%d').date()
-                        if until_date < datetime.now().date():
-                            # Премиум истек - обновляем статус
-                            cursor.execute(
-                                'UPDATE users SET is_premium = FALSE WHERE id = ?',
-                                (user_id,)
-                            )
-                            conn.commit()
-                            is_premium = False
-                    except:
-                        pass
-                
-                result_dict = {
-                    'has_active_premium': is_premium,
-                    'premium_until': premium_until
-                }
-            else:
-                result_dict = {'has_active_premium': False}
-            
-            conn.close()
-            return result_dict
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения статуса премиума: {e}")
-            
-        return {'has_active_premium': False}
-    
-    def get_user_reminders_count(self, user_id):
-        """Получить количество напоминаний пользователя"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return 0
-                
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT COUNT(*) FROM reminders WHERE user_id = ?',
-                (user_id,)
-            )
-            count = cursor.fetchone()[0]
-            conn.close()
-            return count or 0
-                
+
+    def get_user_profile(self, telegram_id, username=None, first_name=None, last_name=None):
+        """Снимок профиля пользователя одним запросом.
+
+        Регистрирует пользователя (как get_or_create_user) и возвращает
+        {'id', 'has_premium', 'premium_until', 'reminders_count', 'reminders_total'}
+        по счетчикам users. Если профиль не менялся (LRU-кэш), снимок берется
+        из кэша профилей без запроса, при промахе - чтение по telegram_id.
+        Новый или изменившийся профиль - UPSERT ... RETURNING. None при ошибке.
+        """
+        profile = (username, first_name, last_name, date.today().isoformat())
+        params = {'telegram_id': telegram_id, 'username': username, 'first_name': first_name,
+                  'last_name': last_name, 'today': profile[3]}
+
+        with self._user_cache_lock:
+            cached = self._user_cache.get(telegram_id)
+            unchanged = cached is not None and cached[1:] == profile
+
+        if unchanged:
+            snapshot = self._get_cached_profile(cached[0])
+            if snapshot is not None:
+                return snapshot
+
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                row = None
+                if unchanged:
+                    cursor.execute(f'SELECT {USER_PROFILE_COLUMNS} FROM users WHERE telegram_id = :telegram_id', params)
+                    row = cursor.fetchone()
+
+                if row is None:
+                    cursor.execute(f'''
+                        INSERT INTO users (telegram_id, username, first_name, last_name, last_seen_at)
+                        VALUES (:telegram_id, :username, :first_name, :last_name, :today)
+                        ON CONFLICT(telegram_id) DO UPDATE SET
+                            username = excluded.username,
+                            first_name = excluded.first_name,
+                            last_name = excluded.last_name,
+                            last_seen_at = excluded.last_seen_at,
+                            delivery_state = 'active',
+                            delivery_state_at = CASE WHEN users.delivery_state != 'active'
+                                                     THEN datetime('now', 'localtime')
+                                                     ELSE users.delivery_state_at END
+                        RETURNING {USER_PROFILE_COLUMNS}
+                    ''', params)
+                    row = cursor.fetchone()
+                    conn.commit()
+
+            snapshot = dict(row)
+            snapshot['has_premium'] = bool(snapshot['has_premium'])
+            self._remember_user(telegram_id, snapshot['id'], profile)
+            self._cache_profile(snapshot['id'], snapshot)
+            return snapshot
+
         except Exception as e:
-            print(f"❌ Ошибка подсчета напоминаний: {e}")
-            return 0
-    
+            print(f"❌ Ошибка получения профиля пользователя: {e}")
+            return None
+
+    def _remember_user(self, telegram_id, user_id, profile):
+        """Положить пользователя в LRU-кэш"""
+        with self._user_cache_lock:
+            self._user_cache[telegram_id] = (user_id,) + tuple(profile)
+            self._user_cache.move_to_end(telegram_id)
+            while len(self._user_cache) > self.user_cache_size:
+                self._user_cache.popitem(last=False)
+
+    def get_user_by_telegram_id(self, telegram_id):
+        """Найти пользователя по Telegram ID"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT id, telegram_id, username FROM users WHERE telegram_id = ?',
+                    (telegram_id,)
+                )
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+        except Exception as e:
+            print(f"❌ Ошибка поиска пользователя: {e}")
+            return None
+
+    def get_user_by_username(self, username):
+        """Найти пользователя по username (без @, без учета регистра)"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT id, telegram_id, username FROM users WHERE username = ? COLLATE NOCASE',
+                    (username,)
+                )
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+        except Exception as e:
+            print(f"❌ Ошибка поиска пользователя: {e}")
+            return None
+
+    def get_users_page(self, cursor=None, direction='older', limit=15):
+        """Страница пользователей, от новых к старым.
+
+        cursor - пара (created_at, id) крайнего пользователя предыдущей
+        страницы; direction - 'older' (следующая страница) или 'newer'
+        (предыдущая). Страница выбирается по индексу idx_users_created,
+        без OFFSET, поэтому любая страница отдается одинаково быстро.
+        """
+        fields = 'id, telegram_id, username, first_name, is_premium, premium_until, created_at'
+        try:
+            with self.connection() as conn:
+                db_cursor = conn.cursor()
+
+                if cursor is None:
+                    db_cursor.execute(f'''
+                        SELECT {fields} FROM users
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
+                    ''', (limit + 1,))
+                elif direction == 'newer':
+                    db_cursor.execute(f'''
+                        SELECT {fields} FROM users
+                        WHERE (created_at, id) > (?, ?)
+                        ORDER BY created_at ASC, id ASC
+                        LIMIT ?
+                    ''', (cursor[0], cursor[1], limit + 1))
+                else:
+                    db_cursor.execute(f'''
+                        SELECT {fields} FROM users
+                        WHERE (created_at, id) < (?, ?)
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
+                    ''', (cursor[0], cursor[1], limit + 1))
+
+                users = [dict(row) for row in db_cursor.fetchall()]
+
+            # Лишняя строка показывает, есть ли еще страница в этом направлении
+            has_more = len(users) > limit
+            users = users[:limit]
+
+            if cursor is not None and direction == 'newer':
+                users.reverse()
+                return {'users': users, 'has_newer': has_more, 'has_older': True}
+
+            return {'users': users, 'has_newer': cursor is not None, 'has_older': has_more}
+
+        except Exception as e:
+            print(f"❌ Ошибка получения пользователей: {e}")
+            return {'users': [], 'has_newer': False, 'has_older': False}
+
+    def search_users_by_username(self, prefix, limit=15):
+        """Найти пользователей, чей username начинается с prefix (без учета регистра)"""
+        try:
+            prefix = prefix.lstrip('@')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                # Диапазон [prefix, prefix + максимальный символ) идет по индексу
+                # idx_users_username_nocase, в отличие от LIKE с экранированием "_"
+                cursor.execute('''
+                    SELECT id, telegram_id, username, first_name, is_premium, premium_until, created_at
+                    FROM users
+                    WHERE username >= ? COLLATE NOCASE
+                    AND username < ? COLLATE NOCASE
+                    ORDER BY username COLLATE NOCASE
+                    LIMIT ?
+                ''', (prefix, prefix + '\U0010ffff', limit))
+
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"❌ Ошибка поиска пользователей: {e}")
+            return []
+
+    def _get_cached_profile(self, user_id):
+        """Снимок профиля из кэша или None, если записи нет или она устарела"""
+        with self._profile_cache_lock:
+            entry = self._profile_cache.get(user_id)
+            if entry is None:
+                return None
+
+            snapshot, until_date, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._profile_cache[user_id]
+                return None
+            self._profile_cache.move_to_end(user_id)
+
+        snapshot = dict(snapshot)
+        # Окончание подписки проверяем в памяти, без запроса к БД
+        if snapshot['has_premium'] and until_date and until_date < datetime.now().date():
+            snapshot['has_premium'] = False
+        return snapshot
+
+    def _cache_profile(self, user_id, snapshot):
+        """Запомнить снимок профиля на profile_cache_ttl секунд"""
+        until_date = None
+        if snapshot['premium_until']:
+            try:
+                until_date = datetime.strptime(snapshot['premium_until'], '%Y-%m-%d').date()
+            except ValueError:
+                pass
+
+        with self._profile_cache_lock:
+            self._profile_cache[user_id] = (dict(snapshot), until_date,
+                                            time.monotonic() + self.profile_cache_ttl)
+            self._profile_cache.move_to_end(user_id)
+            while len(self._profile_cache) > self.user_cache_size:
+                self._profile_cache.popitem(last=False)
+
+    def _invalidate_profile(self, user_id):
+        """Сбросить закэшированный снимок профиля"""
+        with self._profile_cache_lock:
+            self._profile_cache.pop(user_id, None)
+
+    # ========== НАПОМИНАНИЯ ==========
+
     def get_user_reminders(self, user_id):
         """Получить все напоминания пользователя"""
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return []
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, title, amount, payment_date, is_paid
-                FROM reminders 
-                WHERE user_id = ?
-                ORDER BY payment_date ASC
-            ''', (user_id,))
-            
-            reminders = []
-            for row in cursor.fetchall():
-                reminders.append(dict(row))
-            
-            conn.close()
-            return reminders
-                
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, title, amount, payment_date, is_paid, recurrence, recurrence_interval, remind_time
+                    FROM reminders
+                    WHERE user_id = ?
+                    ORDER BY payment_date ASC
+                ''', (user_id,))
+
+                return [dict(row) for row in cursor.fetchall()]
+
         except Exception as e:
             print(f"❌ Ошибка получения напоминаний: {e}")
             return []
-    
-    def add_reminder(self, user_id, title, amount, payment_date):
-        """Добавить новое напоминание"""
+
+    def add_reminder(self, user_id, title, amount, payment_date, recurrence=None, recurrence_interval=1,
+                     remind_time=None):
+        """Добавить новое напоминание.
+
+        recurrence - правило повторения ('days', 'weekly', 'monthly', 'yearly')
+        или None для разового платежа; recurrence_interval - каждые N дней/недель/месяцев/лет.
+        remind_time - «ЧЧ:ММ» точного напоминания в день платежа (по поясу пользователя).
+        """
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return None
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO reminders (user_id, title, amount, payment_date)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, title, amount, payment_date))
-            
-            conn.commit()
-            reminder_id = cursor.lastrowid
-            conn.close()
+            anchor_day = None
+            if recurrence in ('monthly', 'yearly'):
+                anchor_day = datetime.strptime(payment_date, '%Y-%m-%d').day
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+
+                remind_at = None
+                if remind_time:
+                    cursor.execute("SELECT timezone FROM users WHERE id = ?", (user_id,))
+                    row = cursor.fetchone()
+                    timezone = row[0] if row else DEFAULT_TIMEZONE
+                    remind_at = remind_at_for(timezone, datetime.strptime(payment_date, '%Y-%m-%d').date(),
+                                              remind_time).strftime('%Y-%m-%d %H:%M:%S')
+
+                cursor.execute('''
+                    INSERT INTO reminders (user_id, title, amount, payment_date,
+                                           recurrence, recurrence_interval, anchor_day, remind_time, remind_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, title, amount, payment_date, recurrence, recurrence_interval or 1, anchor_day,
+                      remind_time, remind_at))
+
+                conn.commit()
+                reminder_id = cursor.lastrowid
+
+            # Изменились счетчики напоминаний пользователя
+            self._invalidate_profile(user_id)
             return reminder_id
-                
+
         except Exception as e:
             print(f"❌ Ошибка добавления напоминания: {e}")
             return None
-    
+
+    def advance_recurring_reminders(self, batch_size=STREAM_CHUNK_SIZE):
+        """Перенести наступившие повторяющиеся платежи на следующую дату.
+
+        Повторы не хранятся отдельными строками: у напоминания меняется
+        payment_date, поэтому выборка уведомлений остается одним диапазоном
+        по индексу независимо от длины серии. Прошедшие строки выбираются
+        по idx_reminders_recurring порциями. Точное напоминание переносится
+        на новую дату, снимки профиля владельцев сбрасываются (меняется сумма
+        неоплаченных). Возвращает число перенесенных.
+        """
+        today = datetime.now().date()
+        today_str = today.strftime('%Y-%m-%d')
+        advanced = 0
+
+        try:
+            while True:
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT r.id, r.user_id, r.payment_date, r.recurrence, r.recurrence_interval,
+                               r.anchor_day, r.remind_time, u.timezone
+                        FROM reminders r
+                        JOIN users u ON r.user_id = u.id
+                        WHERE r.recurrence IS NOT NULL AND r.payment_date < ?
+                        ORDER BY r.payment_date
+                        LIMIT ?
+                    ''', (today_str, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+
+                    updates = []
+                    for row in rows:
+                        current = datetime.strptime(row['payment_date'], '%Y-%m-%d').date()
+                        next_date = next_payment_date(current, row['recurrence'], row['recurrence_interval'],
+                                                      row['anchor_day'], today)
+                        # Неизвестное правило: снимаем его, чтобы строка не выбиралась снова
+                        if next_date == current:
+                            updates.append((row['payment_date'], None, None, row['id']))
+                            continue
+
+                        remind_at = None
+                        if row['remind_time']:
+                            remind_at = remind_at_for(row['timezone'], next_date,
+                                                      row['remind_time']).strftime('%Y-%m-%d %H:%M:%S')
+                        updates.append((next_date.strftime('%Y-%m-%d'), row['recurrence'], remind_at, row['id']))
+
+                    # Новый повтор - снова неоплаченный
+                    cursor.executemany('''
+                        UPDATE reminders
+                        SET payment_date = ?, recurrence = ?, remind_at = ?, is_paid = FALSE
+                        WHERE id = ?
+                    ''', updates)
+                    conn.commit()
+                    advanced += len(updates)
+
+                for user_id in {row['user_id'] for row in rows}:
+                    self._invalidate_profile(user_id)
+
+                if len(rows) < batch_size:
+                    break
+
+            return advanced
+
+        except Exception as e:
+            print(f"❌ Ошибка переноса повторяющихся платежей: {e}")
+            return advanced
+
     def delete_reminder(self, user_id, reminder_id):
         """Удалить напоминание"""
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return False
-                
-            cursor = conn.cursor()
-            cursor.execute(
-                'DELETE FROM reminders WHERE id = ? AND user_id = ?',
-                (reminder_id, user_id)
-            )
-            
-            conn.commit()
-            deleted = cursor.rowcount > 0
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'DELETE FROM reminders WHERE id = ? AND user_id = ?',
+                    (reminder_id, user_id)
+                )
+                deleted = cursor.rowcount > 0
+
+                if deleted:
+                    # Убираем напоминание из очереди; готовые сообщения чата его
+                    # упоминают, поэтому при отправке они будут собраны заново
+                    cursor.execute('''
+                        UPDATE notification_outbox SET message = NULL
+                        WHERE status = 'pending' AND chat_id IN (
+                            SELECT chat_id FROM notification_outbox
+                            WHERE reminder_id = ? AND status = 'pending'
+                        )
+                    ''', (reminder_id,))
+                    cursor.execute(
+                        "DELETE FROM notification_outbox WHERE reminder_id = ? AND status = 'pending'",
+                        (reminder_id,)
+                    )
+
+                conn.commit()
+
+            if deleted:
+                self._invalidate_profile(user_id)
             return deleted
-                
+
         except Exception as e:
             print(f"❌ Ошибка удаления напоминания: {e}")
             return False
-    
+
+    # ========== ТОЧНЫЕ НАПОМИНАНИЯ ==========
+
+    def get_exact_alerts(self, until):
+        """Точные напоминания со сроком до until (datetime сервера), включая прошедшие"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(EXACT_ALERTS_SQL, {'until': until.strftime('%Y-%m-%d %H:%M:%S')})
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"❌ Ошибка получения точных напоминаний: {e}")
+            return []
+
+    def get_exact_alert(self, reminder_id):
+        """Точное напоминание по id (поля как у get_exact_alerts) или None"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT r.id, r.title, r.amount, r.payment_date, r.remind_at, r.remind_time, u.telegram_id
+                    FROM reminders r
+                    JOIN users u ON r.user_id = u.id
+                    WHERE r.id = ? AND r.remind_at IS NOT NULL
+                ''', (reminder_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+        except Exception as e:
+            print(f"❌ Ошибка получения точного напоминания: {e}")
+            return None
+
+    def complete_exact_alerts(self, reminder_ids):
+        """Отметить точные напоминания отправленными (remind_at очищается)"""
+        if not reminder_ids:
+            return 0
+
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "UPDATE reminders SET remind_at = NULL WHERE id = ?",
+                    [(reminder_id,) for reminder_id in reminder_ids]
+                )
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            print(f"❌ Ошибка сохранения отправленных точных напоминаний: {e}")
+            return 0
+
+    # ========== ПРЕМИУМ ==========
+
     def activate_premium(self, user_id, days):
         """Активировать премиум на указанное количество дней"""
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return False
-                
-            cursor = conn.cursor()
-            
-            # Рассчитываем дату окончания
-            premium_until = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
-            
-            cursor.execute('''
-                UPDATE users 
-                SET is_premium = TRUE, premium_until = ?
-                WHERE id = ?
-            ''', (premium_until, user_id))
-            
-            conn.commit()
-            updated = cursor.rowcount > 0
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+
+                # Рассчитываем дату окончания
+                premium_until = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+
+                cursor.execute('''
+                    UPDATE users
+                    SET is_premium = TRUE, premium_until = ?
+                    WHERE id = ?
+                ''', (premium_until, user_id))
+
+                conn.commit()
+                updated = cursor.rowcount > 0
+
+            self._invalidate_profile(user_id)
             return updated
-                
+
         except Exception as e:
             print(f"❌ Ошибка активации премиума: {e}")
             return False
-    
+
     def deactivate_premium(self, user_id):
         """Деактивировать премиум для пользователя"""
         try:
-            conn = self.get_connection()
-            if conn is None:
-                return False
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users 
-                SET is_premium = FALSE, premium_until = NULL 
-                WHERE id = ?
-            ''', (user_id,))
-            
-            conn.commit()
-            updated = cursor.rowcount > 0
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users
+                    SET is_premium = FALSE, premium_until = NULL
+                    WHERE id = ?
+                ''', (user_id,))
+
+                conn.commit()
+                updated = cursor.rowcount > 0
+
+            self._invalidate_profile(user_id)
             return updated
-                
+
         except Exception as e:
             print(f"❌ Ошибка деактивации премиума: {e}")
             return False
-    
-    def get_upcoming_reminders(self, days_before=1):
-        """Получить напоминания, до которых осталось указанное количество дней"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return []
-                
-            cursor = conn.cursor()
-            
-            # Рассчитываем дату
-            target_date = (datetime.now() + timedelta(days=days_before)).date()
-            target_date_str = target_date.strftime('%Y-%m-%d')
-            
-            cursor.execute('''
-                SELECT r.id, r.title, r.amount, r.payment_date,
-                       u.telegram_id, u.username, u.first_name,
-                       u.is_premium, u.premium_until
-                FROM reminders r
-                JOIN users u ON r.user_id = u.id
-                WHERE r.payment_date = ?
-                AND r.is_paid = FALSE
-                ORDER BY u.telegram_id
-            ''', (target_date_str,))
-            
-            reminders = []
-            for row in cursor.fetchall():
-                reminders.append(dict(row))
-            
-            conn.close()
-            return reminders
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения предстоящих напоминаний: {e}")
+
+    def expire_premium_subscriptions(self):
+        """Снять премиум у всех пользователей с истекшей подпиской.
+
+        Один UPDATE по индексу idx_premium_until. Возвращает список
+        пользователей (id, telegram_id), у которых премиум только что истек.
+        """
+        try:
+            today = datetime.now().date().strftime('%Y-%m-%d')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users
+                    SET is_premium = FALSE
+                    WHERE premium_until < ?
+                    AND is_premium = TRUE
+                    RETURNING id, telegram_id
+                ''', (today,))
+
+                expired = [dict(row) for row in cursor.fetchall()]
+                conn.commit()
+
+            for user in expired:
+                self._invalidate_profile(user['id'])
+            return expired
+
+        except Exception as e:
+            print(f"❌ Ошибка снятия истекших подписок: {e}")
             return []
-    
-    def get_all_users(self):
-        """Получить всех пользователей"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return []
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT telegram_id, username, first_name, is_premium, created_at
+
+    # ========== УВЕДОМЛЕНИЯ И РАССЫЛКИ ==========
+
+    def _due_notification_params(self, today):
+        """Параметры SLOT_NOTIFICATIONS_SQL на дату запуска (без слота и пояса)"""
+        dates = {days: (today + timedelta(days=days)).strftime('%Y-%m-%d') for days in NOTIFICATION_OFFSETS}
+        return {
+            'today': today.strftime('%Y-%m-%d'),
+            'date_1': dates[1],
+            'date_3': dates[3],
+            'date_7': dates[7],
+            'date_free': dates[FREE_NOTIFICATION_OFFSET],
+        }
+
+    # ========== ПОТОКОВОЕ ЧТЕНИЕ ==========
+
+    def _iter_chunks(self, fetch, chunk_size, what):
+        """Генератор порций по chunk_size строк (keyset-пагинация).
+
+        fetch(cursor, last_row, chunk_size) выполняет запрос очередной порции
+        после строки last_row (None - с начала). Подключение берется из пула
+        только на время запроса и не удерживается между порциями.
+        Ошибка чтения пробрасывается: оборванный поток нельзя принять за полный.
+        """
+        last_row = None
+        while True:
+            try:
+                with self.connection() as conn:
+                    rows = [dict(row) for row in fetch(conn.cursor(), last_row, chunk_size)]
+            except Exception as e:
+                print(f"❌ Ошибка потокового чтения ({what}): {e}")
+                raise
+
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            last_row = rows[-1]
+
+    def iter_users(self, premium_only=False, active_only=False, chunk_size=STREAM_CHUNK_SIZE, after_id=0):
+        """Пользователи порциями в порядке id (для рассылок и выгрузок).
+
+        active_only - только пользователи с доступным чатом (по idx_users_active).
+        after_id - продолжить после пользователя с этим id (контрольная точка рассылки).
+        """
+        filters = ''
+        if premium_only:
+            filters += ' AND is_premium = TRUE'
+        if active_only:
+            filters += " AND delivery_state = 'active'"
+
+        def fetch(cursor, last_row, limit):
+            return cursor.execute(f'''
+                SELECT id, telegram_id, username, first_name, is_premium, premium_until, created_at
                 FROM users
-                ORDER BY created_at DESC
-            ''')
-            
-            users = []
-            for row in cursor.fetchall():
-                users.append(dict(row))
-            
-            conn.close()
-            return users
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения всех пользователей: {e}")
+                WHERE id > ?{filters}
+                ORDER BY id
+                LIMIT ?
+            ''', (last_row['id'] if last_row else after_id, limit))
+
+        return self._iter_chunks(fetch, chunk_size, 'пользователи')
+
+    # ========== СЕГМЕНТЫ АУДИТОРИИ ==========
+
+    def _segment_params(self, days=None, free_limit=None, today=None):
+        """Значения параметров условий AUDIENCE_SEGMENTS"""
+        today = today or date.today()
+        days = days or 0
+        return {
+            'today': today.isoformat(),
+            'until': (today + timedelta(days=days)).isoformat(),
+            'week_end': (today + timedelta(days=6)).isoformat(),
+            'seen_before': (today - timedelta(days=days)).isoformat(),
+            'free_limit': free_limit or 0,
+        }
+
+    def _segment_query(self, segment, exclude_blocked=True):
+        """SQL выборки id пользователей сегмента.
+
+        exclude_blocked - только доступные чаты: с этим условием выборка идет
+        по частичным индексам сегментов.
+        """
+        if segment not in AUDIENCE_SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент аудитории: {segment}")
+        conditions = list(AUDIENCE_SEGMENTS[segment])
+        if exclude_blocked:
+            conditions.insert(0, "delivery_state = 'active'")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        return f'SELECT id FROM users{where}'
+
+    def count_segment(self, segment, days=None, free_limit=None, exclude_blocked=True):
+        """Размер сегмента для подтверждения рассылки.
+
+        COUNT идет по индексу сегмента, не читая строки users. Получатели
+        фиксируются при создании рассылки, поэтому итог может немного отличаться.
+        """
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f'SELECT COUNT(*) FROM ({self._segment_query(segment, exclude_blocked)})',
+                    self._segment_params(days, free_limit)
+                )
+                return cursor.fetchone()[0]
+
+        except Exception as e:
+            print(f"❌ Ошибка подсчета сегмента {segment}: {e}")
+            return 0
+
+    # ========== ДОСТУПНОСТЬ ЧАТОВ ==========
+
+    def mark_chats_undeliverable(self, states):
+        """Отметить чаты, в которые нельзя писать: {telegram_id: 'blocked' | 'deactivated'}.
+
+        Пользователь убирается из LRU-кэша, чтобы его следующее обращение
+        к боту прошло через get_or_create_user и вернуло статус active.
+        """
+        if not states:
+            return 0
+
+        try:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    UPDATE users
+                    SET delivery_state = ?, delivery_state_at = ?
+                    WHERE telegram_id = ? AND delivery_state != ?
+                ''', [(state, now, telegram_id, state) for telegram_id, state in states.items()])
+                conn.commit()
+                updated = cursor.rowcount
+
+            with self._user_cache_lock:
+                for telegram_id in states:
+                    self._user_cache.pop(telegram_id, None)
+            return updated
+
+        except Exception as e:
+            print(f"❌ Ошибка обновления доступности чатов: {e}")
+            return 0
+
+    # ========== ОЧЕРЕДЬ УВЕДОМЛЕНИЙ ==========
+
+    def get_slot_timezones(self, slot_hour):
+        """Часовые пояса пользователей, у которых уведомления приходятся на час slot_hour (UTC)"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT DISTINCT timezone FROM users WHERE notify_utc_hour = ? AND delivery_state = 'active'",
+                    (slot_hour,)
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"❌ Ошибка получения часовых поясов слота: {e}")
             return []
-    
-    def get_premium_users(self):
-        """Получить только премиум пользователей"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return []
-                
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT telegram_id, username, first_name, premium_until
-                FROM users
-                WHERE is_premium = TRUE
-                ORDER BY premium_until DESC
-            ''')
-            
-            users = []
-            for row in cursor.fetchall():
-                users.append(dict(row))
-            
-            conn.close()
-            return users
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения премиум пользователей: {e}")
+
+    def enqueue_slot_notifications(self, slot_hour):
+        """Поставить в очередь уведомления пользователей часового слота slot_hour (UTC).
+
+        Для каждого часового пояса слота «сегодня» считается по местному времени.
+        Ключ (reminder_id, offset_days, run_date) уникален, поэтому повторный
+        запуск слота ничего не дублирует. Возвращает число новых строк.
+        """
+        queued = 0
+        for timezone in self.get_slot_timezones(slot_hour):
+            try:
+                zone = ZoneInfo(timezone)
+                local_today = datetime.now(zone).date()
+                expires_at = local_day_end(zone, local_today)
+
+                params = self._due_notification_params(local_today)
+                params.update(
+                    slot_hour=slot_hour,
+                    timezone=timezone,
+                    now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    expires_at=expires_at.strftime('%Y-%m-%d %H:%M:%S')
+                )
+
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO notification_outbox
+                            (reminder_id, offset_days, run_date, chat_id, title, amount,
+                             payment_date, is_premium, next_attempt_at, expires_at)
+                        SELECT id, days_before, :today, telegram_id, title, amount,
+                               payment_date, is_premium, :now, :expires_at
+                        FROM ({SLOT_NOTIFICATIONS_SQL})
+                    ''', params)
+                    conn.commit()
+                    queued += cursor.rowcount
+
+            except Exception as e:
+                print(f"❌ Ошибка постановки уведомлений в очередь ({timezone}): {e}")
+
+        return queued
+
+    def get_slot_notifications(self, slot_hour, timezone, local_date):
+        """Уведомления пользователей слота slot_hour (UTC) из пояса timezone на местную дату local_date"""
+        try:
+            params = self._due_notification_params(local_date)
+            params.update(slot_hour=slot_hour, timezone=timezone)
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(SLOT_NOTIFICATIONS_SQL, params)
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"❌ Ошибка получения уведомлений слота: {e}")
             return []
-    
-    def get_statistics(self):
-        """Получить статистику бота"""
-        try:
-            conn = self.get_connection()
-            if conn is None:
-                return {
-                    'total_users': 0,
-                    'premium_users': 0,
-                    'total_reminders': 0,
-                    'active_reminders': 0
-                }
-                
-            cursor = conn.cursor()
-            
-            # Количество пользователей
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            # Количество премиум пользователей
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_premium = TRUE")
-            premium_users = cursor.fetchone()[0]
-            
-            # Количество напоминаний
-            cursor.execute("SELECT COUNT(*) FROM reminders")
-            total_reminders = cursor.fetchone()[0]
-            
-            # Активные напоминания (будущие)
-            today = datetime.now().date().strftime('%Y-%m-%d')
-            cursor.execute("SELECT COUNT(*) FROM reminders WHERE payment_date >= ?", (today,))
-            active_reminders = cursor.fetchone()[0]
-            
-            conn.close()
-            
+
+    def store_send_plan(self, rows):
+        """Записать подготовленный план отправки в очередь уведомлений.
+
+        rows - словари с полями строки очереди (reminder_id, offset_days, run_date,
+        chat_id, title, amount, payment_date, is_premium, priority, message,
+        next_attempt_at, expires_at). Уже стоящие в очереди уведомления не
+        дублируются. Возвращает число новых строк.
+        """
+        if not rows:
+            return 0
+
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO notification_outbox
+                        (reminder_id, offset_days, run_date, chat_id, title, amount, payment_date,
+                         is_premium, priority, message, next_attempt_at, expires_at)
+                    VALUES (:reminder_id, :offset_days, :run_date, :chat_id, :title, :amount, :payment_date,
+                            :is_premium, :priority, :message, :next_attempt_at, :expires_at)
+                ''', rows)
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            print(f"❌ Ошибка записи плана отправки: {e}")
+            return 0
+
+    def enqueue_missed_notifications(self, missed_slots):
+        """Поставить в очередь уведомления, пропущенные за время простоя.
+
+        missed_slots - пропущенные часовые слоты (datetime в UTC). Напоминания
+        читаются одним диапазонным запросом по payment_date. Напоминание
+        пропущено, если для пользователя был слот в день D, а платеж приходится
+        на D + срок (1 день, для премиум еще 3 и 7). Уведомление ставится как
+        сегодняшнее (run_date - сегодня по местному времени, срок - сколько дней
+        осталось), поэтому не дублирует обычный запуск слота. Прошедшие платежи
+        пропускаются. Возвращает число новых строк. Ошибка чтения напоминаний
+        пробрасывается - водяной знак не сдвигается, и пропуски догонятся позже.
+        """
+        if not missed_slots:
+            return 0
+
+        # Местные даты пропущенных запусков: (пояс, слот) -> {дата}
+        missed_dates = {}
+
+        def missed_run_dates(timezone, slot_hour):
+            key = (timezone, slot_hour)
+            if key not in missed_dates:
+                zone = ZoneInfo(timezone)
+                missed_dates[key] = {slot.astimezone(zone).date() for slot in missed_slots
+                                     if slot.hour == slot_hour}
+            return missed_dates[key]
+
+        # Диапазон дат платежей: от «сегодня» самого западного пояса (прошедшие
+        # платежи не нужны) до последнего пропущенного дня плюс максимальный срок
+        date_first = (datetime.now() - timedelta(days=1)).date().strftime('%Y-%m-%d')
+        date_last = (max(missed_slots).date() + timedelta(days=max(NOTIFICATION_OFFSETS) + 1)).strftime('%Y-%m-%d')
+        params = {
+            'today': datetime.now().date().strftime('%Y-%m-%d'),
+            'after_date': date_first,
+            'after_user_id': 0,
+            'after_id': 0,
+            'date_last': date_last,
+        }
+
+        def fetch(cursor, last_row, limit):
+            if last_row:
+                params.update(after_date=last_row['payment_date'],
+                              after_user_id=last_row['user_id'],
+                              after_id=last_row['id'])
+            params['limit'] = limit
+            return cursor.execute(MISSED_NOTIFICATIONS_SQL, params)
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        queued = 0
+
+        for chunk in self._iter_chunks(fetch, STREAM_CHUNK_SIZE, 'пропущенные уведомления'):
+            rows = []
+            for reminder in chunk:
+                zone = ZoneInfo(reminder['timezone'])
+                local_today = datetime.now(zone).date()
+                payment_date = datetime.strptime(reminder['payment_date'], '%Y-%m-%d').date()
+                if payment_date < local_today:
+                    continue
+
+                offsets = NOTIFICATION_OFFSETS if reminder['is_premium'] else (FREE_NOTIFICATION_OFFSET,)
+                run_dates = missed_run_dates(reminder['timezone'], reminder['notify_utc_hour'])
+                if not any(payment_date - timedelta(days=days) in run_dates for days in offsets):
+                    continue
+
+                rows.append((
+                    reminder['id'], (payment_date - local_today).days, local_today.strftime('%Y-%m-%d'),
+                    reminder['telegram_id'], reminder['title'], reminder['amount'], reminder['payment_date'],
+                    reminder['is_premium'], now, local_day_end(zone, local_today).strftime('%Y-%m-%d %H:%M:%S')
+                ))
+
+            if not rows:
+                continue
+
+            try:
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO notification_outbox
+                            (reminder_id, offset_days, run_date, chat_id, title, amount,
+                             payment_date, is_premium, next_attempt_at, expires_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    conn.commit()
+                    queued += cursor.rowcount
+
+            except Exception as e:
+                print(f"❌ Ошибка постановки пропущенных уведомлений в очередь: {e}")
+
+        return queued
+
+    def claim_outbox_batch(self, chat_limit=100):
+        """Забрать готовые к отправке уведомления для chat_limit чатов (pending -> sending).
+
+        Чат забирается целиком, поэтому все его уведомления оказываются в одной
+        порции и их можно объединить в одно сообщение. Строки после expires_at
+        (конец местного дня пользователя) не берутся: вчерашнее «завтра» уже неактуально.
+        Поля строк совпадают с SLOT_NOTIFICATIONS_SQL (telegram_id, days_before и т.д.),
+        плюс message - готовое сообщение чата из плана отправки (или None).
+        Чаты забираются в порядке priority (у чата с несколькими строками - наименьший).
+        CAST нужен потому, что RETURNING отдает целые суммы REAL-колонки как int.
+        """
+        try:
+            now = datetime.now()
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE notification_outbox
+                    SET status = 'sending', attempts = attempts + 1, claimed_at = :now
+                    WHERE status = 'pending'
+                    AND next_attempt_at <= :now
+                    AND expires_at > :now
+                    AND chat_id IN (
+                        SELECT chat_id FROM notification_outbox
+                        WHERE status = 'pending'
+                        AND next_attempt_at <= :now
+                        AND expires_at > :now
+                        GROUP BY chat_id
+                        ORDER BY MIN(priority), chat_id
+                        LIMIT :limit
+                    )
+                    RETURNING id, reminder_id, offset_days AS days_before, chat_id AS telegram_id,
+                              title, CAST(amount AS REAL) AS amount, payment_date, is_premium, attempts,
+                              message
+                ''', {
+                    'now': now.strftime('%Y-%m-%d %H:%M:%S'),
+                    'limit': chat_limit
+                })
+
+                batch = [dict(row) for row in cursor.fetchall()]
+                conn.commit()
+                return batch
+
+        except Exception as e:
+            print(f"❌ Ошибка получения уведомлений из очереди: {e}")
+            return []
+
+    def count_ready_outbox_chats(self):
+        """Сколько чатов ждут отправки прямо сейчас (для прогресса доставки)"""
+        try:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT COUNT(DISTINCT chat_id) FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ? AND expires_at > ?
+                ''', (now, now))
+                return cursor.fetchone()[0]
+
+        except Exception as e:
+            print(f"❌ Ошибка подсчета очереди уведомлений: {e}")
+            return 0
+
+    def complete_outbox_batch(self, sent=(), blocked=(), failed=()):
+        """Записать итоги отправки порции.
+
+        sent и blocked - id строк; failed - список (id, attempts, ошибка).
+        Неудачные строки возвращаются в pending с экспоненциальной задержкой,
+        после OUTBOX_MAX_ATTEMPTS попыток получают статус failed.
+        """
+        try:
+            now = datetime.now()
+
+            retries = []
+            for outbox_id, attempts, error in failed:
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    status, next_attempt_at = 'failed', now
+                else:
+                    status = 'pending'
+                    next_attempt_at = now + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+                retries.append((status, next_attempt_at.strftime('%Y-%m-%d %H:%M:%S'), str(error)[:500], outbox_id))
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "UPDATE notification_outbox SET status = 'sent', last_error = NULL WHERE id = ?",
+                    [(outbox_id,) for outbox_id in sent]
+                )
+                cursor.executemany(
+                    "UPDATE notification_outbox SET status = 'blocked' WHERE id = ?",
+                    [(outbox_id,) for outbox_id in blocked]
+                )
+                cursor.executemany(
+                    "UPDATE notification_outbox SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    retries
+                )
+                conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"❌ Ошибка сохранения итогов отправки: {e}")
+            return False
+
+    def reset_stale_outbox(self, lease_seconds=600):
+        """Вернуть в очередь строки, зависшие в sending (процесс упал во время отправки)"""
+        try:
+            stale_before = (datetime.now() - timedelta(seconds=lease_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE notification_outbox
+                    SET status = 'pending'
+                    WHERE status = 'sending' AND claimed_at < ?
+                ''', (stale_before,))
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            print(f"❌ Ошибка возврата зависших уведомлений: {e}")
+            return 0
+
+    def cleanup_outbox(self, keep_days=30):
+        """Закрыть просроченные записи очереди (expired) и удалить записи старше keep_days дней"""
+        try:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            keep_from = (datetime.now() - timedelta(days=keep_days)).date().strftime('%Y-%m-%d')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE notification_outbox SET status = 'expired' WHERE status = 'pending' AND expires_at <= ?",
+                    (now,)
+                )
+                cursor.execute("DELETE FROM notification_outbox WHERE run_date < ?", (keep_from,))
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            print(f"❌ Ошибка очистки очереди уведомлений: {e}")
+            return 0
+
+    # ========== РАССЫЛКИ ==========
+
+    def create_broadcast_job(self, title, payload_kind, payload, segment='all', segment_params=None,
+                             report_chat_id=None, report_message_id=None):
+        """Создать задание рассылки в статусе running. Возвращает id.
+
+        payload - JSON содержимого. Получатели - снимок сегмента segment
+        (AUDIENCE_SEGMENTS) с параметрами segment_params: days, free_limit,
+        exclude_blocked (по умолчанию True). total - размер снимка.
+        """
+        segment_params = segment_params or {}
+        try:
+            query = self._segment_query(segment, segment_params.get('exclude_blocked', True))
+            params = self._segment_params(segment_params.get('days'), segment_params.get('free_limit'))
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO broadcast_jobs
+                        (title, payload_kind, payload, segment, segment_params,
+                         report_chat_id, report_message_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (title, payload_kind, payload, segment,
+                      json.dumps(segment_params), report_chat_id, report_message_id))
+                job_id = cursor.lastrowid
+
+                cursor.execute(
+                    f'INSERT INTO broadcast_recipients (job_id, user_id) SELECT :job_id, id FROM ({query})',
+                    dict(params, job_id=job_id)
+                )
+                cursor.execute('UPDATE broadcast_jobs SET total = ? WHERE id = ?', (cursor.rowcount, job_id))
+                conn.commit()
+                return job_id
+
+        except Exception as e:
+            print(f"❌ Ошибка создания рассылки: {e}")
+            return None
+
+    def get_broadcast_job(self, job_id):
+        """Задание рассылки по id или None"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+        except Exception as e:
+            print(f"❌ Ошибка получения рассылки: {e}")
+            return None
+
+    def get_unfinished_broadcast_jobs(self, statuses=('running', 'paused')):
+        """Незавершенные рассылки (по умолчанию идущие и приостановленные)"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ', '.join('?' for _ in statuses)
+                cursor.execute(
+                    f'SELECT * FROM broadcast_jobs WHERE status IN ({placeholders}) ORDER BY id',
+                    tuple(statuses)
+                )
+                return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"❌ Ошибка получения незавершенных рассылок: {e}")
+            return []
+
+    def iter_broadcast_recipients(self, job_id, chunk_size=STREAM_CHUNK_SIZE, after_id=0):
+        """Получатели рассылки порциями в порядке id пользователя.
+
+        after_id - продолжить после пользователя с этим id (контрольная точка рассылки).
+        """
+        def fetch(cursor, last_row, limit):
+            return cursor.execute('''
+                SELECT u.id, u.telegram_id
+                FROM broadcast_recipients b
+                JOIN users u ON u.id = b.user_id
+                WHERE b.job_id = ? AND b.user_id > ?
+                ORDER BY b.user_id
+                LIMIT ?
+            ''', (job_id, last_row['id'] if last_row else after_id, limit))
+
+        return self._iter_chunks(fetch, chunk_size, 'получатели рассылки')
+
+    def _drop_broadcast_recipients(self, cursor, job_id, status):
+        """Снимок получателей завершенной или отмененной рассылки больше не нужен"""
+        if status in ('done', 'cancelled'):
+            cursor.execute('DELETE FROM broadcast_recipients WHERE job_id = ?', (job_id,))
+
+    def save_broadcast_progress(self, job_id, cursor_user_id, sent, failed, blocked, status=None, last_error=None):
+        """Сохранить контрольную точку рассылки (и, если указан, новый статус)"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE broadcast_jobs
+                    SET cursor_user_id = ?, sent = ?, failed = ?, blocked = ?,
+                        status = COALESCE(?, status),
+                        last_error = COALESCE(?, last_error),
+                        updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN ? IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP END
+                    WHERE id = ?
+                ''', (cursor_user_id, sent, failed, blocked, status, last_error, status, job_id))
+                updated = cursor.rowcount > 0
+                if updated:
+                    self._drop_broadcast_recipients(cursor, job_id, status)
+                conn.commit()
+                return updated
+
+        except Exception as e:
+            print(f"❌ Ошибка сохранения прогресса рассылки: {e}")
+            return False
+
+    def set_broadcast_status(self, job_id, status, from_statuses=None):
+        """Сменить статус рассылки. from_statuses - менять только из этих статусов.
+        Возвращает True, если статус изменился."""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                condition = ''
+                params = [status, status, job_id]
+                if from_statuses:
+                    condition = f" AND status IN ({', '.join('?' for _ in from_statuses)})"
+                    params.extend(from_statuses)
+                cursor.execute(f'''
+                    UPDATE broadcast_jobs
+                    SET status = ?, updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN ? IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP END
+                    WHERE id = ?{condition}
+                ''', params)
+                updated = cursor.rowcount > 0
+                if updated:
+                    self._drop_broadcast_recipients(cursor, job_id, status)
+                conn.commit()
+                return updated
+
+        except Exception as e:
+            print(f"❌ Ошибка изменения статуса рассылки: {e}")
+            return False
+
+    # ========== СОСТОЯНИЕ ПЛАНИРОВЩИКА ==========
+
+    def get_scheduler_watermark(self, name):
+        """Последний обработанный слот планировщика name (datetime в UTC) или None"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT value FROM scheduler_state WHERE name = ?", (name,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                return datetime.strptime(row[0], '%Y-%m-%d %H:%M').replace(tzinfo=ZoneInfo('UTC'))
+
+        except Exception as e:
+            print(f"❌ Ошибка чтения состояния планировщика: {e}")
+            return None
+
+    def set_scheduler_watermark(self, name, slot):
+        """Запомнить обработанный слот (datetime в UTC). Водяной знак только растет"""
+        try:
+            value = slot.astimezone(ZoneInfo('UTC')).strftime('%Y-%m-%d %H:%M')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO scheduler_state (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        value = excluded.value,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE excluded.value > scheduler_state.value
+                ''', (name, value))
+                conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"❌ Ошибка сохранения состояния планировщика: {e}")
+            return False
+
+    # ========== ВРЕМЯ УВЕДОМЛЕНИЙ ==========
+
+    def set_notification_time(self, user_id, notify_hour, timezone=None):
+        """Задать час уведомлений (и, если указан, часовой пояс) пользователя.
+
+        Уже запланированные уведомления пользователя переносятся на новое время.
+        """
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT telegram_id, timezone FROM users WHERE id = ?", (user_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return False
+                telegram_id = row[0]
+                if timezone is None:
+                    timezone = row[1]
+
+                cursor.execute('''
+                    UPDATE users
+                    SET timezone = ?, notify_hour = ?, notify_utc_hour = ?
+                    WHERE id = ?
+                ''', (timezone, notify_hour, notify_utc_hour(timezone, notify_hour), user_id))
+                self._reschedule_planned(cursor, telegram_id, ZoneInfo(timezone), notify_hour)
+                conn.commit()
+                return True
+
+        except Exception as e:
+            print(f"❌ Ошибка изменения времени уведомлений: {e}")
+            return False
+
+    def _reschedule_planned(self, cursor, chat_id, zone, notify_hour):
+        """Перенести будущие уведомления чата из плана на notify_hour их местного дня"""
+        now = datetime.now()
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('''
+            SELECT DISTINCT run_date FROM notification_outbox
+            WHERE chat_id = ? AND status = 'pending' AND next_attempt_at > ?
+        ''', (chat_id, now_str))
+
+        for (run_date,) in cursor.fetchall():
+            local_notify = datetime.combine(datetime.strptime(run_date, '%Y-%m-%d').date(),
+                                            dt_time(hour=notify_hour), tzinfo=zone)
+            send_at = max(local_notify.astimezone().replace(tzinfo=None), now)
+            cursor.execute('''
+                UPDATE notification_outbox SET next_attempt_at = ?
+                WHERE chat_id = ? AND run_date = ? AND status = 'pending' AND next_attempt_at > ?
+            ''', (send_at.strftime('%Y-%m-%d %H:%M:%S'), chat_id, run_date, now_str))
+
+    def get_notification_time(self, user_id):
+        """Часовой пояс и час уведомлений пользователя"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT timezone, notify_hour FROM users WHERE id = ?", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    return {'timezone': row[0], 'notify_hour': row[1]}
+                return {'timezone': DEFAULT_TIMEZONE, 'notify_hour': DEFAULT_NOTIFY_HOUR}
+
+        except Exception as e:
+            print(f"❌ Ошибка получения времени уведомлений: {e}")
+            return {'timezone': DEFAULT_TIMEZONE, 'notify_hour': DEFAULT_NOTIFY_HOUR}
+
+    def refresh_notification_slots(self):
+        """Пересчитать notify_utc_hour после перехода на летнее/зимнее время.
+
+        Пар (часовой пояс, час) немного, поэтому обновление идет по парам,
+        а меняются только строки, у которых слот действительно сдвинулся.
+        """
+        try:
+            updated = 0
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT DISTINCT timezone, notify_hour FROM users")
+                pairs = cursor.fetchall()
+
+                for timezone, notify_hour in pairs:
+                    cursor.execute('''
+                        UPDATE users SET notify_utc_hour = ?
+                        WHERE timezone = ? AND notify_hour = ? AND notify_utc_hour != ?
+                    ''', (notify_utc_hour(timezone, notify_hour), timezone, notify_hour,
+                          notify_utc_hour(timezone, notify_hour)))
+                    updated += cursor.rowcount
+                conn.commit()
+            return updated
+
+        except Exception as e:
+            print(f"❌ Ошибка пересчета слотов уведомлений: {e}")
+            return 0
+
+    def get_activity_statistics(self):
+        """Получить статистику активности для админ-панели"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+
+                # Напоминаний на завтра - из счетчика по датам
+                tomorrow = (datetime.now() + timedelta(days=1)).date().strftime('%Y-%m-%d')
+                cursor.execute("SELECT cnt FROM reminder_date_counts WHERE payment_date = ?", (tomorrow,))
+                row = cursor.fetchone()
+                tomorrow_reminders = row[0] if row else 0
+
+                # Активные пользователи (за последние 7 дней) - диапазон по idx_reminders_created_at
+                week_ago = (datetime.now() - timedelta(days=7)).date().strftime('%Y-%m-%d')
+                cursor.execute("SELECT COUNT(DISTINCT user_id) FROM reminders WHERE created_at >= ?", (week_ago,))
+                active_users = cursor.fetchone()[0]
+
             return {
-                'total_users': total_users or 0,
-                'premium_users': premium_users or 0,
-                'total_reminders': total_reminders or 0,
-                'active_reminders': active_reminders or 0
+                'tomorrow_reminders': tomorrow_reminders or 0,
+                'active_users': active_users or 0
             }
-                
+
         except Exception as e:
-            print(f"❌ Ошибка получения статистики: {e}")
+            print(f"❌ Ошибка получения статистики активности: {e}")
             return {
-                'total_users': 0,
-                'premium_users': 0,
-                'total_reminders': 0,
-                'active_reminders': 0
+                'tomorrow_reminders': 0,
+                'active_users': 0
             }
 
+    def get_statistics(self):
+        """Получить статистику бота.
+
+        Значения берутся из счетчиков, которые поддерживают триггеры,
+        поэтому запрос не зависит от размера таблиц.
+        """
+        empty = {
+            'total_users': 0,
+            'premium_users': 0,
+            'total_reminders': 0,
+            'active_reminders': 0
+        }
+
+        try:
+            today = datetime.now().date().strftime('%Y-%m-%d')
+
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, value FROM stats")
+                stats = dict(empty)
+                for name, value in cursor.fetchall():
+                    stats[name] = value or 0
+
+                # Активные напоминания (с датой в будущем или сегодня)
+                cursor.execute(
+                    "SELECT COALESCE(SUM(cnt), 0) FROM reminder_date_counts WHERE payment_date >= ?",
+                    (today,)
+                )
+                stats['active_reminders'] = cursor.fetchone()[0] or 0
+
+            return stats
+
+        except Exception as e:
+            print(f"❌ Ошибка получения статистики: {e}")
+            return empty
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Запросы выполняются в отдельном пуле потоков, поэтому медленный запрос
+    или заблокированная БД не останавливают цикл событий бота.
+    Любой публичный метод Database доступен здесь как корутина:
+    ``await async_db.get_or_create_user(...)``.
+    """
+
+    def __init__(self, database, max_workers=None):
+        self._db = database
+        # Потоков не больше, чем подключений в пуле - иначе они будут ждать друг друга
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or database.pool_size,
+            thread_name_prefix='db'
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию в пуле потоков БД"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        # Кэшируем обертку, чтобы не создавать ее на каждый вызов
+        setattr(self, name, method)
+        return method
+
+    async def stream(self, name, *args, **kwargs):
+        """Асинхронно перебрать строки генератора Database.iter_*.
+
+        Каждая порция читается в пуле потоков БД, в памяти одновременно
+        находится не больше одной порции:
+        ``async for row in async_db.stream('iter_users', premium_only=True)``.
+        """
+        chunks = getattr(self._db, name)(*args, **kwargs)
+        while True:
+            chunk = await self.run(next, chunks, None)
+            if chunk is None:
+                return
+            for row in chunk:
+                yield row
+
+    def close(self):
+        """Остановить пул потоков и закрыть подключения"""
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
 # Создаем глобальный экземпляр базы данных
 db = Database()
+async_db = AsyncDatabase(db)
@@ -0,0 +1,339 @@
+# delivery.py - отправка сообщений с учетом лимитов Telegram
+import asyncio
+import bisect
+import logging
+import time
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Forbidden, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат.
+# Берем с запасом, чтобы не ловить flood control
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+DEFAULT_CONCURRENCY = 10
+MAX_RETRIES = 3
+
+# Живой прогресс публикуется не чаще раза в PROGRESS_INTERVAL секунд (3 правки
+# сообщения в минуту), чтобы не тратить на него лимит отправок
+PROGRESS_INTERVAL = 20
+
+# Границы корзин гистограммы задержек, сек.: от 1 мс до ~2 мин с шагом 10%.
+# Перцентиль по гистограмме точен до шага, а память не растет с числом отправок
+LATENCY_BUCKETS = tuple(0.001 * 1.1 ** i for i in range(123))
+
+class TokenBucket:
+    """Корзина токенов: не больше rate операций в секунду в среднем"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Остановить выдачу токенов (например, после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Пополнение начинается после паузы, иначе корзина сразу наполнится целиком
+        self._tokens = 0
+        self._updated_at = self._paused_until
+
+    async def acquire(self):
+        """Дождаться свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                # Пополняем корзину за прошедшее время
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class RateLimiter:
+    """Общий лимит бота плюс минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL):
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self._chat_next_at = {}  # chat_id -> когда можно писать в чат снова
+
+    def pause(self, seconds):
+        """Пауза для всех отправок"""
+        self.bucket.pause(seconds)
+
+    async def acquire(self, chat_id):
+        """Дождаться разрешения на отправку в chat_id"""
+        now = time.monotonic()
+        next_at = self._chat_next_at.get(chat_id, 0)
+        self._chat_next_at[chat_id] = max(now, next_at) + self.per_chat_interval
+
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+        await self.bucket.acquire()
+
+        # Не даем словарю чатов расти бесконечно
+        if len(self._chat_next_at) > 10000:
+            now = time.monotonic()
+            self._chat_next_at = {cid: t for cid, t in self._chat_next_at.items() if t > now}
+
+# Один лимитер на весь бот: рассылки и уведомления делят общий бюджет Telegram
+telegram_limiter = RateLimiter()
+
+def retry_after_seconds(error):
+    """Сколько секунд просит подождать Telegram (int или timedelta в разных версиях)"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+async def send_with_retry(send, chat_id, limiter=telegram_limiter, max_retries=MAX_RETRIES):
+    """Отправить сообщение с учетом лимитов и повторами.
+
+    send - функция без аргументов, возвращающая корутину отправки в chat_id.
+    RetryAfter приостанавливает все отправки на указанное Telegram время,
+    сетевые ошибки повторяются с экспоненциальной задержкой. Forbidden и
+    BadRequest не повторяются - они пробрасываются вызывающему коду.
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(chat_id)
+        try:
+            return await send()
+        except RetryAfter as e:
+            wait = retry_after_seconds(e)
+            logger.warning(f"Flood control: пауза {wait} сек.")
+            limiter.pause(wait)
+            if attempt == max_retries:
+                raise
+        except (Forbidden, BadRequest):
+            raise
+        except (TimedOut, NetworkError):
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+def chat_state_for_error(error):
+    """Состояние чата по ошибке Telegram: 'blocked', 'deactivated' или None (чат доступен)"""
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        if 'deactivated' in message:
+            return 'deactivated'
+        return 'blocked'
+    if isinstance(error, BadRequest) and 'chat not found' in message:
+        return 'deactivated'
+    return None
+
+def is_chat_unavailable(error):
+    """Ошибка означает, что писать в этот чат больше нельзя (бот заблокирован, чат удален)"""
+    return chat_state_for_error(error) is not None
+
+class DeliveryStats:
+    """Итоги массовой отправки: счетчики, пропускная способность и задержки"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0  # из failed: чат недоступен (бот заблокирован, аккаунт удален)
+        # Гистограмма времени отправки одного сообщения (с ожиданием лимитов):
+        # число отправок в каждой корзине LATENCY_BUCKETS (последняя - все, что дольше)
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_max = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def total(self):
+        return self.sent + self.failed
+
+    @property
+    def duration(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Сообщений в секунду"""
+        return self.total / self.duration if self.duration > 0 else 0
+
+    def eta(self, total):
+        """Сколько секунд осталось до total отправок при текущей скорости (None - пока неизвестно)"""
+        remaining = total - self.total
+        if remaining <= 0:
+            return 0
+        if not self.throughput:
+            return None
+        return remaining / self.throughput
+
+    def progress(self, total=None):
+        """Однострочный прогресс для логов"""
+        message = f"обработано {self.total}"
+        if total is not None:
+            message += f" из {total}"
+        message += (
+            f", ошибок {self.failed} (недоступных чатов {self.blocked}), "
+            f"{self.throughput:.1f} сообщ./сек."
+        )
+        if total is not None:
+            message += f", осталось {format_duration(self.eta(total))}"
+        return message
+
+    def record_latency(self, seconds):
+        """Учесть время отправки одного сообщения, сек."""
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_max = max(self.latency_max, seconds)
+
+    def latency_percentile(self, percent):
+        """Перцентиль задержки отправки, сек. (верхняя граница корзины, не больше максимума)"""
+        count = sum(self.latency_counts)
+        if not count:
+            return 0
+        rank = min(count - 1, int(count * percent / 100))
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, self.latency_counts):
+            seen += bucket_count
+            if seen > rank:
+                return min(bound, self.latency_max)
+        return self.latency_max  # в последней корзине (дольше всех границ)
+
+    def summary(self):
+        """Однострочная сводка для логов"""
+        return (
+            f"отправлено {self.sent}, ошибок {self.failed} (недоступных чатов {self.blocked}) за {self.duration:.1f} сек. "
+            f"({self.throughput:.1f} сообщ./сек.), задержка p50 {self.latency_percentile(50) * 1000:.0f} мс, "
+            f"p95 {self.latency_percentile(95) * 1000:.0f} мс, max {self.latency_max * 1000:.0f} мс"
+        )
+
+def format_duration(seconds):
+    """Длительность для людей: «~2 мин 05 сек», «~1 ч 10 мин»; None - «неизвестно»"""
+    if seconds is None:
+        return "неизвестно"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"~{seconds} сек"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"~{minutes} мин {seconds:02d} сек"
+    hours, minutes = divmod(minutes, 60)
+    return f"~{hours} ч {minutes:02d} мин"
+
+class ThrottledProgress:
+    """Публикация прогресса не чаще раза в interval секунд.
+
+    update() только отмечает, что прогресс изменился. Публикация выполняется
+    не раньше чем через interval после предыдущей (и после создания), а все
+    изменения за это время сливаются в одну публикацию с актуальным состоянием.
+    publish - корутинная функция без аргументов (правка сообщения, запись в лог).
+    """
+
+    def __init__(self, publish, interval=PROGRESS_INTERVAL):
+        self.publish = publish
+        self.interval = interval
+        self._published_at = time.monotonic()
+        self._task = None
+
+    def update(self):
+        if self._task is None or self._task.done():
+            delay = max(0, self._published_at + self.interval - time.monotonic())
+            self._task = asyncio.create_task(self._publish_later(delay))
+
+    async def _publish_later(self, delay):
+        await asyncio.sleep(delay)
+        self._published_at = time.monotonic()
+        try:
+            await self.publish()
+        except Exception as e:
+            logger.warning(f"Не удалось опубликовать прогресс: {e}")
+
+    async def close(self):
+        """Отменить отложенную публикацию (перед итоговым сообщением)"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+async def _iterate(items):
+    """Единый async-перебор для обычных и асинхронных последовательностей"""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+async def fan_out(items, send, concurrency=DEFAULT_CONCURRENCY, limiter=telegram_limiter, chat_id_of=None,
+                  on_result=None, stats=None):
+    """Отправить send(item) для всех items не более чем в concurrency параллельных задач.
+
+    items может быть списком или асинхронным генератором. По умолчанию item
+    сам является chat_id, иначе chat_id берется через chat_id_of(item).
+    on_result(item, error) вызывается после каждой отправки (error=None при успехе),
+    может быть корутинной функцией; его ошибка пишется в лог и не останавливает отправку.
+    Если обработчик все же упал, fan_out пробрасывает его ошибку, а не ждет вечно.
+    Возвращает DeliveryStats (можно передать свой stats, чтобы накапливать итоги).
+    """
+    stats = stats or DeliveryStats()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    done = object()
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            chat_id = chat_id_of(item) if chat_id_of else item
+            started_at = time.monotonic()
+            error = None
+            try:
+                await send_with_retry(lambda: send(item), chat_id, limiter=limiter)
+                stats.sent += 1
+            except Exception as e:
+                stats.failed += 1
+                error = e
+                if is_chat_unavailable(e):
+                    # Ожидаемая ситуация, а не сбой - не засоряем лог ошибками
+                    logger.info(f"Чат {chat_id} недоступен: {e}")
+                    stats.blocked += 1
+                else:
+                    logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+            stats.record_latency(time.monotonic() - started_at)
+            if on_result:
+                try:
+                    result = on_result(item, error)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Ошибка обработки результата отправки в чат {chat_id}: {e}")
+
+    async def feed():
+        async for item in _iterate(items):
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(done)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    # Подача идет отдельной задачей: если обработчики упали, очередь больше
+    # никто не разбирает, и подача не должна остаться ждать в queue.put
+    tasks = [asyncio.create_task(feed())] + workers
+    try:
+        finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in finished:
+            task.result()  # Пробрасывает ошибку подачи (items) или упавшего обработчика
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    stats.finished_at = time.monotonic()
+    return stats
@@ -1,66 +1,503 @@
 # notifications.py
 import logging
-from datetime import datetime, timedelta
-from database import db
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from database import async_db, local_day_end
+from delivery import fan_out, chat_state_for_error, DeliveryStats, ThrottledProgress
+from timer_wheel import TimerWheel
 
 logger = logging.getLogger(__name__)
 
+# Сколько уведомлений отправляется параллельно
+NOTIFICATION_CONCURRENCY = 20
+
+# Сколько чатов забирается из очереди за раз
+OUTBOX_BATCH_SIZE = 200
+
+# Как часто писать в лог прогресс долгой отправки уведомлений, сек.
+NOTIFICATION_PROGRESS_INTERVAL = 60
+
+# Имя водяного знака планировщика слотов в scheduler_state
+SLOTS_WATERMARK = 'notification_slots'
+# Насколько далеко назад догонять пропущенные слоты (больше максимального срока смысла нет)
+MAX_CATCH_UP = timedelta(days=7)
+
+# Дайджест: все уведомления пользователя за запуск - одним сообщением
+NOTIFICATION_DIGEST = True
+# Сколько платежей перечислять в дайджесте (лимит длины сообщения Telegram)
+DIGEST_MAX_ITEMS = 30
+
+# На сколько часовых слотов вперед готовится план отправки
+SEND_PLAN_HOURS = 24
+
+# Точные напоминания: на сколько вперед колесо таймеров загружается из БД
+# (загрузка раз в час) и через сколько пропущенное напоминание уже не отправляется
+EXACT_ALERT_WINDOW = timedelta(hours=2)
+EXACT_ALERT_GRACE = timedelta(hours=6)
+
+# Уведомление об окончании премиум подписки (expire_premium_job)
+PREMIUM_EXPIRED_TEXT = (
+    "⌛ <b>Ваша премиум подписка закончилась</b>\n\n"
+    "Напоминания сохранены, но снова действует бесплатный тариф.\n"
+    "Продлить премиум можно командой /premium 💎"
+)
+
+# Колесо таймеров точных напоминаний: ключ - id напоминания
+alert_wheel = TimerWheel()
+# Сработавшие напоминания, которые еще отправляются (не загружать их повторно)
+_alerts_in_flight = set()
+
+class PhaseTimer:
+    """Время по фазам задачи (выборка, подготовка, отправка...) для отчета в логе"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - started_at
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.2f} сек." for name, seconds in self.phases.items())
+
+def format_days_before(days_before):
+    """Когда платеж: «СЕГОДНЯ!», «ЗАВТРА!», «через 3 дня», «через 7 дней»"""
+    if days_before == 0:
+        return "СЕГОДНЯ!"
+    if days_before == 1:
+        return "ЗАВТРА!"
+    if days_before % 10 in (2, 3, 4) and days_before not in (12, 13, 14):
+        return f"через {days_before} дня"
+    return f"через {days_before} дней"
+
+def format_reminder_notification(reminder):
+    """Текст уведомления о предстоящем платеже"""
+    message = (
+        f"🔔 <b>НАПОМИНАНИЕ О ПЛАТЕЖЕ!</b>\n\n"
+        f"<b>Название:</b> {reminder['title']}\n"
+        f"<b>Сумма:</b> {reminder['amount']}₽\n"
+        f"<b>Дата оплаты:</b> {format_days_before(reminder.get('days_before', 1))}\n\n"
+    )
+    
+    # Проверяем, является ли пользователь премиум
+    if reminder.get('is_premium', False):
+        message += f"💎 <i>Спасибо за использование премиума!</i>"
+    else:
+        message += f"🆓 <i>Для получения напоминаний за 3 и 7 дней оформите премиум</i>"
+    
+    return message
+
+def format_digest_notification(reminders):
+    """Одно сообщение со всеми платежами пользователя, сгруппированными по сроку"""
+    message = f"🔔 <b>НАПОМИНАНИЕ О ПЛАТЕЖАХ!</b>\n"
+    
+    ordered = sorted(reminders, key=lambda r: (r.get('days_before', 1), r['payment_date'], r['id']))
+    shown = ordered[:DIGEST_MAX_ITEMS]
+    
+    current_days = None
+    for reminder in shown:
+        days_before = reminder.get('days_before', 1)
+        if days_before != current_days:
+            current_days = days_before
+            message += f"\n<b>📅 {format_days_before(days_before).rstrip('!').capitalize()}</b>\n"
+        message += f"• {reminder['title']} — {reminder['amount']}₽\n"
+    
+    if len(ordered) > len(shown):
+        message += f"… и еще {len(ordered) - len(shown)}\n"
+    
+    total = round(sum(r['amount'] for r in reminders), 2)
+    message += f"\n💰 <b>Итого:</b> {total}₽\n\n"
+    
+    if any(r.get('is_premium', False) for r in reminders):
+        message += f"💎 <i>Спасибо за использование премиума!</i>"
+    else:
+        message += f"🆓 <i>Для получения напоминаний за 3 и 7 дней оформите премиум</i>"
+    
+    return message
+
+def group_by_chat(reminders):
+    """Сгруппировать уведомления порции по чатам (порядок чатов сохраняется)"""
+    groups = {}
+    for reminder in reminders:
+        groups.setdefault(reminder['telegram_id'], []).append(reminder)
+    return list(groups.values())
+
+def render_chat_notification(group):
+    """Сообщение для уведомлений одного чата: одиночное или дайджест"""
+    if len(group) == 1:
+        return format_reminder_notification(group[0])
+    return format_digest_notification(group)
+
+def planned_message(group):
+    """Готовое сообщение из плана, если оно собрано ровно для этих уведомлений.
+
+    Строки чата, добавленные после построения плана, приходят без message,
+    а после удаления напоминания message сбрасывается - тогда None.
+    """
+    message = group[0].get('message')
+    if message and all(reminder.get('message') == message for reminder in group):
+        return message
+    return None
+
+async def deliver_outbox(bot, digest=NOTIFICATION_DIGEST):
+    """Отправить все готовые уведомления из очереди порциями.
+
+    Каждая порция забирается из БД (pending -> sending) и отправляется;
+    итоговый статус (sent, blocked или повтор с задержкой) записывается сразу
+    после отправки в чат, поэтому падение процесса посреди порции не приводит
+    к повторной отправке уже доставленных уведомлений.
+    В режиме digest уведомления одного чата уходят одним сообщением.
+    Долгая отправка пишет в лог прогресс со скоростью и оценкой времени.
+    Возвращает DeliveryStats (счетчики - по сообщениям).
+    """
+    stats = DeliveryStats()
+    # Оценка для прогресса: в режиме digest одно сообщение на чат
+    expected = await async_db.count_ready_outbox_chats() if digest else None
+    
+    async def publish_progress():
+        logger.info(f"Отправка уведомлений: {stats.progress(expected)}")
+    
+    reporter = ThrottledProgress(publish_progress, interval=NOTIFICATION_PROGRESS_INTERVAL)
+    
+    async def send(group):
+        text = (digest and planned_message(group)) or render_chat_notification(group)
+        await bot.send_message(chat_id=group[0]['telegram_id'], text=text, parse_mode='HTML')
+    
+    while True:
+        batch = await async_db.claim_outbox_batch(OUTBOX_BATCH_SIZE)
+        if not batch:
+            break
+        
+        groups = group_by_chat(batch) if digest else [[reminder] for reminder in batch]
+        
+        async def on_result(group, error):
+            ids = [reminder['id'] for reminder in group]
+            chat_state = chat_state_for_error(error) if error else None
+            if error is None:
+                await async_db.complete_outbox_batch(sent=ids)
+            elif chat_state:
+                await async_db.complete_outbox_batch(blocked=ids)
+                # Недоступные чаты больше не попадают в выборки уведомлений и рассылок
+                await async_db.mark_chats_undeliverable({group[0]['telegram_id']: chat_state})
+            else:
+                await async_db.complete_outbox_batch(
+                    failed=[(reminder['id'], reminder['attempts'], error) for reminder in group]
+                )
+            reporter.update()
+        
+        # Параллельная отправка через общий лимитер Telegram
+        await fan_out(
+            groups, send,
+            concurrency=NOTIFICATION_CONCURRENCY,
+            chat_id_of=lambda group: group[0]['telegram_id'],
+            on_result=on_result,
+            stats=stats
+        )
+    
+    await reporter.close()
+    return stats
+
+def current_slot():
+    """Начало текущего часового слота (UTC)"""
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+async def build_send_plan(hours=SEND_PLAN_HOURS, timer=None):
+    """Заранее поставить в очередь уведомления следующих hours часовых слотов.
+
+    Для каждого слота выбираются уведомления его пользователей (на их местную
+    дату), сообщения чатов собираются сразу и сохраняются в очереди вместе с
+    приоритетом (ближайший срок платежа - раньше) и временем отправки - началом
+    слота. Запуск слота затем только забирает готовые строки и отправляет их.
+    Возвращает (чатов, новых строк очереди).
+    """
+    timer = timer or PhaseTimer()
+    first_slot = current_slot() + timedelta(hours=1)
+    chats = queued = 0
+
+    for index in range(hours):
+        slot = first_slot + timedelta(hours=index)
+        send_at = slot.astimezone().replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+
+        with timer.phase('выборка'):
+            timezones = await async_db.get_slot_timezones(slot.hour)
+
+        for timezone_name in timezones:
+            zone = ZoneInfo(timezone_name)
+            local_date = slot.astimezone(zone).date()
+
+            with timer.phase('выборка'):
+                reminders = await async_db.get_slot_notifications(slot.hour, timezone_name, local_date)
+
+            with timer.phase('подготовка'):
+                expires_at = local_day_end(zone, local_date).strftime('%Y-%m-%d %H:%M:%S')
+                for group in group_by_chat(reminders):
+                    chats += 1
+                    message = render_chat_notification(group)
+                    priority = min(reminder['days_before'] for reminder in group)
+                    for reminder in group:
+                        rows.append({
+                            'reminder_id': reminder['id'],
+                            'offset_days': reminder['days_before'],
+                            'run_date': local_date.strftime('%Y-%m-%d'),
+                            'chat_id': reminder['telegram_id'],
+                            'title': reminder['title'],
+                            'amount': reminder['amount'],
+                            'payment_date': reminder['payment_date'],
+                            'is_premium': reminder['is_premium'],
+                            'priority': priority,
+                            'message': message,
+                            'next_attempt_at': send_at,
+                            'expires_at': expires_at,
+                        })
+
+        with timer.phase('запись'):
+            queued += await async_db.store_send_plan(rows)
+
+    return chats, queued
+
 async def send_reminder_notifications(context):
-    """Отправка уведомлений о предстоящих платежах"""
+    """Отправка уведомлений о предстоящих платежах (за 1 день, премиум - еще за 3 и 7).
+
+    Запускается каждый час и обрабатывает только пользователей, у которых
+    время уведомлений приходится на текущий час UTC. Основную часть слота
+    заранее ставит в очередь план отправки (build_send_plan_job), здесь
+    добавляются только напоминания, созданные после построения плана.
+    """
     try:
-        # Получаем напоминания на завтра
-        tomorrow_reminders = db.get_upcoming_reminders(days_before=1)
-        
-        for reminder in tomorrow_reminders:
-            try:
-                telegram_id = reminder['telegram_id']
-                title = reminder['title']
-                amount = reminder['amount']
-                
-                # Проверяем, является ли пользователь премиум
-                is_premium = reminder.get('is_premium', False)
-                
-                message = (
-                    f"🔔 <b>НАПОМИНАНИЕ О ПЛАТЕЖЕ!</b>\n\n"
-                    f"<b>Название:</b> {title}\n"
-                    f"<b>Сумма:</b> {amount}₽\n"
-                    f"<b>Дата оплаты:</b> ЗАВТРА!\n\n"
-                )
-                
-                if is_premium:
-                    message += f"💎 <i>Спасибо за использование премиума!</i>"
-                else:
-                    message += f"🆓 <i>Для получения напоминаний за 3 и 7 дней оформите премиум</i>"
-                
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=message,
-                    parse_mode='HTML'
-                )
-                
-                logger.info(f"Отправлено уведомление пользователю {telegram_id}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления: {e}")
-                continue
-        
-        # Для премиум пользователей также отправляем за 3 и 7 дней
-        premium_reminders_3 = []
-        premium_reminders_7 = []
-        
-        # Находим премиум пользователей
-        premium_users = db.get_premium_users()
-        
-        for user in premium_users:
-            try:
-                # Здесь должна быть логика для получения напоминаний каждого пользователя
-                # за 3 и 7 дней. В реальной реализации нужно доработать этот метод
-                pass
-            except Exception as e:
-                logger.error(f"Ошибка обработки премиум пользователя: {e}")
-                continue
-                
-        logger.info(f"Уведомления отправлены: {len(tomorrow_reminders)} напоминаний")
+        slot = current_slot()
+        timer = PhaseTimer()
+        
+        # Дополняем очередь слота - уже запланированное не дублируется
+        with timer.phase('очередь'):
+            await async_db.reset_stale_outbox()
+            queued = await async_db.enqueue_slot_notifications(slot.hour)
+            # Слот в очереди - дальше доставку гарантирует очередь
+            await async_db.set_scheduler_watermark(SLOTS_WATERMARK, slot)
+        
+        with timer.phase('отправка'):
+            stats = await deliver_outbox(context.bot)
+        
+        with timer.phase('очистка'):
+            await async_db.cleanup_outbox()
+        
+        logger.info(f"Слот {slot.hour}:00 UTC: добавлено в очередь вне плана: {queued}; {timer.summary()}")
+        if stats.total:
+            logger.info(f"Уведомления о платежах: {stats.summary()}")
         
     except Exception as e:
         logger.error(f"Ошибка в планировщике уведомлений: {e}")
+
+async def catch_up_notifications_job(context):
+    """Догнать слоты уведомлений, пропущенные пока бот не работал (запускается при старте)"""
+    try:
+        slot = current_slot()
+        watermark = await async_db.get_scheduler_watermark(SLOTS_WATERMARK)
+        
+        if watermark is None:
+            # Первый запуск: пропусков еще не может быть
+            await async_db.set_scheduler_watermark(SLOTS_WATERMARK, slot)
+            return
+        
+        # Все слоты после водяного знака до текущего включительно (текущий час уже начался,
+        # а следующий запуск будет только в начале следующего часа)
+        first_missed = max(watermark + timedelta(hours=1), slot - MAX_CATCH_UP)
+        missed_slots = []
+        while first_missed <= slot:
+            missed_slots.append(first_missed)
+            first_missed += timedelta(hours=1)
+        
+        if not missed_slots:
+            return
+        
+        logger.info(f"Пропущено слотов уведомлений: {len(missed_slots)} (с {missed_slots[0]:%Y-%m-%d %H:%M} UTC)")
+        queued = await async_db.enqueue_missed_notifications(missed_slots)
+        await async_db.set_scheduler_watermark(SLOTS_WATERMARK, slot)
+        logger.info(f"Поставлено в очередь пропущенных уведомлений: {queued}")
+        
+        stats = await deliver_outbox(context.bot)
+        if stats.total:
+            logger.info(f"Пропущенные уведомления: {stats.summary()}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка догоняющей отправки уведомлений: {e}")
+
+async def build_send_plan_job(context):
+    """Построение плана отправки на сутки вперед (запускается вне часа пик)"""
+    try:
+        timer = PhaseTimer()
+        chats, queued = await build_send_plan(timer=timer)
+        logger.info(f"План отправки на {SEND_PLAN_HOURS} ч.: чатов {chats}, новых уведомлений {queued}; {timer.summary()}")
+    except Exception as e:
+        logger.error(f"Ошибка построения плана отправки: {e}")
+
+async def refresh_notification_slots_job(context):
+    """Пересчет слотов уведомлений (переход на летнее/зимнее время)"""
+    try:
+        updated = await async_db.refresh_notification_slots()
+        if updated:
+            logger.info(f"Обновлены слоты уведомлений: {updated} пользователей")
+    except Exception as e:
+        logger.error(f"Ошибка пересчета слотов уведомлений: {e}")
+
+async def deliver_outbox_job(context):
+    """Периодическая досылка очереди: повторы после ошибок и продолжение прерванного запуска"""
+    try:
+        reset = await async_db.reset_stale_outbox()
+        if reset:
+            logger.info(f"Возвращено в очередь зависших уведомлений: {reset}")
+        
+        stats = await deliver_outbox(context.bot)
+        if stats.total:
+            logger.info(f"Досылка уведомлений: {stats.summary()}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка досылки уведомлений: {e}")
+
+async def expire_premium_job(context):
+    """Фоновое снятие истекших премиум подписок"""
+    try:
+        expired = await async_db.expire_premium_subscriptions()
+        logger.info(f"Истекших премиум подписок: {len(expired)}")
+        
+        # Уведомления об окончании подписки (если включены в data задачи)
+        job_data = context.job.data if context.job and context.job.data else {}
+        if not job_data.get('notify'):
+            return
+        
+        undeliverable = {}
+        
+        def on_result(user, error):
+            chat_state = chat_state_for_error(error) if error else None
+            if chat_state:
+                undeliverable[user['telegram_id']] = chat_state
+        
+        # Через общий лимитер Telegram: после массового истечения не ловим flood control
+        stats = await fan_out(
+            expired,
+            lambda user: context.bot.send_message(chat_id=user['telegram_id'], text=PREMIUM_EXPIRED_TEXT,
+                                                  parse_mode='HTML'),
+            concurrency=NOTIFICATION_CONCURRENCY,
+            chat_id_of=lambda user: user['telegram_id'],
+            on_result=on_result
+        )
+        await async_db.mark_chats_undeliverable(undeliverable)
+        if stats.total:
+            logger.info(f"Уведомления об окончании премиума: {stats.summary()}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка проверки истекших подписок: {e}")
+
+async def advance_recurring_job(context):
+    """Перенос наступивших повторяющихся платежей на следующую дату"""
+    try:
+        advanced = await async_db.advance_recurring_reminders()
+        if advanced:
+            logger.info(f"Перенесено повторяющихся платежей: {advanced}")
+    except Exception as e:
+        logger.error(f"Ошибка переноса повторяющихся платежей: {e}")
+
+async def reconcile_statistics_job(context):
+    """Ночная сверка счетчиков статистики с таблицами"""
+    try:
+        if await async_db.reconcile_statistics():
+            logger.info("Счетчики статистики сверены")
+    except Exception as e:
+        logger.error(f"Ошибка сверки статистики: {e}")
+
+def format_exact_alert(alert):
+    """Текст точного напоминания в день платежа"""
+    return (
+        f"⏰ <b>ПОРА ОПЛАТИТЬ!</b>\n\n"
+        f"<b>Название:</b> {alert['title']}\n"
+        f"<b>Сумма:</b> {alert['amount']}₽\n"
+        f"<b>Дата оплаты:</b> СЕГОДНЯ!"
+    )
+
+def schedule_exact_alert(alert):
+    """Положить точное напоминание в колесо, если его срок в окне загрузки"""
+    remind_at = datetime.strptime(alert['remind_at'], '%Y-%m-%d %H:%M:%S')
+    if remind_at > datetime.now() + EXACT_ALERT_WINDOW or alert['id'] in _alerts_in_flight:
+        return False
+    alert_wheel.schedule(alert['id'], remind_at.timestamp(), alert)
+    return True
+
+async def track_exact_alert(reminder_id):
+    """Учесть новое напоминание в колесе (после add_reminder)"""
+    alert = await async_db.get_exact_alert(reminder_id)
+    if alert:
+        schedule_exact_alert(alert)
+
+def untrack_exact_alert(reminder_id):
+    """Убрать напоминание из колеса (после delete_reminder)"""
+    alert_wheel.cancel(reminder_id)
+
+async def load_exact_alerts_job(context):
+    """Загрузка точных напоминаний ближайших часов в колесо таймеров"""
+    try:
+        now = datetime.now()
+        alerts = await async_db.get_exact_alerts(now + EXACT_ALERT_WINDOW)
+        
+        stale = []
+        for alert in alerts:
+            if datetime.strptime(alert['remind_at'], '%Y-%m-%d %H:%M:%S') < now - EXACT_ALERT_GRACE:
+                stale.append(alert['id'])
+            else:
+                schedule_exact_alert(alert)
+        
+        # Давно пропущенные (бот долго не работал) уже неактуальны
+        if stale:
+            await async_db.complete_exact_alerts(stale)
+            logger.info(f"Пропущено устаревших точных напоминаний: {len(stale)}")
+        logger.info(f"Точных напоминаний в колесе: {len(alert_wheel)}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка загрузки точных напоминаний: {e}")
+
+async def exact_alerts_job(context):
+    """Тик колеса таймеров: отправка наступивших точных напоминаний в фоне"""
+    fired = alert_wheel.advance()
+    if fired:
+        alerts = [alert for _, alert in fired]
+        _alerts_in_flight.update(alert['id'] for alert in alerts)
+        context.application.create_task(send_exact_alerts(context.bot, alerts))
+
+async def send_exact_alerts(bot, alerts):
+    """Отправить сработавшие точные напоминания.
+
+    Отправленные (и адресованные недоступным чатам) больше не загружаются;
+    после сетевых ошибок напоминание остается в БД и будет загружено снова.
+    """
+    try:
+        completed = []
+        undeliverable = {}
+        
+        def on_result(alert, error):
+            chat_state = chat_state_for_error(error) if error else None
+            if chat_state:
+                undeliverable[alert['telegram_id']] = chat_state
+            if error is None or chat_state:
+                completed.append(alert['id'])
+        
+        stats = await fan_out(
+            alerts,
+            lambda alert: bot.send_message(chat_id=alert['telegram_id'], text=format_exact_alert(alert),
+                                           parse_mode='HTML'),
+            concurrency=NOTIFICATION_CONCURRENCY,
+            chat_id_of=lambda alert: alert['telegram_id'],
+            on_result=on_result
+        )
+        await async_db.complete_exact_alerts(completed)
+        await async_db.mark_chats_undeliverable(undeliverable)
+        logger.info(f"Точные напоминания: {stats.summary()}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка отправки точных напоминаний: {e}")
+    finally:
+        _alerts_in_flight.difference_update(alert['id'] for alert in alerts)
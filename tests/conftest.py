@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Модуль database, импортированный из временной папки.
+
+    При импорте создается глобальный db = Database() с reminders.db
+    в текущей папке - он не должен попасть в репозиторий.
+    """
+    monkeypatch.chdir(tmp_path)
+    import database
+    return database
+
+
+@pytest.fixture
+def db(database, tmp_path):
+    """Database на временном файле (схема создается в конструкторе)"""
+    db = database.Database(str(tmp_path / 'test.db'))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def async_db(database, db, monkeypatch):
+    """AsyncDatabase над тестовой БД вместо глобальной - во всех модулях бота"""
+    import broadcast
+    import notifications
+
+    async_db = database.AsyncDatabase(db)
+    for module in (database, broadcast, notifications):
+        monkeypatch.setattr(module, 'async_db', async_db)
+    yield async_db
+    async_db._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def fast_sends(monkeypatch):
+    """Общий лимитер Telegram без ожиданий"""
+    import delivery
+
+    monkeypatch.setattr(delivery.telegram_limiter, 'per_chat_interval', 0)
+    bucket = delivery.telegram_limiter.bucket
+    for name in ('rate', 'capacity', '_tokens'):
+        monkeypatch.setattr(bucket, name, 10 ** 9)
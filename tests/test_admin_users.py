@@ -0,0 +1,84 @@
+import pytest
+
+
+@pytest.fixture
+def users(db):
+    """10 пользователей, по три с одинаковым created_at: [(created_at, id), ...] от новых к старым"""
+    with db.connection() as conn:
+        for index in range(10):
+            conn.execute(
+                'INSERT INTO users (telegram_id, username, created_at) VALUES (?, ?, ?)',
+                (100 + index, f'user{index}', f'2024-01-0{1 + index // 3} 12:00:00')
+            )
+        conn.commit()
+        rows = conn.execute('SELECT created_at, id FROM users').fetchall()
+    return sorted((tuple(row) for row in rows), reverse=True)
+
+
+def keys(page):
+    return [(user['created_at'], user['id']) for user in page['users']]
+
+
+def edge(page, index):
+    user = page['users'][index]
+    return user['created_at'], user['id']
+
+
+def test_pages_older_cover_ties_once(db, users):
+    """Листание к старым проходит всех ровно по разу, в том числе при равных created_at"""
+    page = db.get_users_page(limit=4)
+    pages = [keys(page)]
+    assert (page['has_newer'], page['has_older']) == (False, True)
+
+    while page['has_older']:
+        page = db.get_users_page(edge(page, -1), 'older', limit=4)
+        pages.append(keys(page))
+
+    assert [len(chunk) for chunk in pages] == [4, 4, 2]
+    assert [key for chunk in pages for key in chunk] == users
+    assert page['has_newer']
+
+
+def test_older_then_newer_returns_same_page(db, users):
+    first = db.get_users_page(limit=4)
+    second = db.get_users_page(edge(first, -1), 'older', limit=4)
+    third = db.get_users_page(edge(second, -1), 'older', limit=4)
+
+    back = db.get_users_page(edge(third, 0), 'newer', limit=4)
+    assert keys(back) == keys(second)
+    assert (back['has_newer'], back['has_older']) == (True, True)
+
+    back = db.get_users_page(edge(back, 0), 'newer', limit=4)
+    assert keys(back) == keys(first)
+    assert back['has_newer'] is False
+
+
+@pytest.fixture
+def named(db):
+    for telegram_id, username in enumerate(['Alice', 'alice_b', 'aliceXb', 'ALIBABA', 'al', 'bob', 'Alz'], 1):
+        db.get_or_create_user(telegram_id, username)
+
+
+def usernames(found):
+    return [user['username'] for user in found]
+
+
+def test_search_is_case_insensitive(db, named):
+    assert usernames(db.search_users_by_username('ALI')) == ['ALIBABA', 'Alice', 'alice_b', 'aliceXb']
+    assert usernames(db.search_users_by_username('@bOB')) == ['bob']
+
+
+def test_search_prefix_equal_to_username(db, named):
+    """Префикс, совпадающий с username целиком, находит и его, и более длинные"""
+    assert usernames(db.search_users_by_username('al')) == ['al', 'ALIBABA', 'Alice', 'alice_b', 'aliceXb', 'Alz']
+    assert usernames(db.search_users_by_username('alice')) == ['Alice', 'alice_b', 'aliceXb']
+
+
+def test_search_underscore_is_literal(db, named):
+    """'_' - обычный символ, а не шаблон LIKE"""
+    assert usernames(db.search_users_by_username('alice_')) == ['alice_b']
+    assert db.search_users_by_username('zzz') == []
+
+
+def test_search_limit(db, named):
+    assert len(db.search_users_by_username('a', limit=2)) == 2
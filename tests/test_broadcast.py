@@ -0,0 +1,156 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import broadcast
+from broadcast import MediaGroupPayload, TextPayload, payload_from_job
+
+USERS = 120
+
+
+class Bot:
+    """Бот, который запоминает получателей и может поставить рассылку на паузу"""
+
+    def __init__(self, pause_after=None):
+        self.sent = []
+        self.pause_after = pause_after
+        self.job_id = None
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        self.sent.append(chat_id)
+        if self.pause_after and len(self.sent) == self.pause_after:
+            broadcast.pause_broadcast(self.job_id)
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+def application(bot):
+    return SimpleNamespace(bot=bot, create_task=asyncio.create_task)
+
+
+@pytest.fixture
+def users(db):
+    """telegram_id -> id пользователя"""
+    return {1000 + index: db.get_or_create_user(1000 + index, f'user{index}') for index in range(USERS)}
+
+
+async def run_broadcast(bot, job_id):
+    await broadcast.start_broadcast(application(bot), job_id)
+
+
+def recipients_left(db, job_id):
+    with db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = ?', (job_id,)).fetchone()[0]
+
+
+def test_full_run(db, async_db, fast_sends, users):
+    async def scenario():
+        job_id, total = await broadcast.create_broadcast(TextPayload('Привет'))
+        assert total == USERS
+        bot = Bot()
+        await run_broadcast(bot, job_id)
+        return job_id, bot
+
+    job_id, bot = asyncio.run(scenario())
+
+    assert sorted(bot.sent) == sorted(users)
+    job = db.get_broadcast_job(job_id)
+    assert (job['status'], job['sent'], job['cursor_user_id']) == ('done', USERS, max(users.values()))
+    assert recipients_left(db, job_id) == 0
+
+
+def test_pause_and_resume_skip_processed(db, async_db, fast_sends, users):
+    """После паузы продолжение начинается после контрольной точки, без повторов"""
+    async def scenario():
+        job_id, _ = await broadcast.create_broadcast(TextPayload('Привет'))
+        first = Bot(pause_after=30)
+        first.job_id = job_id
+        await run_broadcast(first, job_id)
+        paused = db.get_broadcast_job(job_id)
+
+        second = Bot()
+        assert await broadcast.resume_broadcast(application(second), job_id)
+        while broadcast.is_broadcast_running(job_id):
+            await asyncio.sleep(0.01)
+        return job_id, first, paused, second
+
+    job_id, first, paused, second = asyncio.run(scenario())
+
+    assert paused['status'] == 'paused'
+    assert 30 <= paused['sent'] == len(first.sent) < USERS
+    checkpoint = paused['cursor_user_id']
+    # Все отправленные до паузы - не дальше контрольной точки, продолжение - только после нее
+    assert all(users[chat_id] <= checkpoint for chat_id in first.sent)
+    assert all(users[chat_id] > checkpoint for chat_id in second.sent)
+    assert Counter(first.sent + second.sent) == Counter(users.keys())
+
+    job = db.get_broadcast_job(job_id)
+    assert (job['status'], job['sent']) == ('done', USERS)
+
+
+def test_resume_after_restart_from_checkpoint(db, async_db, fast_sends, users):
+    """Рассылка, прерванная перезапуском (status running), продолжается с контрольной точки"""
+    checkpoint = sorted(users.values())[49]
+
+    async def scenario():
+        job_id, _ = await broadcast.create_broadcast(TextPayload('Привет'))
+        await async_db.save_broadcast_progress(job_id, checkpoint, 50, 0, 0)
+        bot = Bot()
+        await broadcast.resume_broadcasts_job(SimpleNamespace(application=application(bot)))
+        while broadcast.is_broadcast_running(job_id):
+            await asyncio.sleep(0.01)
+        return job_id, bot
+
+    job_id, bot = asyncio.run(scenario())
+
+    assert sorted(bot.sent) == sorted(chat_id for chat_id, user_id in users.items() if user_id > checkpoint)
+    assert db.get_broadcast_job(job_id)['sent'] == USERS
+
+
+def test_cancel(db, async_db, fast_sends, users):
+    async def scenario():
+        paused_id, _ = await broadcast.create_broadcast(TextPayload('Первая'))
+        await async_db.set_broadcast_status(paused_id, 'paused')
+        assert await broadcast.cancel_broadcast(paused_id)
+        # Отмененную нельзя продолжить
+        assert not await broadcast.resume_broadcast(application(Bot()), paused_id)
+
+        running_id, _ = await broadcast.create_broadcast(TextPayload('Вторая'))
+        bot = Bot()
+        task = broadcast.start_broadcast(application(bot), running_id)
+        assert await broadcast.cancel_broadcast(running_id)
+        await task
+        return paused_id, running_id, bot
+
+    paused_id, running_id, bot = asyncio.run(scenario())
+
+    assert db.get_broadcast_job(paused_id)['status'] == 'cancelled'
+    assert db.get_broadcast_job(running_id)['status'] == 'cancelled'
+    assert len(bot.sent) < USERS
+    assert recipients_left(db, paused_id) == recipients_left(db, running_id) == 0
+
+
+def test_progress_for_missing_job_keeps_snapshot(db, users):
+    """Контрольная точка без строки задания ничего не удаляет"""
+    job_id = db.create_broadcast_job('РАССЫЛКА', 'text', '{"text": "x"}')
+    with db.connection() as conn:
+        conn.execute('DELETE FROM broadcast_jobs WHERE id = ?', (job_id,))
+        conn.commit()
+
+    assert not db.save_broadcast_progress(job_id, 0, 0, 0, 0, status='done')
+    assert recipients_left(db, job_id) == USERS
+
+
+def test_album_rejects_documents_with_photos():
+    with pytest.raises(ValueError):
+        MediaGroupPayload([{'type': 'photo', 'media': 'p1'}, {'type': 'document', 'media': 'd1'}])
+
+    documents = MediaGroupPayload([{'type': 'document', 'media': 'd1'}, {'type': 'document', 'media': 'd2'}])
+    visual = MediaGroupPayload([{'type': 'photo', 'media': 'p1'}, {'type': 'video', 'media': 'v1'}], caption='x')
+    for payload in (documents, visual):
+        job = {'payload_kind': payload.kind, 'payload': broadcast.dump_payload(payload)}
+        assert payload_from_job(job).to_dict() == payload.to_dict()
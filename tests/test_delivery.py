@@ -0,0 +1,156 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from telegram.error import BadRequest, Forbidden
+
+import delivery
+from delivery import RateLimiter, TokenBucket, fan_out
+
+
+class FakeClock:
+    """Время для лимитера: sleep не ждет, а сдвигает часы.
+
+    Скорости в тестах - степени двойки, чтобы шаги часов считались без
+    ошибок округления (иначе корзина может ждать бесконечно малые доли).
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += max(seconds, 0)
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+
+    class FakeAsyncio:
+        sleep = staticmethod(clock.sleep)
+
+        def __getattr__(self, name):
+            return getattr(asyncio, name)
+
+    class FakeTime:
+        monotonic = staticmethod(clock.monotonic)
+
+    monkeypatch.setattr(delivery, 'asyncio', FakeAsyncio())
+    monkeypatch.setattr(delivery, 'time', FakeTime())
+    return clock
+
+
+def fast_limiter():
+    return RateLimiter(global_rate=100000, per_chat_interval=0)
+
+
+def test_bucket_rate_bound(clock):
+    """После запаса capacity токены выдаются не чаще rate в секунду"""
+    bucket = TokenBucket(rate=8, capacity=4)
+
+    async def run():
+        times = []
+        for _ in range(20):
+            await bucket.acquire()
+            times.append(clock.now)
+        return times
+
+    times = asyncio.run(run())
+    assert times[:4] == [0.0] * 4
+    assert times[4:] == [0.125 * i for i in range(1, 17)]
+
+
+def test_pause_does_not_refill(clock):
+    """После RetryAfter корзина пополняется с конца паузы, а не залпом"""
+    bucket = TokenBucket(rate=8, capacity=8)
+
+    async def run():
+        bucket.pause(5)
+        times = []
+        for _ in range(3):
+            await bucket.acquire()
+            times.append(clock.now)
+        return times
+
+    assert asyncio.run(run()) == [5.125, 5.25, 5.375]
+
+
+def test_per_chat_interval(clock):
+    """В один чат - не чаще per_chat_interval, другие чаты не ждут"""
+    limiter = RateLimiter(global_rate=1024, per_chat_interval=1.0)
+
+    async def run():
+        times = []
+        for chat_id in (1, 2, 1, 2, 1, 3):
+            await limiter.acquire(chat_id)
+            times.append((chat_id, round(clock.now, 3)))
+        return times
+
+    assert asyncio.run(run()) == [(1, 0.0), (2, 0.0), (1, 1.0), (2, 1.0), (1, 2.0), (3, 2.0)]
+
+
+def test_on_result_sees_each_item_once():
+    seen = Counter()
+    errors = {}
+
+    async def send(chat_id):
+        await asyncio.sleep(0)
+        if chat_id % 7 == 0:
+            raise Forbidden('bot was blocked by the user')
+        if chat_id % 5 == 0:
+            raise BadRequest('message is too long')
+
+    def on_result(chat_id, error):
+        seen[chat_id] += 1
+        errors[chat_id] = error
+
+    stats = asyncio.run(fan_out(range(1, 101), send, concurrency=8, limiter=fast_limiter(), on_result=on_result))
+
+    assert seen == Counter(range(1, 101))
+    assert {chat_id for chat_id, error in errors.items() if error} == {
+        chat_id for chat_id in range(1, 101) if chat_id % 7 == 0 or chat_id % 5 == 0
+    }
+    assert stats.sent + stats.failed == 100
+    assert stats.blocked == 14
+
+
+def test_fan_out_reraises_items_error():
+    """Ошибка источника получателей пробрасывается, а не вешает отправку"""
+    sent = []
+
+    async def send(chat_id):
+        sent.append(chat_id)
+
+    async def items():
+        for chat_id in range(1, 50):
+            yield chat_id
+        raise RuntimeError('stream failed')
+
+    async def run():
+        await asyncio.wait_for(fan_out(items(), send, concurrency=3, limiter=fast_limiter()), 5)
+
+    with pytest.raises(RuntimeError, match='stream failed'):
+        asyncio.run(run())
+
+
+def test_fan_out_survives_on_result_error():
+    """Ошибка on_result пишется в лог, отправка продолжается"""
+    sent = []
+
+    async def send(chat_id):
+        sent.append(chat_id)
+
+    def on_result(chat_id, error):
+        raise ValueError('handler failed')
+
+    async def run():
+        return await asyncio.wait_for(
+            fan_out(range(100), send, concurrency=3, limiter=fast_limiter(), on_result=on_result), 5
+        )
+
+    assert asyncio.run(run()).sent == 100
+    assert sorted(sent) == list(range(100))
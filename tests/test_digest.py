@@ -0,0 +1,66 @@
+import notifications
+from notifications import (
+    DIGEST_MAX_ITEMS, format_digest_notification, group_by_chat, render_chat_notification
+)
+
+
+def reminder(id, days_before=1, amount=100, telegram_id=1, is_premium=False):
+    return {
+        'id': id, 'telegram_id': telegram_id, 'title': f'Платеж {id}', 'amount': amount,
+        'payment_date': f'2024-05-{10 + days_before:02d}', 'days_before': days_before,
+        'is_premium': is_premium,
+    }
+
+
+def test_single_reminder_is_not_digest():
+    message = render_chat_notification([reminder(1, days_before=0, amount=250)])
+
+    assert message == notifications.format_reminder_notification(reminder(1, days_before=0, amount=250))
+    assert 'НАПОМИНАНИЕ О ПЛАТЕЖЕ!' in message
+    assert 'Платеж 1' in message and '250₽' in message and 'СЕГОДНЯ!' in message
+    assert 'Итого' not in message
+
+
+def test_digest_groups_by_days_before():
+    group = [reminder(3, days_before=7, amount=10.5, is_premium=True), reminder(1, amount=20), reminder(2, amount=30)]
+
+    message = render_chat_notification(group)
+
+    assert message == format_digest_notification(group)
+    assert message.startswith('🔔 <b>НАПОМИНАНИЕ О ПЛАТЕЖАХ!</b>\n')
+    lines = message.split('\n')
+    assert lines.index('<b>📅 Завтра</b>') < lines.index('• Платеж 1 — 20₽') < lines.index('• Платеж 2 — 30₽')
+    assert lines.index('• Платеж 2 — 30₽') < lines.index('<b>📅 Через 7 дней</b>') < lines.index('• Платеж 3 — 10.5₽')
+    assert '💰 <b>Итого:</b> 60.5₽' in message
+    assert '…' not in message
+    assert message.endswith('💎 <i>Спасибо за использование премиума!</i>')
+
+
+def test_digest_truncates_long_list():
+    """Показываются первые DIGEST_MAX_ITEMS, остальные - строкой «… и еще N», итог - по всем"""
+    extra = 5
+    group = [reminder(id) for id in range(DIGEST_MAX_ITEMS + extra, 0, -1)]
+
+    message = format_digest_notification(group)
+
+    items = [line for line in message.split('\n') if line.startswith('• ')]
+    assert items == [f'• Платеж {id} — 100₽' for id in range(1, DIGEST_MAX_ITEMS + 1)]
+    assert f'… и еще {extra}\n' in message
+    assert f'💰 <b>Итого:</b> {100 * (DIGEST_MAX_ITEMS + extra)}₽' in message
+    assert message.endswith('оформите премиум</i>')
+
+
+def test_digest_at_limit_is_not_truncated():
+    message = format_digest_notification([reminder(id) for id in range(1, DIGEST_MAX_ITEMS + 1)])
+
+    assert message.count('• ') == DIGEST_MAX_ITEMS
+    assert '…' not in message
+
+
+def test_group_by_chat_keeps_chat_order():
+    batch = [reminder(1, telegram_id=20), reminder(2, telegram_id=10), reminder(3, telegram_id=20), reminder(4, telegram_id=30)]
+
+    groups = group_by_chat(batch)
+
+    assert [[r['id'] for r in group] for group in groups] == [[1, 3], [2], [4]]
+    assert [render_chat_notification(group).startswith('🔔 <b>НАПОМИНАНИЕ О ПЛАТЕЖАХ!') for group in groups] == [True, False, False]
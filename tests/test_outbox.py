@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from telegram.error import BadRequest, Forbidden
+
+import database as database_module
+import notifications
+
+
+def stamp(delta=timedelta()):
+    return (datetime.now() + delta).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def queue(db, *chats):
+    """Поставить в очередь строки: chats - (chat_id, число строк, priority)"""
+    rows = []
+    for chat_id, count, priority in chats:
+        for index in range(count):
+            rows.append({
+                'reminder_id': chat_id * 100 + index, 'offset_days': 1, 'run_date': '2000-01-01',
+                'chat_id': chat_id, 'title': f'Платеж {index}', 'amount': 100, 'payment_date': '2000-01-02',
+                'is_premium': False, 'priority': priority, 'message': None,
+                'next_attempt_at': stamp(-timedelta(minutes=1)), 'expires_at': stamp(timedelta(hours=1)),
+            })
+    assert db.store_send_plan(rows) == len(rows)
+
+
+def statuses(db):
+    with db.connection() as conn:
+        return {row['reminder_id']: dict(row) for row in conn.execute(
+            'SELECT reminder_id, chat_id, status, attempts, next_attempt_at, last_error FROM notification_outbox'
+        )}
+
+
+def test_claim_takes_whole_chats_by_priority(db):
+    queue(db, (1, 3, 7), (2, 2, 1), (3, 1, 3))
+
+    batch = db.claim_outbox_batch(chat_limit=2)
+
+    assert sorted({row['telegram_id'] for row in batch}) == [2, 3]
+    assert len(batch) == 3
+    assert all(row['attempts'] == 1 and row['days_before'] == 1 for row in batch)
+    state = statuses(db)
+    assert {rid: row['status'] for rid, row in state.items() if row['chat_id'] == 1} == \
+        {100: 'pending', 101: 'pending', 102: 'pending'}
+    # Повторно те же чаты не забираются
+    assert {row['telegram_id'] for row in db.claim_outbox_batch(chat_limit=10)} == {1}
+    assert db.claim_outbox_batch() == []
+
+
+def test_chat_priority_is_its_lowest(db):
+    """Чат со строками разного приоритета идет по наименьшему"""
+    queue(db, (1, 2, 5), (2, 1, 2))
+    with db.connection() as conn:
+        conn.execute('UPDATE notification_outbox SET priority = 1 WHERE reminder_id = 100')
+        conn.commit()
+
+    assert {row['telegram_id'] for row in db.claim_outbox_batch(chat_limit=1)} == {1}
+
+
+def test_claim_skips_not_ready_and_expired(db):
+    queue(db, (1, 1, 1), (2, 1, 1), (3, 1, 1))
+    with db.connection() as conn:
+        conn.execute('UPDATE notification_outbox SET next_attempt_at = ? WHERE chat_id = 1',
+                     (stamp(timedelta(minutes=5)),))
+        conn.execute('UPDATE notification_outbox SET expires_at = ? WHERE chat_id = 2',
+                     (stamp(-timedelta(seconds=1)),))
+        conn.commit()
+
+    assert [row['telegram_id'] for row in db.claim_outbox_batch()] == [3]
+    assert db.count_ready_outbox_chats() == 0
+
+
+def test_complete_and_retry_backoff(db):
+    queue(db, (1, 1, 1), (2, 1, 1), (3, 2, 1))
+    batch = {row['reminder_id']: row for row in db.claim_outbox_batch()}
+    with db.connection() as conn:
+        conn.execute('UPDATE notification_outbox SET attempts = ? WHERE reminder_id = 301',
+                     (database_module.OUTBOX_MAX_ATTEMPTS,))
+        conn.commit()
+
+    before = datetime.now().replace(microsecond=0)
+    assert db.complete_outbox_batch(
+        sent=[batch[100]['id']],
+        blocked=[batch[200]['id']],
+        failed=[(batch[300]['id'], 2, 'timeout'), (batch[301]['id'], database_module.OUTBOX_MAX_ATTEMPTS, 'boom')]
+    )
+
+    state = statuses(db)
+    assert state[100]['status'] == 'sent'
+    assert state[200]['status'] == 'blocked'
+    assert state[301]['status'] == 'failed'
+    # Вторая неудачная попытка - повтор через OUTBOX_RETRY_DELAY * 2
+    retry = state[300]
+    assert (retry['status'], retry['last_error']) == ('pending', 'timeout')
+    delay = datetime.strptime(retry['next_attempt_at'], '%Y-%m-%d %H:%M:%S') - before
+    assert timedelta(seconds=database_module.OUTBOX_RETRY_DELAY * 2) <= delay \
+        <= timedelta(seconds=database_module.OUTBOX_RETRY_DELAY * 2 + 2)
+    assert db.claim_outbox_batch() == []
+
+
+def test_reset_stale_sending(db):
+    queue(db, (1, 1, 1), (2, 1, 1))
+    db.claim_outbox_batch()
+    with db.connection() as conn:
+        conn.execute('UPDATE notification_outbox SET claimed_at = ? WHERE chat_id = 1',
+                     (stamp(-timedelta(minutes=30)),))
+        conn.commit()
+
+    assert db.reset_stale_outbox(lease_seconds=600) == 1
+    state = statuses(db)
+    assert (state[100]['status'], state[200]['status']) == ('pending', 'sending')
+    assert [row['telegram_id'] for row in db.claim_outbox_batch()] == [1]
+
+
+class Bot:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+
+def test_deliver_with_chat_failing_mid_batch(db, async_db, fast_sends):
+    """Ошибка одного чата посреди порции не влияет на остальные"""
+    queue(db, *[(chat_id, 2, 1) for chat_id in range(1, 11)])
+    bot = Bot({4: BadRequest('message is too long'), 7: Forbidden('bot was blocked by the user')})
+
+    stats = asyncio.run(notifications.deliver_outbox(bot))
+
+    assert sorted(bot.sent) == [1, 2, 3, 5, 6, 8, 9, 10]
+    assert (stats.sent, stats.failed, stats.blocked) == (8, 2, 1)
+    by_chat = {}
+    for row in statuses(db).values():
+        by_chat.setdefault(row['chat_id'], set()).add(row['status'])
+    assert by_chat.pop(4) == {'pending'}
+    assert by_chat.pop(7) == {'blocked'}
+    assert all(state == {'sent'} for state in by_chat.values())
+
+
+def test_interrupted_delivery_keeps_sent_rows(db, async_db, fast_sends, monkeypatch):
+    """Прерванная порция: доставленные чаты уже отмечены и не уйдут повторно"""
+    monkeypatch.setattr(notifications, 'NOTIFICATION_CONCURRENCY', 1)
+    queue(db, *[(chat_id, 1, 1) for chat_id in range(1, 7)])
+
+    class HangingBot(Bot):
+        async def send_message(self, chat_id, text, **kwargs):
+            if chat_id == 4:
+                await asyncio.Event().wait()
+            await super().send_message(chat_id, text)
+
+    bot = HangingBot()
+
+    async def run():
+        task = asyncio.create_task(notifications.deliver_outbox(bot))
+        while len(bot.sent) < 3:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    state = {row['chat_id']: row['status'] for row in statuses(db).values()}
+    assert state == {1: 'sent', 2: 'sent', 3: 'sent', 4: 'sending', 5: 'sending', 6: 'sending'}
@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def queries(db, monkeypatch):
+    """Счетчик обращений к БД (взятий подключения из пула)"""
+    counter = {'count': 0}
+    connection = db.connection
+
+    @contextmanager
+    def counting_connection():
+        counter['count'] += 1
+        with connection() as conn:
+            yield conn
+
+    monkeypatch.setattr(db, 'connection', counting_connection)
+    return counter
+
+
+def profile(db):
+    return db.get_user_profile(1, 'user', 'Имя')
+
+
+def test_repeated_profile_is_served_from_cache(db, queries):
+    first = profile(db)
+    assert first['reminders_count'] == 0 and not first['has_premium']
+    queries['count'] = 0
+
+    assert profile(db) == first
+    assert queries['count'] == 0
+
+
+def test_changed_names_bypass_cache(db, queries):
+    profile(db)
+    queries['count'] = 0
+    db.get_user_profile(1, 'renamed', 'Имя')
+    assert queries['count'] == 1
+
+
+@pytest.mark.parametrize('change', ['add', 'delete', 'premium', 'advance'])
+def test_invalidation(db, change):
+    """Изменения напоминаний и премиума сразу видны в снимке"""
+    user_id = profile(db)['id']
+    past = (date.today() - timedelta(days=3)).isoformat()
+    reminder_id = db.add_reminder(user_id, 'Аренда', 1000, past, recurrence='weekly')
+    with db.connection() as conn:
+        conn.execute('UPDATE reminders SET is_paid = TRUE')
+        conn.commit()
+    before = profile(db)
+    assert before['reminders_count'] == 1 and before['reminders_total'] == 0
+
+    if change == 'add':
+        db.add_reminder(user_id, 'Связь', 300, date.today().isoformat())
+        assert profile(db)['reminders_count'] == 2
+        assert profile(db)['reminders_total'] == 300
+    elif change == 'delete':
+        db.delete_reminder(user_id, reminder_id)
+        assert profile(db)['reminders_count'] == 0
+    elif change == 'premium':
+        db.activate_premium(user_id, 30)
+        assert profile(db)['has_premium']
+        db.deactivate_premium(user_id)
+        assert not profile(db)['has_premium']
+    else:
+        # Новый повтор снова не оплачен - сумма неоплаченных выросла
+        assert db.advance_recurring_reminders() == 1
+        assert profile(db)['reminders_total'] == 1000
+
+
+def test_entry_expires_after_ttl(db, queries, database, monkeypatch):
+    clock = {'now': 1000.0}
+    monkeypatch.setattr(database.time, 'monotonic', lambda: clock['now'])
+
+    profile(db)
+    clock['now'] += db.profile_cache_ttl - 1
+    queries['count'] = 0
+    profile(db)
+    assert queries['count'] == 0
+
+    clock['now'] += 1
+    profile(db)
+    assert queries['count'] == 1
+
+
+def test_expired_premium_is_checked_in_memory(db, queries, database, monkeypatch):
+    """Подписка, закончившаяся после кэширования, не считается действующей"""
+    user_id = profile(db)['id']
+    db.activate_premium(user_id, 1)
+    assert profile(db)['has_premium']
+
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=2)
+
+    monkeypatch.setattr(database, 'datetime', Later)
+    queries['count'] = 0
+    assert not profile(db)['has_premium']
+    assert queries['count'] == 0
@@ -0,0 +1,22 @@
+def test_hot_queries_use_indexes(database, tmp_path):
+    """Все горячие запросы на свежей схеме идут по индексам"""
+    db = database.Database(str(tmp_path / 'plans.db'))
+    try:
+        db.init_db()  # Повторный вызов, как при перезапуске бота
+        assert db.check_query_plans() == []
+    finally:
+        db.close()
+
+
+def test_check_reports_full_scan(database, tmp_path, monkeypatch):
+    """Проверка не пустая: полный просмотр таблицы попадает в список проблем"""
+    db = database.Database(str(tmp_path / 'plans.db'))
+    try:
+        monkeypatch.setattr(db, '_hot_queries', lambda: [
+            ('scan', 'SELECT * FROM reminders WHERE title = ?', ('x',)),
+        ])
+        problems = db.check_query_plans()
+        assert len(problems) == 1
+        assert problems[0].startswith('scan: SCAN')
+    finally:
+        db.close()
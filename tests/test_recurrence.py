@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+
+def test_add_months_keeps_anchor_day(database):
+    """31-е становится последним днем короткого месяца и возвращается в длинном"""
+    start = date(2023, 1, 31)
+    assert database.add_months(start, 1, 31) == date(2023, 2, 28)
+    assert database.add_months(date(2023, 2, 28), 1, 31) == date(2023, 3, 31)
+    assert database.add_months(date(2024, 1, 31), 1, 31) == date(2024, 2, 29)
+    assert database.add_months(date(2023, 11, 30), 2, 30) == date(2024, 1, 30)
+
+
+def test_monthly_end_of_month_series(database):
+    """Серия от 31 января: Feb 28/29, затем снова 31 марта"""
+    assert database.next_payment_date(date(2023, 1, 31), 'monthly', 1, 31, date(2023, 2, 1)) == date(2023, 2, 28)
+    assert database.next_payment_date(date(2024, 1, 31), 'monthly', 1, 31, date(2024, 2, 1)) == date(2024, 2, 29)
+    # После февраля дата берется от якоря, а не от 28-го
+    assert database.next_payment_date(date(2023, 2, 28), 'monthly', 1, 31, date(2023, 3, 1)) == date(2023, 3, 31)
+
+
+def test_yearly_leap_day(database):
+    """29 февраля в невисокосный год - 28-е, в високосный - снова 29-е"""
+    assert database.next_payment_date(date(2024, 2, 29), 'yearly', 1, 29, date(2024, 3, 1)) == date(2025, 2, 28)
+    assert database.next_payment_date(date(2025, 2, 28), 'yearly', 1, 29, date(2025, 3, 1)) == date(2026, 2, 28)
+    assert database.next_payment_date(date(2027, 2, 28), 'yearly', 1, 29, date(2027, 3, 1)) == date(2028, 2, 29)
+
+
+def test_catches_up_several_missed_periods(database):
+    """Дата в прошлом на несколько периодов - сразу ближайший повтор не раньше today"""
+    today = date(2024, 6, 15)
+    assert database.next_payment_date(date(2024, 1, 10), 'monthly', 1, 10, today) == date(2024, 7, 10)
+    assert database.next_payment_date(date(2024, 1, 31), 'monthly', 2, 31, today) == date(2024, 7, 31)
+    assert database.next_payment_date(date(2024, 5, 1), 'weekly', 1, None, today) == date(2024, 6, 19)
+    assert database.next_payment_date(date(2024, 6, 1), 'days', 5, None, today) == date(2024, 6, 16)
+    # Повтор, выпадающий ровно на today, не пропускается
+    assert database.next_payment_date(date(2024, 6, 1), 'weekly', 2, None, today) == date(2024, 6, 15)
+    assert database.next_payment_date(date(2020, 6, 15), 'yearly', 1, 15, today) == date(2024, 6, 15)
+
+
+def test_unknown_rule_and_future_date_unchanged(database):
+    today = date(2024, 6, 15)
+    assert database.next_payment_date(date(2024, 1, 1), 'hourly', 1, None, today) == date(2024, 1, 1)
+    assert database.next_payment_date(date(2024, 7, 1), 'monthly', 1, 1, today) == date(2024, 7, 1)
+
+
+def test_advance_recurring_reminders_moves_row(db):
+    """Наступивший платеж переносится на следующий повтор и снова не оплачен"""
+    user_id = db.get_or_create_user(1, 'user')
+    today = date.today()
+    past = today - timedelta(days=10)
+    recurring_id = db.add_reminder(user_id, 'Связь', 300, past.isoformat(), recurrence='weekly')
+    once_id = db.add_reminder(user_id, 'Разовый', 100, past.isoformat())
+    with db.connection() as conn:
+        conn.execute('UPDATE reminders SET is_paid = TRUE')
+        conn.commit()
+
+    assert db.advance_recurring_reminders() == 1
+
+    with db.connection() as conn:
+        rows = {row['id']: dict(row) for row in conn.execute('SELECT id, payment_date, is_paid FROM reminders')}
+    assert rows[recurring_id]['payment_date'] == (past + timedelta(days=14)).isoformat()
+    assert not rows[recurring_id]['is_paid']
+    # Разовый платеж не трогается
+    assert rows[once_id] == {'id': once_id, 'payment_date': past.isoformat(), 'is_paid': 1}
+    # Повторный запуск ничего не переносит
+    assert db.advance_recurring_reminders() == 0
@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import AUDIENCE_SEGMENTS
+
+TODAY = date.today()
+
+
+def day(offset):
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture
+def users(db):
+    """username -> id пользователя; у каждого свое сочетание признаков сегментов"""
+    columns = {
+        'premium': dict(is_premium=True, premium_until=day(30)),
+        'expiring': dict(is_premium=True, premium_until=day(3)),
+        'lifetime': dict(is_premium=True, premium_until=None),
+        'expired': dict(is_premium=True, premium_until=day(-1), reminders_count=5),
+        'at_limit': dict(reminders_count=5),
+        'sleeping': dict(reminders_count=2, last_seen_at=day(-40)),
+        'blocked': dict(is_premium=True, premium_until=day(3), reminders_count=5,
+                        last_seen_at=day(-40), delivery_state='blocked'),
+        'blocked_free': dict(reminders_count=5, delivery_state='deactivated'),
+    }
+    ids = {}
+    for telegram_id, (username, values) in enumerate(columns.items(), 1):
+        ids[username] = db.get_or_create_user(telegram_id, username)
+
+    # Платежи недели: неоплаченный у at_limit и blocked; оплаченный и поздний не считаются
+    db.add_reminder(ids['at_limit'], 'Интернет', 500, day(2))
+    db.add_reminder(ids['blocked'], 'Телефон', 300, day(6))
+    paid = db.add_reminder(ids['sleeping'], 'Аренда', 9000, day(1))
+    db.add_reminder(ids['premium'], 'Кредит', 7000, day(10))
+
+    with db.connection() as conn:
+        conn.execute('UPDATE reminders SET is_paid = TRUE WHERE id = ?', (paid,))
+        for username, values in columns.items():
+            assignments = ', '.join(f'{column} = ?' for column in values)
+            conn.execute(f'UPDATE users SET {assignments} WHERE id = ?', (*values.values(), ids[username]))
+        conn.commit()
+    return ids
+
+
+# Сегмент -> (параметры, доступные участники, недоступные участники)
+EXPECTED = {
+    'all': ({}, {'premium', 'expiring', 'lifetime', 'expired', 'at_limit', 'sleeping'}, {'blocked', 'blocked_free'}),
+    'premium': ({}, {'premium', 'expiring', 'lifetime'}, {'blocked'}),
+    'premium_expiring': ({'days': 7}, {'expiring'}, {'blocked'}),
+    'free_at_limit': ({'free_limit': 5}, {'at_limit'}, {'blocked_free'}),
+    'due_this_week': ({}, {'at_limit'}, {'blocked'}),
+    'inactive': ({'days': 30}, {'sleeping'}, {'blocked'}),
+}
+
+
+def segment_users(db, users, segment, params):
+    query = db._segment_query(segment, params.get('exclude_blocked', True))
+    with db.connection() as conn:
+        rows = conn.execute(query, db._segment_params(params.get('days'), params.get('free_limit'))).fetchall()
+    names = {user_id: username for username, user_id in users.items()}
+    return {names[row['id']] for row in rows}
+
+
+def test_every_segment_is_covered():
+    assert set(EXPECTED) == set(AUDIENCE_SEGMENTS)
+
+
+@pytest.mark.parametrize('segment', EXPECTED)
+def test_segment_members(db, users, segment):
+    params, active, undeliverable = EXPECTED[segment]
+
+    assert segment_users(db, users, segment, params) == active
+    assert segment_users(db, users, segment, dict(params, exclude_blocked=False)) == active | undeliverable
+
+
+@pytest.mark.parametrize('segment', EXPECTED)
+@pytest.mark.parametrize('exclude_blocked', [True, False])
+def test_count_matches_snapshot(db, users, segment, exclude_blocked):
+    """Подсчет для подтверждения совпадает с размером снимка получателей рассылки"""
+    params, active, undeliverable = EXPECTED[segment]
+    params = dict(params, exclude_blocked=exclude_blocked)
+
+    count = db.count_segment(segment, params.get('days'), params.get('free_limit'), exclude_blocked)
+    job_id = db.create_broadcast_job('test', 'text', '{}', segment, params)
+
+    assert count == len(active if exclude_blocked else active | undeliverable)
+    assert db.get_broadcast_job(job_id)['total'] == count
+    with db.connection() as conn:
+        snapshot = conn.execute('SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = ?', (job_id,)).fetchone()[0]
+    assert snapshot == count
+
+
+def test_unknown_segment(db, users):
+    assert db.count_segment('nobody') == 0
+    assert db.create_broadcast_job('test', 'text', '{}', 'nobody') is None
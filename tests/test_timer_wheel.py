@@ -0,0 +1,100 @@
+import pytest
+
+from timer_wheel import TimerWheel
+
+# Не на границе минуты и часа, чтобы таймеры проходили через каскады
+START = 1_700_000_000 + 1234
+
+
+def fire_times(wheel, until):
+    """Продвигать колесо по секунде до until: {key: момент срабатывания}"""
+    fired = {}
+    for now in range(int(wheel.current_tick) + 1, until + 1):
+        for key, _ in wheel.advance(now):
+            assert key not in fired
+            fired[key] = now
+    return fired
+
+
+@pytest.mark.parametrize('delay', [1, 5, 59, 60, 61, 90, 3599, 3600, 3601, 2 * 3600 + 17, 86399])
+def test_fires_exactly_on_time(delay):
+    """Таймер на любом уровне срабатывает ровно в свою секунду"""
+    wheel = TimerWheel(now=START)
+    wheel.schedule('t', START + delay, 'payload')
+
+    assert wheel.advance(START + delay - 1) == []
+    assert wheel.advance(START + delay) == [('t', 'payload')]
+    assert len(wheel) == 0
+
+
+def test_fire_order_across_levels():
+    """Секунды, минуты, часы и дальше горизонта - в порядке сроков"""
+    wheel = TimerWheel(now=START)
+    delays = {'day+': 86400 + 700, 'hours': 3 * 3600 + 5, 'minutes': 7 * 60 + 3, 'seconds': 12}
+    for key, delay in delays.items():
+        wheel.schedule(key, START + delay, key)
+
+    fired = []
+    now = START
+    while len(wheel):
+        now += 1
+        fired += [(key, now - START) for key, _ in wheel.advance(now)]
+
+    assert fired == sorted(((key, delay) for key, delay in delays.items()), key=lambda item: item[1])
+
+
+def test_advance_in_one_step_keeps_order():
+    """Большой шаг advance возвращает все сработавшие в порядке сроков"""
+    wheel = TimerWheel(now=START)
+    for key, delay in (('c', 4000), ('a', 3), ('b', 200)):
+        wheel.schedule(key, START + delay)
+    assert [key for key, _ in wheel.advance(START + 5000)] == ['a', 'b', 'c']
+
+
+def test_cancelled_timer_never_fires():
+    wheel = TimerWheel(now=START)
+    for key, delay in (('sec', 10), ('min', 600), ('hour', 7200), ('far', 200000)):
+        wheel.schedule(key, START + delay)
+    wheel.schedule('kept', START + 7200)
+
+    for key in ('sec', 'min', 'hour', 'far'):
+        assert wheel.cancel(key)
+    assert not wheel.cancel('sec')
+    assert 'min' not in wheel
+
+    fired = fire_times(wheel, START + 200001)
+    assert fired == {'kept': START + 7200}
+
+
+def test_reschedule_moves_timer():
+    """Повторный schedule с тем же ключом переносит таймер"""
+    wheel = TimerWheel(now=START)
+    wheel.schedule('t', START + 3600)
+    wheel.schedule('t', START + 30)
+    assert len(wheel) == 1
+    assert fire_times(wheel, START + 4000) == {'t': START + 30}
+
+
+def test_past_time_fires_on_next_tick():
+    wheel = TimerWheel(now=START)
+    wheel.schedule('late', START - 100)
+    assert wheel.advance(START + 1) == [('late', None)]
+
+
+def test_overflow_returns_at_hour_boundary():
+    """Таймер дальше суток ждет вне колеса и раскладывается в начале часа"""
+    wheel = TimerWheel(now=START)
+    expires = START + wheel.horizon + 5000
+    wheel.schedule('far', expires)
+    assert 'far' in wheel._overflow
+
+    # Первая граница часа, на которой таймер уже в пределах колеса
+    boundary = (expires - wheel.horizon) // 3600 * 3600 + 3600
+    wheel.advance(boundary - 1)
+    assert 'far' in wheel._overflow
+    wheel.advance(boundary)
+    assert 'far' not in wheel._overflow
+    assert 'far' in wheel
+
+    assert wheel.advance(expires - 1) == []
+    assert wheel.advance(expires) == [('far', None)]
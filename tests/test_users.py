@@ -0,0 +1,84 @@
+import pytest
+
+
+@pytest.fixture
+def user_writes(db):
+    """Число UPDATE строк users (триггер в тестовой БД)"""
+    with db.connection() as conn:
+        conn.execute('CREATE TABLE test_user_writes (telegram_id INTEGER)')
+        conn.execute('''
+            CREATE TRIGGER test_count_user_writes AFTER UPDATE ON users
+            BEGIN
+                INSERT INTO test_user_writes VALUES (NEW.telegram_id);
+            END
+        ''')
+        conn.commit()
+
+    def count():
+        with db.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM test_user_writes').fetchone()[0]
+
+    return count
+
+
+def user_row(db, telegram_id):
+    with db.connection() as conn:
+        return dict(conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone())
+
+
+def test_new_user(db, user_writes):
+    user_id = db.get_or_create_user(42, 'alice', 'Алиса', 'Смирнова')
+
+    row = user_row(db, 42)
+    assert row['id'] == user_id
+    assert (row['username'], row['first_name'], row['last_name']) == ('alice', 'Алиса', 'Смирнова')
+    assert row['delivery_state'] == 'active'
+    assert user_writes() == 0
+    assert db.get_statistics()['total_users'] == 1
+
+
+def test_unchanged_user_does_not_write(db, user_writes):
+    user_id = db.get_or_create_user(42, 'alice', 'Алиса')
+
+    # Из LRU-кэша - без запроса
+    assert db.get_or_create_user(42, 'alice', 'Алиса') == user_id
+    # Мимо кэша: UPSERT пропускает UPDATE, id берется отдельным SELECT
+    db._user_cache.clear()
+    assert db.get_or_create_user(42, 'alice', 'Алиса') == user_id
+    assert user_writes() == 0
+
+
+def test_username_change_updates_same_user(db, user_writes):
+    user_id = db.get_or_create_user(42, 'alice', 'Алиса')
+
+    assert db.get_or_create_user(42, 'alice_new', 'Алиса') == user_id
+    assert user_row(db, 42)['username'] == 'alice_new'
+    assert user_writes() == 1
+    assert db.get_statistics()['total_users'] == 1
+
+
+def test_blocked_user_is_reactivated(db):
+    user_id = db.get_or_create_user(42, 'alice', 'Алиса')
+    db.mark_chats_undeliverable({42: 'blocked'})
+    assert user_row(db, 42)['delivery_state'] == 'blocked'
+
+    # Тот же профиль: запись все равно нужна, чтобы вернуть статус active
+    assert db.get_or_create_user(42, 'alice', 'Алиса') == user_id
+    row = user_row(db, 42)
+    assert row['delivery_state'] == 'active'
+    assert row['delivery_state_at'] is not None
+
+
+def test_lru_evicts_oldest(database, tmp_path):
+    db = database.Database(str(tmp_path / 'lru.db'), user_cache_size=2)
+    try:
+        for telegram_id in (1, 2, 3):
+            db.get_or_create_user(telegram_id, f'user{telegram_id}')
+        assert list(db._user_cache) == [2, 3]
+
+        # Обращение из кэша делает запись самой свежей
+        db.get_or_create_user(2, 'user2')
+        db.get_or_create_user(4, 'user4')
+        assert list(db._user_cache) == [2, 4]
+    finally:
+        db.close()
@@ -0,0 +1,110 @@
+# timer_wheel.py - иерархическое колесо таймеров для точных напоминаний
+import time
+
+# Уровни колеса: 60 слотов по секунде, 60 по минуте, 24 по часу - сутки вперед
+WHEEL_LEVELS = (60, 60, 24)
+
+class TimerWheel:
+    """Иерархическое колесо таймеров.
+
+    Таймер кладется в слот уровня, соответствующего его задержке: ближайшая
+    минута - в секундный уровень, ближайший час - в минутный и т.д. Добавление
+    и отмена по ключу - O(1). При переходе через границу минуты (часа) слот
+    старшего уровня раскладывается по младшим. Таймеры дальше горизонта
+    колеса ждут в отдельном списке и раскладываются каждый час.
+    Время - секунды эпохи (time.time()), разрешение - tick секунд.
+    Колесо не потокобезопасно: работать с ним нужно из одного event loop.
+    """
+
+    def __init__(self, levels=WHEEL_LEVELS, tick=1.0, now=None):
+        self.tick = tick
+        self.levels = levels
+        # Длина слота каждого уровня в тиках: 1, 60, 3600
+        self._spans = []
+        span = 1
+        for size in levels:
+            self._spans.append(span)
+            span *= size
+        self.horizon = span  # в тиках
+        self._wheels = [[{} for _ in range(size)] for size in levels]
+        self._overflow = {}
+        self._timers = {}  # key -> (слот, срок в тиках)
+        self.current_tick = self._to_tick(time.time() if now is None else now)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _to_tick(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def _place(self, key, expires, payload):
+        """Положить таймер в слот по задержке относительно current_tick"""
+        delay = expires - self.current_tick
+        if delay >= self.horizon:
+            bucket = self._overflow
+        else:
+            for level, size in enumerate(self.levels):
+                span = self._spans[level]
+                if delay < span * size:
+                    bucket = self._wheels[level][(expires // span) % size]
+                    break
+        bucket[key] = (expires, payload)
+        self._timers[key] = (bucket, expires)
+
+    def schedule(self, key, when, payload=None):
+        """Запланировать таймер key на момент when (секунды эпохи).
+
+        Повторный schedule с тем же ключом переносит таймер. Прошедшее
+        время срабатывает на ближайшем тике.
+        """
+        self.cancel(key)
+        expires = max(self._to_tick(when), self.current_tick + 1)
+        self._place(key, expires, payload)
+
+    def cancel(self, key):
+        """Отменить таймер. Возвращает True, если он был"""
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        bucket, _ = timer
+        bucket.pop(key, None)
+        return True
+
+    def _cascade(self, level):
+        """Разложить текущий слот уровня level по младшим уровням"""
+        span = self._spans[level]
+        bucket = self._wheels[level][(self.current_tick // span) % self.levels[level]]
+        timers = list(bucket.items())
+        bucket.clear()
+        for key, (expires, payload) in timers:
+            self._place(key, expires, payload)
+
+    def advance(self, now=None):
+        """Продвинуть колесо до момента now. Возвращает [(key, payload)] сработавших таймеров"""
+        target = self._to_tick(time.time() if now is None else now)
+        fired = []
+
+        while self.current_tick < target:
+            self.current_tick += 1
+
+            # Начало часа: подтягиваем дальние таймеры, затем раскладываем старшие уровни
+            if self._overflow and self.current_tick % self._spans[-1] == 0:
+                timers = list(self._overflow.items())
+                self._overflow.clear()
+                for key, (expires, payload) in timers:
+                    self._place(key, expires, payload)
+            for level in range(len(self.levels) - 1, 0, -1):
+                if self.current_tick % self._spans[level] == 0:
+                    self._cascade(level)
+
+            bucket = self._wheels[0][self.current_tick % self.levels[0]]
+            if bucket:
+                for key, (expires, payload) in bucket.items():
+                    del self._timers[key]
+                    fired.append((key, payload))
+                bucket.clear()
+
+        return fired